@@ -0,0 +1,103 @@
+"""
+Model fields supporting compact storage of gradebook summaries
+"""
+import base64
+import hashlib
+import zlib
+from functools import lru_cache
+
+from django.apps import apps
+from django.conf import settings
+from django.db import models
+
+COMPRESSED_TEXT_PREFIX = 'zlib:'
+GRADING_POLICY_REFERENCE_PREFIX = 'policy:'
+
+
+def is_compact_storage_enabled():
+    """
+    Compact storage is opt-in through the GRADEBOOK_COMPACT_STORAGE setting
+    """
+    return getattr(settings, 'GRADEBOOK_COMPACT_STORAGE', False)
+
+
+def compress_text(value):
+    return COMPRESSED_TEXT_PREFIX + base64.b64encode(zlib.compress(value.encode('utf-8'))).decode('ascii')
+
+
+def decompress_text(value):
+    if isinstance(value, str) and value.startswith(COMPRESSED_TEXT_PREFIX):
+        return zlib.decompress(base64.b64decode(value[len(COMPRESSED_TEXT_PREFIX):])).decode('utf-8')
+    return value
+
+
+def store_grading_policy(policy):
+    """
+    Saves the policy in the content-addressed policy table and returns its digest
+    """
+    digest = hashlib.sha1(policy.encode('utf-8')).hexdigest()
+    apps.get_model('gradebook', 'GradebookGradingPolicy').objects.get_or_create(
+        digest=digest,
+        defaults={'policy': policy},
+    )
+    return digest
+
+
+def prepare_grading_policy(policy):
+    """
+    Returns the value to write for a policy: in compact storage mode the policy is
+    saved in the shared policy table and a reference to it is returned
+    """
+    if policy and is_compact_storage_enabled() and not policy.startswith(GRADING_POLICY_REFERENCE_PREFIX):
+        return GRADING_POLICY_REFERENCE_PREFIX + store_grading_policy(policy)
+    return policy
+
+
+@lru_cache(maxsize=256)
+def load_grading_policy(digest):
+    """
+    Returns the policy stored under the digest; policies never change once stored
+    """
+    return apps.get_model('gradebook', 'GradebookGradingPolicy').objects.get(digest=digest).policy
+
+
+class CompressedTextField(models.TextField):
+    """
+    TextField whose values are written zlib-compressed (base64-encoded behind a prefix)
+    in compact storage mode.  Values are decompressed when loaded, so rows written in
+    either mode read back as the original text.
+    """
+
+    def from_db_value(self, value, expression, connection):  # pylint: disable=unused-argument
+        return decompress_text(value)
+
+    def to_python(self, value):
+        return decompress_text(super().to_python(value))
+
+    def get_prep_value(self, value):
+        value = super().get_prep_value(value)
+        if value and is_compact_storage_enabled() and not value.startswith(COMPRESSED_TEXT_PREFIX):
+            return compress_text(value)
+        return value
+
+
+class GradingPolicyField(models.TextField):
+    """
+    TextField which, in compact storage mode, moves the policy into the shared
+    GradebookGradingPolicy table and stores only a reference to it.  References are
+    resolved when loaded, so rows written in either mode read back as the policy text.
+    The policy is moved on save and bulk_create only; update and bulk_update callers
+    pass their values through prepare_grading_policy.
+    """
+
+    def from_db_value(self, value, expression, connection):  # pylint: disable=unused-argument
+        return self.to_python(value)
+
+    def to_python(self, value):
+        value = super().to_python(value)
+        if isinstance(value, str) and value.startswith(GRADING_POLICY_REFERENCE_PREFIX):
+            return load_grading_policy(value[len(GRADING_POLICY_REFERENCE_PREFIX):])
+        return value
+
+    def pre_save(self, model_instance, add):
+        return prepare_grading_policy(super().pre_save(model_instance, add))
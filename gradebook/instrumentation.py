@@ -0,0 +1,207 @@
+"""
+Optional per-stage timing of the gradebook calculation hot path.  Stages are timed and
+their database queries counted only when GRADEBOOK_INSTRUMENTATION_SINK names a sink:
+'logging', 'memory', 'statsd' or the dotted path of a class with a record() method.
+"""
+import logging
+import socket
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection
+from django.utils.module_loading import import_string
+
+log = logging.getLogger(__name__)
+
+
+class LoggingSink:
+    """
+    Logs every stage measurement
+    """
+
+    def record(self, stage_name, duration, query_count):
+        log.info("Gradebook stage %s: %.2fms, %d queries", stage_name, duration * 1000, query_count)
+
+
+class InMemorySink:
+    """
+    Aggregates stage measurements in process for summaries
+    """
+
+    def __init__(self):
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage_name, duration, query_count):
+        with self._lock:
+            stats = self._stages.setdefault(stage_name, {'count': 0, 'duration': 0.0, 'max_duration': 0.0, 'queries': 0})
+            stats['count'] += 1
+            stats['duration'] += duration
+            stats['max_duration'] = max(stats['max_duration'], duration)
+            stats['queries'] += query_count
+
+    def summary(self):
+        """
+        Returns the call count, total, mean and maximum duration in milliseconds and the
+        query count of every stage
+        """
+        with self._lock:
+            return {
+                stage_name: {
+                    'count': stats['count'],
+                    'total_ms': stats['duration'] * 1000,
+                    'mean_ms': stats['duration'] * 1000 / stats['count'],
+                    'max_ms': stats['max_duration'] * 1000,
+                    'queries': stats['queries'],
+                }
+                for stage_name, stats in self._stages.items()
+            }
+
+    def reset(self):
+        with self._lock:
+            self._stages.clear()
+
+
+class StatsdSink:
+    """
+    Sends stage durations as statsd timers and query counts as counters over UDP to
+    GRADEBOOK_STATSD_HOST:GRADEBOOK_STATSD_PORT
+    """
+
+    def __init__(self):
+        self.address = (
+            getattr(settings, 'GRADEBOOK_STATSD_HOST', 'localhost'),
+            getattr(settings, 'GRADEBOOK_STATSD_PORT', 8125),
+        )
+        self.prefix = getattr(settings, 'GRADEBOOK_STATSD_PREFIX', 'gradebook')
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def record(self, stage_name, duration, query_count):
+        metric = '{}.{}'.format(self.prefix, stage_name)
+        payload = '{0}.duration:{1:.3f}|ms\n{0}.queries:{2}|c'.format(metric, duration * 1000, query_count)
+        try:
+            self._socket.sendto(payload.encode('utf-8'), self.address)
+        except OSError:
+            pass
+
+
+SINKS = {
+    'logging': LoggingSink,
+    'memory': InMemorySink,
+    'statsd': StatsdSink,
+}
+_sinks = {}
+
+
+def get_sink():
+    """
+    Returns the configured sink, None while instrumentation is disabled
+    """
+    sink_name = getattr(settings, 'GRADEBOOK_INSTRUMENTATION_SINK', None)
+    if not sink_name:
+        return None
+    sink = _sinks.get(sink_name)
+    if sink is None:
+        sink = _sinks.setdefault(sink_name, (SINKS.get(sink_name) or import_string(sink_name))())
+    return sink
+
+
+class _QueryCounter:
+    """
+    Database execute wrapper counting the statements run inside a stage
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class _NullStage:
+    """
+    Stage used while instrumentation is disabled
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_STAGE = _NullStage()
+
+
+@contextmanager
+def _measure(sink, stage_name):
+    query_counter = _QueryCounter()
+    started = time.perf_counter()
+    try:
+        with connection.execute_wrapper(query_counter):
+            yield
+    finally:
+        sink.record(stage_name, time.perf_counter() - started, query_counter.count)
+
+
+def stage(stage_name):
+    """
+    Returns a context manager recording the duration and query count of the code it wraps
+    """
+    sink = get_sink()
+    if sink is None:
+        return NULL_STAGE
+    return _measure(sink, stage_name)
+
+
+def get_summary():
+    """
+    Returns the aggregated stage measurements of sinks keeping them, otherwise None
+    """
+    sink = get_sink()
+    return sink.summary() if hasattr(sink, 'summary') else None
+
+
+def pop_summary():
+    """
+    Returns the aggregated stage measurements like get_summary, then starts over
+    """
+    sink = get_sink()
+    if not hasattr(sink, 'summary'):
+        return None
+    summary = sink.summary()
+    sink.reset()
+    return summary
+
+
+def merge_summaries(summaries):
+    """
+    Combines stage summaries, e.g. of several worker processes, into one
+    """
+    merged = {}
+    for summary in summaries:
+        for stage_name, stats in (summary or {}).items():
+            merged_stats = merged.setdefault(stage_name, {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'queries': 0})
+            merged_stats['count'] += stats['count']
+            merged_stats['total_ms'] += stats['total_ms']
+            merged_stats['max_ms'] = max(merged_stats['max_ms'], stats['max_ms'])
+            merged_stats['queries'] += stats['queries']
+    for merged_stats in merged.values():
+        merged_stats['mean_ms'] = merged_stats['total_ms'] / merged_stats['count']
+    return merged
+
+
+def log_summary(logger, summary=None):
+    """
+    Logs aggregated stage measurements, by default those kept by the sink
+    """
+    if summary is None:
+        summary = get_summary()
+    for stage_name, stats in sorted((summary or {}).items()):
+        logger.info(
+            "Gradebook stage %s: %d calls, %.1fms total, %.2fms mean, %.2fms max, %d queries",
+            stage_name, stats['count'], stats['total_ms'], stats['mean_ms'], stats['max_ms'], stats['queries']
+        )
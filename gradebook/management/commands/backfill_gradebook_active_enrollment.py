@@ -0,0 +1,71 @@
+"""
+Command to backfill the denormalized active enrollment flag of gradebook entries
+./manage.py lms backfill_gradebook_active_enrollment --settings=aws
+./manage.py lms backfill_gradebook_active_enrollment -c {course_id} --settings=aws
+"""
+import logging
+
+from django.core.management import BaseCommand
+from django.db import transaction
+
+from gradebook.models import StudentGradebook
+from gradebook.utils import finish_bulk_gradebook_update
+from opaque_keys.edx.keys import CourseKey
+
+log = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """
+    Recomputes StudentGradebook.is_active_enrollment from the user and enrollment tables
+    """
+    help = "Command to backfill the active enrollment flag of gradebook entries"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "-c",
+            "--course_id",
+            dest="course_id",
+            help="course id to backfill, defaults to every course with gradebook entries",
+            metavar="any/course/id"
+        )
+        parser.add_argument(
+            "--chunk-size",
+            dest="chunk_size",
+            type=int,
+            default=1000,
+            help="number of gradebook ids updated per statement",
+        )
+
+    def handle(self, *args, **options):
+
+        course_id = options.get('course_id')
+        chunk_size = options.get('chunk_size')
+
+        if course_id:
+            course_keys = [CourseKey.from_string(course_id)]
+        else:
+            course_keys = StudentGradebook.objects.values_list('course_id', flat=True).distinct()
+
+        for course_key in course_keys:
+            rows_changed = self._backfill(StudentGradebook.objects.filter(course_id=course_key), chunk_size)
+            log.info("%d gradebook entries changed in Course %s", rows_changed, course_key)
+            if rows_changed:
+                finish_bulk_gradebook_update(course_key)
+
+    def _backfill(self, queryset, chunk_size):
+        """
+        Updates the flag of every entry with a mismatching value, one id range per transaction
+        """
+        rows_changed = 0
+        last_id = 0
+        while True:
+            ids = list(queryset.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:chunk_size])
+            if not ids:
+                break
+            with transaction.atomic():
+                rows_changed += queryset.filter(id__gte=ids[0], id__lte=ids[-1]).exclude(
+                    is_active_enrollment=StudentGradebook.active_enrollment_expression()
+                ).update(is_active_enrollment=StudentGradebook.active_enrollment_expression())
+            last_id = ids[-1]
+        return rows_changed
@@ -0,0 +1,104 @@
+"""
+Command to compare the encode and decode throughput of gradebook summaries
+./manage.py lms benchmark_gradebook_json --settings=aws
+./manage.py lms benchmark_gradebook_json --chapters 20 --sections 10 --iterations 2000 --settings=aws
+"""
+import json
+import timeit
+from datetime import datetime
+
+from django.core.management import BaseCommand
+from pytz import utc
+
+from gradebook.models import StudentGradebook
+from gradebook.utils import encode_datetime, get_json_data
+from xmodule.modulestore import EdxJSONEncoder
+
+
+def build_progress_summary(chapters, sections, encode_datetimes=True):
+    """
+    Returns a progress summary of attempted sections shaped like the output of
+    make_courseware_summary, with raw due and first attempted datetimes, as before they
+    were encoded up front, when `encode_datetimes` is False
+    """
+    due = datetime(2030, 1, 1, tzinfo=utc)
+    first_attempted = datetime(2029, 6, 1, 12, 30, tzinfo=utc)
+    if encode_datetimes:
+        due, first_attempted = encode_datetime(due), encode_datetime(first_attempted)
+    return [{
+        'url_name': 'chapter_{}'.format(chapter),
+        'display_name': 'Chapter {}'.format(chapter),
+        'sections': [{
+            'location': 'block-v1:Org+Course+Run+type@sequential+block@s{}_{}'.format(chapter, section),
+            'display_name': 'Section {}'.format(section),
+            'url_name': 's{}_{}'.format(chapter, section),
+            'due': due,
+            'graded': True,
+            'format': 'Homework',
+            'section_total': [1.0, 2.0, True, first_attempted],
+            'graded_total': [1.0, 2.0, True, first_attempted],
+        } for section in range(sections)],
+    } for chapter in range(chapters)]
+
+
+class Command(BaseCommand):
+    """
+    Times encoding a progress summary with EdxJSONEncoder against get_json_data, and decoding
+    it with json.loads on every access against the memoized progress_summary_data
+    """
+    help = "Command to benchmark gradebook summary encoding and decoding"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chapters",
+            dest="chapters",
+            type=int,
+            default=10,
+            help="number of chapters in the progress summary",
+        )
+        parser.add_argument(
+            "--sections",
+            dest="sections",
+            type=int,
+            default=8,
+            help="number of sections per chapter",
+        )
+        parser.add_argument(
+            "--iterations",
+            dest="iterations",
+            type=int,
+            default=1000,
+            help="number of timed runs of every operation",
+        )
+
+    def handle(self, *args, **options):
+
+        iterations = options.get('iterations')
+        raw_summary = build_progress_summary(options.get('chapters'), options.get('sections'), encode_datetimes=False)
+        summary = build_progress_summary(options.get('chapters'), options.get('sections'))
+        progress_summary = get_json_data(summary)
+        gradebook_entry = StudentGradebook(progress_summary=progress_summary)
+
+        def decode_memoized():
+            for __ in range(10):
+                gradebook_entry.progress_summary_data  # pylint: disable=pointless-statement
+
+        def decode_every_access():
+            for __ in range(10):
+                json.loads(gradebook_entry.progress_summary)
+
+        operations = {
+            'encode_edx_json_encoder': lambda: json.dumps(raw_summary, cls=EdxJSONEncoder),
+            'encode_get_json_data': lambda: get_json_data(summary),
+            'decode_10_accesses_json_loads': decode_every_access,
+            'decode_10_accesses_memoized': decode_memoized,
+        }
+        report = {
+            'summary_size': len(progress_summary),
+            'iterations': iterations,
+            'operations_per_second': {
+                name: iterations / timeit.timeit(operation, number=iterations)
+                for name, operation in operations.items()
+            },
+        }
+        self.stdout.write(json.dumps(report, indent=2, sort_keys=True))
@@ -0,0 +1,182 @@
+"""
+Command to benchmark the gradebook query methods on synthetic courses of several sizes
+./manage.py lms benchmark_gradebook_queries --settings=aws
+./manage.py lms benchmark_gradebook_queries --sizes 1000,10000 --keep --output baseline.json --settings=aws
+./manage.py lms benchmark_gradebook_queries --sizes 1000,10000 --compare baseline.json --settings=aws
+"""
+import json
+import logging
+
+from django.core.management import BaseCommand, CommandError
+from django.db import connection
+from django.db.migrations.recorder import MigrationRecorder
+
+from gradebook.management.commands.explain_gradebook_queries import time_query
+from gradebook.management.synthetic import (create_synthetic_course,
+                                            delete_synthetic_course,
+                                            get_synthetic_course_key,
+                                            get_synthetic_filters)
+from gradebook.models import StudentGradebook
+
+log = logging.getLogger(__name__)
+
+
+def get_benchmarks(course_key, filters):
+    """
+    Returns the benchmarked query methods of a course, called with the given filters
+    """
+    # rank a learner from the middle of the filtered leaderboard
+    ranked_user_ids = StudentGradebook._build_queryset(course_key, **filters).order_by(  # pylint: disable=protected-access
+        '-grade', 'modified'
+    ).values_list('user_id', flat=True)
+    ranked_count = ranked_user_ids.count()
+    median_user_id = ranked_user_ids[ranked_count // 2] if ranked_count else None
+
+    return {
+        'generate_leaderboard': lambda: list(StudentGradebook.generate_leaderboard(
+            course_key, count=10, **filters
+        )['queryset']),
+        'get_user_position': lambda: StudentGradebook.get_user_position(
+            course_key, user_id=median_user_id, **filters
+        ),
+        'course_grade_avg': lambda: StudentGradebook.course_grade_avg(course_key, **filters),
+        'get_num_users_completed': lambda: StudentGradebook.get_num_users_completed(course_key, **filters),
+        'get_passed_users_gradebook': lambda: StudentGradebook.get_passed_users_gradebook(
+            course_key, **filters
+        ).count(),
+    }
+
+
+def compare_reports(baseline, report, threshold):
+    """
+    Returns a line for every benchmark whose median is more than `threshold` times slower
+    than in the baseline, or which issues more queries
+    """
+    regressions = []
+    for size, scenarios in report['results'].items():
+        for scenario, benchmarks in scenarios.items():
+            for name, result in benchmarks.items():
+                previous = baseline['results'].get(size, {}).get(scenario, {}).get(name)
+                if previous is None:
+                    continue
+                if result['median'] > previous['median'] * threshold:
+                    regressions.append('{} learners, {}, {}: median {:.4f}s was {:.4f}s'.format(
+                        size, scenario, name, result['median'], previous['median']
+                    ))
+                if result['query_count'] > previous['query_count']:
+                    regressions.append('{} learners, {}, {}: {} queries were {}'.format(
+                        size, scenario, name, result['query_count'], previous['query_count']
+                    ))
+    return regressions
+
+
+class Command(BaseCommand):
+    """
+    Times the StudentGradebook leaderboard, position, average, completion and pass queries
+    on synthetic courses, unfiltered and filtered by group, organization, cohort and
+    exclusions, and writes the timings and query counts as a JSON report
+    """
+    help = "Command to benchmark gradebook queries on synthetic courses"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes",
+            dest="sizes",
+            default="1000,10000,100000",
+            help="comma separated numbers of learners of the synthetic courses",
+        )
+        parser.add_argument(
+            "--repeat",
+            dest="repeat",
+            type=int,
+            default=5,
+            help="number of timed runs of every query",
+        )
+        parser.add_argument(
+            "--keep",
+            action="store_true",
+            dest="keep",
+            default=False,
+            help="keep the synthetic courses for a later run",
+        )
+        parser.add_argument(
+            "--output",
+            dest="output",
+            help="file to write the JSON report to, defaults to stdout",
+        )
+        parser.add_argument(
+            "--compare",
+            dest="compare",
+            help="JSON report of an earlier run to check for regressions against",
+        )
+        parser.add_argument(
+            "--threshold",
+            dest="threshold",
+            type=float,
+            default=1.5,
+            help="slowdown factor of a median reported as a regression",
+        )
+
+    def handle(self, *args, **options):
+
+        try:
+            sizes = [int(size) for size in options.get('sizes').split(',')]
+        except ValueError:
+            raise CommandError('--sizes must be comma separated numbers')
+
+        applied_migrations = sorted(
+            name for app, name in MigrationRecorder(connection).applied_migrations() if app == 'gradebook'
+        )
+        report = {
+            'database': connection.vendor,
+            'gradebook_migration': applied_migrations[-1] if applied_migrations else None,
+            'repeat': options.get('repeat'),
+            'results': {},
+        }
+        for size in sizes:
+            course_key = get_synthetic_course_key(size)
+            if not StudentGradebook.objects.filter(course_id=course_key).exists():
+                log.info("Creating synthetic course %s with %d learners", course_key, size)
+                create_synthetic_course(course_key, size)
+            try:
+                report['results'][str(size)] = self._benchmark(course_key, options.get('repeat'))
+            finally:
+                if not options.get('keep'):
+                    delete_synthetic_course(course_key)
+
+        output = json.dumps(report, indent=2, sort_keys=True)
+        if options.get('output'):
+            with open(options.get('output'), 'w') as output_file:
+                output_file.write(output)
+        else:
+            self.stdout.write(output)
+
+        if options.get('compare'):
+            with open(options.get('compare')) as baseline_file:
+                regressions = compare_reports(json.load(baseline_file), report, options.get('threshold'))
+            for regression in regressions:
+                log.info("Regression: %s", regression)
+            log.info("%d regressions against %s", len(regressions), options.get('compare'))
+
+    def _benchmark(self, course_key, repeat):
+        """
+        Returns the results of every benchmark in every filter scenario of a course
+        """
+        filters = get_synthetic_filters(course_key)
+        scenarios = {
+            'course': {'exclude_users': filters['exclude_users']},
+            'group': {'exclude_users': filters['exclude_users'], 'group_ids': filters['group_ids']},
+            'organization': {'exclude_users': filters['exclude_users'], 'org_ids': filters['org_ids']},
+            'cohort': {'exclude_users': filters['exclude_users'], 'cohort_user_ids': filters['cohort_user_ids']},
+        }
+        results = {}
+        for scenario, scenario_filters in scenarios.items():
+            results[scenario] = {}
+            for name, run_query in get_benchmarks(course_key, scenario_filters).items():
+                results[scenario][name] = time_query(run_query, repeat, explain=False)
+                log.info(
+                    "%s, %s, %s: median %.4fs, %d queries",
+                    course_key, scenario, name, results[scenario][name]['median'],
+                    results[scenario][name]['query_count']
+                )
+        return results
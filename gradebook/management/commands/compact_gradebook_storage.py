@@ -0,0 +1,117 @@
+"""
+Command to rewrite gradebook summaries in compact storage and report the savings
+./manage.py lms compact_gradebook_storage --settings=aws
+./manage.py lms compact_gradebook_storage -c {course_id} --report-only --settings=aws
+"""
+import logging
+
+from django.core.management import BaseCommand, CommandError
+from django.db.models import Count, Sum
+from django.db.models.functions import Length
+
+from gradebook.fields import (is_compact_storage_enabled,
+                             prepare_grading_policy)
+from gradebook.models import (GradebookGradingPolicy, StudentGradebook,
+                              StudentGradebookHistory)
+from opaque_keys.edx.keys import CourseKey
+
+log = logging.getLogger(__name__)
+
+SUMMARY_FIELDS = ('progress_summary', 'grade_summary', 'grading_policy')
+
+
+class Command(BaseCommand):
+    """
+    Rewrites existing gradebook and history rows in compact storage, then reports
+    stored versus original summary sizes per table
+    """
+    help = "Command to compact gradebook summary storage and report the savings"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "-c",
+            "--course_id",
+            dest="course_id",
+            help="course id to compact, defaults to every course",
+            metavar="any/course/id"
+        )
+        parser.add_argument(
+            "--report-only",
+            action="store_true",
+            dest="report_only",
+            default=False,
+            help="only report storage sizes, without rewriting any row",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            dest="chunk_size",
+            type=int,
+            default=500,
+            help="number of rows rewritten or measured per query",
+        )
+
+    def handle(self, *args, **options):
+
+        course_id = options.get('course_id')
+        chunk_size = options.get('chunk_size')
+        if not options.get('report_only') and not is_compact_storage_enabled():
+            raise CommandError('Enable GRADEBOOK_COMPACT_STORAGE before compacting, or pass --report-only')
+
+        for model in (StudentGradebook, StudentGradebookHistory):
+            queryset = model.objects.all()
+            if course_id:
+                queryset = queryset.filter(course_id=CourseKey.from_string(course_id))
+
+            if not options.get('report_only'):
+                rows_compacted = self._compact(model, queryset, chunk_size)
+                log.info("%d %s rows rewritten in compact storage", rows_compacted, model.__name__)
+
+            row_count, stored_size, original_size = self._measure(queryset, chunk_size)
+            log.info(
+                "%s: %d rows, %d characters stored for %d characters of summaries (%.1f%% saved)",
+                model.__name__, row_count, stored_size, original_size,
+                100.0 * (original_size - stored_size) / original_size if original_size else 0.0
+            )
+
+        policies = GradebookGradingPolicy.objects.aggregate(count=Count('digest'), size=Sum(Length('policy')))
+        log.info(
+            "%s: %d shared policies, %d characters stored",
+            GradebookGradingPolicy.__name__, policies['count'], policies['size'] or 0
+        )
+
+    def _compact(self, model, queryset, chunk_size):
+        """
+        Rewrites the summaries of every row, which stores them in the current storage mode
+        """
+        rows_compacted = 0
+        last_id = 0
+        while True:
+            rows = list(queryset.filter(id__gt=last_id).order_by('id').only('id', *SUMMARY_FIELDS)[:chunk_size])
+            if not rows:
+                break
+            # bulk_update skips the field pre_save hooks, so policies are prepared here
+            prepared_policies = {}
+            for row in rows:
+                if row.grading_policy not in prepared_policies:
+                    prepared_policies[row.grading_policy] = prepare_grading_policy(row.grading_policy)
+                row.grading_policy = prepared_policies[row.grading_policy]
+            model.objects.bulk_update(rows, SUMMARY_FIELDS)
+            rows_compacted += len(rows)
+            last_id = rows[-1].id
+        return rows_compacted
+
+    def _measure(self, queryset, chunk_size):
+        """
+        Returns the row count, the stored size of the summary columns and the size
+        of the summaries once decompressed and resolved
+        """
+        stored = queryset.aggregate(
+            row_count=Count('id'),
+            **{field: Sum(Length(field)) for field in SUMMARY_FIELDS}
+        )
+        stored_size = sum(stored[field] or 0 for field in SUMMARY_FIELDS)
+
+        original_size = 0
+        for summaries in queryset.values_list(*SUMMARY_FIELDS).iterator(chunk_size=chunk_size):
+            original_size += sum(len(summary) for summary in summaries if summary)
+        return stored['row_count'], stored_size, original_size
@@ -0,0 +1,176 @@
+"""
+Command to capture query plans and timings of the gradebook leaderboard and pass queries.
+Run it before and after applying a migration to compare plans on the same data.
+./manage.py lms explain_gradebook_queries --learners 100000 --keep --output before.json --settings=aws
+./manage.py lms migrate gradebook --settings=aws
+./manage.py lms explain_gradebook_queries --learners 100000 --output after.json --settings=aws
+"""
+import json
+import logging
+import statistics
+import time
+
+from django.core.management import BaseCommand
+from django.db import connection
+from django.db.migrations.recorder import MigrationRecorder
+from django.test.utils import CaptureQueriesContext
+
+from edx_solutions_api_integration.utils import get_aggregate_exclusion_user_ids
+from gradebook.management.synthetic import (create_synthetic_course,
+                                            delete_synthetic_course,
+                                            get_synthetic_course_key)
+from gradebook.models import StudentGradebook
+from opaque_keys.edx.keys import CourseKey
+
+log = logging.getLogger(__name__)
+
+EXPLAIN_PREFIXES = {
+    'sqlite': 'EXPLAIN QUERY PLAN ',
+}
+
+
+def get_query_plans(captured_queries):
+    """
+    Returns the EXPLAIN output of every captured SELECT statement
+    """
+    plans = []
+    with connection.cursor() as cursor:
+        for query in captured_queries:
+            sql = query['sql']
+            if not sql.lstrip().upper().startswith('SELECT'):
+                continue
+            cursor.execute(EXPLAIN_PREFIXES.get(connection.vendor, 'EXPLAIN ') + sql)
+            plans.append({
+                'sql': sql,
+                'plan': [[str(column) for column in row] for row in cursor.fetchall()],
+            })
+    return plans
+
+
+def time_query(run_query, repeat, explain=True):
+    """
+    Runs the query once to warm up, then returns its timings in seconds, the number of
+    statements of a single run and, with `explain`, their query plans
+    """
+    run_query()
+    timings = []
+    for __ in range(repeat):
+        started = time.perf_counter()
+        run_query()
+        timings.append(time.perf_counter() - started)
+
+    with CaptureQueriesContext(connection) as captured:
+        run_query()
+    result = {
+        'timings': timings,
+        'median': statistics.median(timings),
+        'query_count': len(captured.captured_queries),
+    }
+    if explain:
+        result['plans'] = get_query_plans(captured.captured_queries)
+    return result
+
+
+class Command(BaseCommand):
+    """
+    Captures EXPLAIN output and timings of the StudentGradebook leaderboard and pass queries
+    """
+    help = "Command to capture query plans and timings of gradebook queries"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "-c",
+            "--course_id",
+            dest="course_id",
+            help="existing course id to explain, instead of a synthetic course",
+            metavar="any/course/id"
+        )
+        parser.add_argument(
+            "--learners",
+            dest="learners",
+            type=int,
+            default=100000,
+            help="number of learners in the synthetic course",
+        )
+        parser.add_argument(
+            "--repeat",
+            dest="repeat",
+            type=int,
+            default=5,
+            help="number of timed runs of every query",
+        )
+        parser.add_argument(
+            "--keep",
+            action="store_true",
+            dest="keep",
+            default=False,
+            help="keep the synthetic course for a later run",
+        )
+        parser.add_argument(
+            "--output",
+            dest="output",
+            help="file to write the JSON report to, defaults to stdout",
+        )
+
+    def handle(self, *args, **options):
+
+        course_id = options.get('course_id')
+        synthetic = not course_id
+        if synthetic:
+            course_key = get_synthetic_course_key(options.get('learners'))
+            if not StudentGradebook.objects.filter(course_id=course_key).exists():
+                log.info("Creating synthetic course %s with %d learners", course_key, options.get('learners'))
+                create_synthetic_course(course_key, options.get('learners'))
+        else:
+            course_key = CourseKey.from_string(course_id)
+
+        try:
+            report = self._explain(course_key, options.get('repeat'))
+        finally:
+            if synthetic and not options.get('keep'):
+                delete_synthetic_course(course_key)
+
+        output = json.dumps(report, indent=2, sort_keys=True)
+        if options.get('output'):
+            with open(options.get('output'), 'w') as output_file:
+                output_file.write(output)
+        else:
+            self.stdout.write(output)
+
+    def _explain(self, course_key, repeat):
+        """
+        Returns the report of every explained query
+        """
+        exclude_users = get_aggregate_exclusion_user_ids(course_key)
+        gradebook_entries = StudentGradebook.objects.filter(course_id=course_key)
+        row_count = gradebook_entries.count()
+        # rank a learner from the middle of the leaderboard
+        median_user_id = gradebook_entries.order_by('-grade', 'modified').values_list(
+            'user_id', flat=True
+        )[row_count // 2] if row_count else None
+
+        queries = {
+            'generate_leaderboard': lambda: list(StudentGradebook.generate_leaderboard(
+                course_key, exclude_users=exclude_users, count=10
+            )['queryset']),
+            'get_user_position': lambda: StudentGradebook.get_user_position(
+                course_key, user_id=median_user_id, exclude_users=exclude_users
+            ),
+            'get_num_users_completed': lambda: StudentGradebook.get_num_users_completed(
+                course_key, exclude_users=exclude_users
+            ),
+            'get_passed_users_gradebook': lambda: StudentGradebook.get_passed_users_gradebook(
+                course_key, exclude_users=exclude_users
+            ).count(),
+        }
+
+        applied_migrations = sorted(
+            name for app, name in MigrationRecorder(connection).applied_migrations() if app == 'gradebook'
+        )
+        return {
+            'database': connection.vendor,
+            'gradebook_migration': applied_migrations[-1] if applied_migrations else None,
+            'course_id': str(course_key),
+            'gradebook_rows': row_count,
+            'queries': {name: time_query(run_query, repeat) for name, run_query in queries.items()},
+        }
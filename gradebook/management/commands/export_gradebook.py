@@ -0,0 +1,166 @@
+"""
+Command to export the gradebook of a course as CSV or JSON Lines
+./manage.py lms export_gradebook -c {course_id} --output gradebook.csv --settings=aws
+./manage.py lms export_gradebook -c {course_id} --format jsonl --columns username,grade,progress_summary --settings=aws
+./manage.py lms export_gradebook -c {course_id} --expand-progress --output gradebook.csv --settings=aws
+"""
+import csv
+import json
+import logging
+
+from django.core.management import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+
+from gradebook.models import StudentGradebook
+from opaque_keys.edx.keys import CourseKey
+
+log = logging.getLogger(__name__)
+
+# exported column name -> StudentGradebook lookup
+EXPORT_COLUMNS = {
+    'user_id': 'user_id',
+    'username': 'user__username',
+    'email': 'user__email',
+    'grade': 'grade',
+    'proforma_grade': 'proforma_grade',
+    'is_passed': 'is_passed',
+    'modified': 'modified',
+    'progress_summary': 'progress_summary',
+    'grade_summary': 'grade_summary',
+    'grading_policy': 'grading_policy',
+}
+DEFAULT_COLUMNS = 'user_id,username,email,grade,proforma_grade,is_passed,modified'
+
+
+def get_progress_columns(progress_summary):
+    """
+    Returns the expanded column names of the sections of a progress summary, in course order
+    """
+    columns = []
+    for chapter in json.loads(progress_summary or '[]'):
+        for section in chapter['sections']:
+            columns.extend([
+                'progress:{}:earned'.format(section['url_name']),
+                'progress:{}:possible'.format(section['url_name']),
+            ])
+    return columns
+
+
+def expand_progress_summary(progress_summary):
+    """
+    Returns the graded earned and possible scores of every section of a progress summary
+    """
+    expanded = {}
+    for chapter in json.loads(progress_summary or '[]'):
+        for section in chapter['sections']:
+            earned, possible = section['graded_total'][:2]
+            expanded['progress:{}:earned'.format(section['url_name'])] = earned
+            expanded['progress:{}:possible'.format(section['url_name'])] = possible
+    return expanded
+
+
+class Command(BaseCommand):
+    """
+    Streams the StudentGradebook entries of a course, reading them in id-ordered chunks so
+    that memory use does not grow with the size of the course
+    """
+    help = "Command to export the gradebook of a course as CSV or JSON Lines"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "-c",
+            "--course_id",
+            dest="course_id",
+            help="course id to export",
+            metavar="any/course/id"
+        )
+        parser.add_argument(
+            "--format",
+            dest="format",
+            choices=['csv', 'jsonl'],
+            default='csv',
+            help="output format",
+        )
+        parser.add_argument(
+            "--columns",
+            dest="columns",
+            default=DEFAULT_COLUMNS,
+            help="comma separated columns to export, out of {}".format(', '.join(EXPORT_COLUMNS)),
+        )
+        parser.add_argument(
+            "--expand-progress",
+            action="store_true",
+            dest="expand_progress",
+            default=False,
+            help="add earned and possible graded scores of every section from progress_summary",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            dest="chunk_size",
+            type=int,
+            default=2000,
+            help="number of entries read per query",
+        )
+        parser.add_argument(
+            "--output",
+            dest="output",
+            help="file to write the export to, defaults to stdout",
+        )
+
+    def handle(self, *args, **options):
+
+        course_id = options.get('course_id')
+        if not course_id:
+            raise CommandError('--course_id is required')
+        columns = [column.strip() for column in options.get('columns').split(',') if column.strip()]
+        unknown_columns = set(columns) - set(EXPORT_COLUMNS)
+        if unknown_columns:
+            raise CommandError('Unknown columns: {}'.format(', '.join(sorted(unknown_columns))))
+
+        queryset = StudentGradebook.objects.filter(course_id=CourseKey.from_string(course_id))
+        expand_progress = options.get('expand_progress')
+        fieldnames = list(columns)
+        if expand_progress:
+            # sections of the most recently graded entry, which follow the latest course structure
+            latest_progress_summary = queryset.exclude(progress_summary='').order_by('-modified').values_list(
+                'progress_summary', flat=True
+            ).first()
+            fieldnames.extend(get_progress_columns(latest_progress_summary))
+
+        output_file = open(options.get('output'), 'w', newline='') if options.get('output') else self.stdout
+        try:
+            if options.get('format') == 'csv':
+                writer = csv.DictWriter(output_file, fieldnames=fieldnames, extrasaction='ignore')
+                writer.writeheader()
+                write_row = writer.writerow
+            else:
+                def write_row(row):
+                    output_file.write(json.dumps(row, cls=DjangoJSONEncoder) + '\n')
+
+            rows_exported = 0
+            for row in self._stream_rows(queryset, columns, expand_progress, options.get('chunk_size')):
+                write_row(row)
+                rows_exported += 1
+        finally:
+            if output_file is not self.stdout:
+                output_file.close()
+        log.info("%d gradebook entries of Course %s exported", rows_exported, course_id)
+
+    def _stream_rows(self, queryset, columns, expand_progress, chunk_size):
+        """
+        Yields the exported dict of every entry, one keyset-paginated query per chunk
+        """
+        lookups = ['id'] + [EXPORT_COLUMNS[column] for column in columns]
+        if expand_progress:
+            lookups.append('progress_summary')
+        last_id = 0
+        while True:
+            rows = list(queryset.filter(id__gt=last_id).order_by('id').values_list(*lookups)[:chunk_size])
+            if not rows:
+                break
+            for values in rows:
+                row = dict(zip(columns, values[1:]))
+                if expand_progress:
+                    row.update(expand_progress_summary(values[-1]))
+                yield row
+            last_id = rows[-1][0]
@@ -0,0 +1,61 @@
+"""
+Command to rebuild or verify incrementally maintained course grade aggregates
+./manage.py lms rebuild_gradebook_aggregates -c {course_id} --settings=aws
+./manage.py lms rebuild_gradebook_aggregates -c {course_id} --check --settings=aws
+"""
+import logging
+
+from django.core.management import BaseCommand
+
+from gradebook.models import StudentGradebook, StudentGradebookCourseAggregate
+from opaque_keys.edx.keys import CourseKey
+
+log = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """
+    Rebuilds (or checks) course grade aggregates for one or all courses
+    """
+    help = "Command to rebuild or verify course grade aggregates"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "-c",
+            "--course_id",
+            dest="course_id",
+            help="course id to rebuild the aggregate for, defaults to every course with gradebook entries",
+            metavar="any/course/id"
+        )
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            dest="check",
+            default=False,
+            help="only report aggregates which drifted from the live gradebook",
+        )
+
+    def handle(self, *args, **options):
+
+        course_id = options.get('course_id')
+
+        if course_id:
+            course_keys = [CourseKey.from_string(course_id)]
+        else:
+            course_keys = StudentGradebook.objects.values_list('course_id', flat=True).distinct()
+
+        for course_key in course_keys:
+            if options.get('check'):
+                drift = StudentGradebookCourseAggregate.check_drift(course_key)
+                for field, (expected, stored) in sorted(drift.items()):
+                    log.info(
+                        "Aggregate drift in Course %s for %s: expected %s, stored %s",
+                        course_key, field, expected, stored
+                    )
+                log.info("%d drifted aggregate values found in Course %s", len(drift), course_key)
+            else:
+                course_aggregate = StudentGradebookCourseAggregate.rebuild(course_key)
+                log.info(
+                    "Aggregate rebuilt in Course %s: %d graded of %d enrolled users",
+                    course_key, course_aggregate.grade_count, course_aggregate.enrollment_count
+                )
@@ -0,0 +1,58 @@
+"""
+Command to rebuild or verify materialized leaderboard ranks
+./manage.py lms rebuild_gradebook_ranks -c {course_id} --settings=aws
+./manage.py lms rebuild_gradebook_ranks -c {course_id} --check --settings=aws
+"""
+import logging
+
+from django.core.management import BaseCommand
+
+from gradebook.models import StudentGradebook, StudentGradebookRank
+from opaque_keys.edx.keys import CourseKey
+
+log = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """
+    Rebuilds (or checks) materialized gradebook ranks for one or all courses
+    """
+    help = "Command to rebuild or verify materialized gradebook ranks"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "-c",
+            "--course_id",
+            dest="course_id",
+            help="course id to rebuild ranks for, defaults to every course with gradebook entries",
+            metavar="any/course/id"
+        )
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            dest="check",
+            default=False,
+            help="only report ranks which disagree with the live gradebook",
+        )
+
+    def handle(self, *args, **options):
+
+        course_id = options.get('course_id')
+
+        if course_id:
+            course_keys = [CourseKey.from_string(course_id)]
+        else:
+            course_keys = StudentGradebook.objects.values_list('course_id', flat=True).distinct()
+
+        for course_key in course_keys:
+            if options.get('check'):
+                discrepancies = StudentGradebookRank.check_consistency(course_key)
+                for user_id, expected_position, stored_position in discrepancies:
+                    log.info(
+                        "Rank mismatch in Course %s for User id %s: expected %s, stored %s",
+                        course_key, user_id, expected_position, stored_position
+                    )
+                log.info("%d rank mismatches found in Course %s", len(discrepancies), course_key)
+            else:
+                ranks_built = StudentGradebookRank.rebuild(course_key)
+                log.info("%d ranks rebuilt in Course %s", ranks_built, course_key)
@@ -1,13 +1,31 @@
 """
 Command to regrade users in a course
 ./manage.py lms regrade_course -c {course_id} --settings=aws
+./manage.py lms regrade_course -c {course_id} --workers 8 --settings=aws
+./manage.py lms regrade_course -c {course_id} --celery --resume --settings=aws
+./manage.py lms regrade_course -c {course_id} --workers 8 --bulk --settings=aws
+./manage.py lms regrade_course -c {course_id} --stale-only --dry-run --settings=aws
+./manage.py lms regrade_course -c {course_id} --since 2024-01-31T00:00:00Z --settings=aws
 """
+import json
 import logging
-from optparse import make_option
+import os
+import re
+import time
+from collections import deque
+from multiprocessing import Pool
 
-from django.core.management import BaseCommand
+from django import db
+from django.core.management import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 
-from gradebook.utils import generate_user_gradebook
+from gradebook import instrumentation
+from gradebook.tasks import regrade_course_chunk
+from gradebook.utils import (course_grading_cache, filter_stale_users,
+                             finish_bulk_gradebook_update,
+                             get_course_published_at, iter_keyset_chunks,
+                             regrade_users)
 from opaque_keys.edx.keys import CourseKey
 from student.models import CourseEnrollment
 from xmodule.modulestore.django import modulestore
@@ -15,6 +33,89 @@ from xmodule.modulestore.django import modulestore
 log = logging.getLogger(__name__)
 
 
+def get_failed_chunk_result(course_id, user_ids, error):
+    """
+    Returns the result of a chunk whose regrade failed as a whole, with every user failed
+    """
+    log.info("Failed to regrade chunk of %d users in course %s. Error: %s", len(user_ids), course_id, str(error))
+    return {'regraded': 0, 'failed': user_ids}
+
+
+def regrade_chunk(course_id, bulk, user_ids):
+    """
+    Regrades a chunk of users, used in the current process and as the worker function
+    of the process pool
+    """
+    try:
+        users_regraded, failed_user_ids = regrade_users(CourseKey.from_string(course_id), user_ids, bulk=bulk)
+    except Exception as ex:  # pylint: disable=broad-except
+        return user_ids, dict(get_failed_chunk_result(course_id, user_ids, ex), stages=instrumentation.pop_summary())
+    return user_ids, {'regraded': users_regraded, 'failed': failed_user_ids, 'stages': instrumentation.pop_summary()}
+
+
+class RegradeCheckpoint:
+    """
+    Progress of a course regrade appended to disk after every chunk, so that an
+    interrupted run can be resumed.  The file holds a header line naming the course,
+    then one JSON line per finished chunk with the ids of the users it regraded and of
+    those who failed; failed users are retried on resume.  Users who enroll later are
+    never taken for done, whatever their id.
+    """
+
+    def __init__(self, path, course_id):
+        self.path = path
+        self.course_id = course_id
+        self.done_user_ids = set()
+        self.failed_user_ids = set()
+        self._started = False
+
+    def load(self):
+        """
+        Loads a previously saved checkpoint, if there is one
+        """
+        if not os.path.exists(self.path):
+            return
+        with open(self.path) as checkpoint_file:
+            lines = checkpoint_file.read().splitlines()
+        header = json.loads(lines[0]) if lines else {}
+        if header.get('course_id') != self.course_id:
+            raise CommandError('Checkpoint {} belongs to course {}'.format(self.path, header.get('course_id')))
+        self._started = True
+        for line in lines[1:]:
+            try:
+                chunk = json.loads(line)
+            except ValueError:
+                # a line cut short by an interruption
+                continue
+            self._apply(chunk['done'], chunk['failed'])
+
+    def _apply(self, done_user_ids, failed_user_ids):
+        self.done_user_ids.update(done_user_ids)
+        self.done_user_ids.difference_update(failed_user_ids)
+        self.failed_user_ids.difference_update(done_user_ids)
+        self.failed_user_ids.update(failed_user_ids)
+
+    def is_done(self, user_id):
+        return user_id in self.done_user_ids
+
+    def record(self, user_ids, failed_user_ids):
+        """
+        Marks a chunk of users as processed and appends it to the checkpoint file
+        """
+        failed_user_ids = set(failed_user_ids)
+        done_user_ids = [user_id for user_id in user_ids if user_id not in failed_user_ids]
+        self._apply(done_user_ids, failed_user_ids)
+        if not self._started:
+            # a run that is not resumed replaces any earlier checkpoint
+            with open(self.path, 'w') as checkpoint_file:
+                checkpoint_file.write(json.dumps({'course_id': self.course_id}) + '\n')
+            self._started = True
+        with open(self.path, 'a') as checkpoint_file:
+            checkpoint_file.write(json.dumps({'done': done_user_ids, 'failed': sorted(failed_user_ids)}) + '\n')
+            checkpoint_file.flush()
+            os.fsync(checkpoint_file.fileno())
+
+
 class Command(BaseCommand):
     """
     Updates gradebook entries for the specified course
@@ -28,35 +129,222 @@ class Command(BaseCommand):
             dest="course_id",
             help="course id to regrade",
             metavar="any/course/id"
-        ),
-
+        )
+        parser.add_argument(
+            "--workers",
+            dest="workers",
+            type=int,
+            default=1,
+            help="number of processes to regrade with",
+        )
+        parser.add_argument(
+            "--celery",
+            action="store_true",
+            dest="celery",
+            default=False,
+            help="fan chunks out to celery workers instead of local processes; needs a celery result backend",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            dest="chunk_size",
+            type=int,
+            default=100,
+            help="number of users regraded per chunk",
+        )
+        parser.add_argument(
+            "--bulk",
+            action="store_true",
+            dest="bulk",
+            default=False,
+            help="write each chunk with batched upserts instead of saving every entry",
+        )
+        parser.add_argument(
+            "--checkpoint",
+            dest="checkpoint",
+            help="file to save progress to, defaults to a file named after the course in the working directory",
+        )
+        parser.add_argument(
+            "--resume",
+            action="store_true",
+            dest="resume",
+            default=False,
+            help="skip users already regraded according to the checkpoint",
+        )
+        parser.add_argument(
+            "--stale-only",
+            action="store_true",
+            dest="stale_only",
+            default=False,
+            help="only regrade users whose entry predates the last course publish or their latest scores",
+        )
+        parser.add_argument(
+            "--since",
+            dest="since",
+            help="like --stale-only, with entries written before this ISO 8601 time counted as stale",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            dest="dry_run",
+            default=False,
+            help="only log how many users would be regraded",
+        )
 
     def handle(self, *args, **options):
 
         course_id = options.get('course_id')
-
-        users_regraded = 0
+        bulk = options.get('bulk')
+        workers = options.get('workers')
+        chunk_size = options.get('chunk_size')
+        if workers < 1 or chunk_size < 1:
+            raise CommandError('--workers and --chunk-size must be positive')
 
         course_key = CourseKey.from_string(course_id)
+        checkpoint = RegradeCheckpoint(
+            options.get('checkpoint') or 'regrade_course.{}.checkpoint'.format(re.sub(r'[^\w.-]', '_', course_id)),
+            course_id,
+        )
+        if options.get('resume'):
+            checkpoint.load()
+
         users = CourseEnrollment.objects.users_enrolled_in(course_key)
-        course = modulestore().get_course(course_key, depth=None)
-
-        if course:
-            # For each user...
-            for user in users:
-                try:
-                    gradebook = generate_user_gradebook(course_key, user)
-                except Exception as ex:   # pylint: disable=broad-except
-                    log.info(
-                        "Failed to update gradeboo for user %s in course %s. Error: %s",
-                        user.id, course_key, ex.message
-                    )
-
-                users_regraded += 1
-                log.info(
-                    "Gradebook entry updated in Course %s for User id %s with grade: %s, proforma_grade: %s ",
-                    course.id, user.id, gradebook.grade, gradebook.proforma_grade
-                )
-        else:
-            log.info("Course with course id %s does not exist", course_id)
-        log.info("%d users regraded", users_regraded)
+        since = self._get_stale_since(course_key, options)
+        if since:
+            users = filter_stale_users(course_key, users, since)
+        if options.get('dry_run'):
+            users_total = 0
+            chunks_total = 0
+            for chunk in self._iter_chunks(users, chunk_size, checkpoint):
+                users_total += len(chunk)
+                chunks_total += 1
+            log.info(
+                "Regrade of Course %s would process %d users in %d chunks%s",
+                course_key, users_total, chunks_total, " (stale since {})".format(since) if since else ""
+            )
+            return
+
+        pool = None
+        if workers > 1 and not options.get('celery'):
+            # fork before this process opens any database or modulestore connection,
+            # so that every worker sets up connections of its own
+            db.connections.close_all()
+            pool = Pool(workers)
+
+        try:
+            course = modulestore().get_course(course_key, depth=None)
+            if not course:
+                log.info("Course with course id %s does not exist", course_id)
+                return
+
+            started = time.time()
+            users_total = self._count_users_to_regrade(users, checkpoint)
+            chunks = self._iter_chunks(users, chunk_size, checkpoint)
+            if options.get('celery'):
+                results = self._regrade_with_celery(course_id, bulk, chunks)
+            elif pool:
+                results = self._regrade_with_pool(pool, workers * 2, course_id, bulk, chunks)
+            else:
+                results = (regrade_chunk(course_id, bulk, chunk) for chunk in chunks)
+
+            self._collect_results(course_key, checkpoint, results, users_total, started)
+            if bulk:
+                finish_bulk_gradebook_update(course_key)
+        finally:
+            if pool:
+                pool.terminate()
+
+    def _get_stale_since(self, course_key, options):
+        """
+        Returns the time before which gradebook entries count as stale, None to regrade everyone
+        """
+        if options.get('since'):
+            since = parse_datetime(options.get('since'))
+            if since is None:
+                raise CommandError('--since must be an ISO 8601 date and time')
+            return since if timezone.is_aware(since) else timezone.make_aware(since, timezone.utc)
+        if options.get('stale_only'):
+            since = get_course_published_at(course_key)
+            if since is None:
+                raise CommandError('The last publish of Course {} is unknown, pass --since'.format(course_key))
+            return since
+        return None
+
+    def _iter_chunks(self, users, chunk_size, checkpoint):
+        """
+        Yields the ids of the users to regrade in chunks, reading one chunk at a time
+        and leaving out users already regraded according to the checkpoint
+        """
+        for user_ids in iter_keyset_chunks(users.values_list('id', flat=True), chunk_size):
+            user_ids = [user_id for user_id in user_ids if not checkpoint.is_done(user_id)]
+            if user_ids:
+                yield user_ids
+
+    def _count_users_to_regrade(self, users, checkpoint):
+        """
+        Returns the number of users left to regrade, streaming their ids when some are
+        already done according to the checkpoint
+        """
+        if not checkpoint.done_user_ids:
+            return users.count()
+        return sum(
+            not checkpoint.is_done(user_id) for user_id in users.values_list('id', flat=True).iterator()
+        )
+
+    def _regrade_with_pool(self, pool, max_pending, course_id, bulk, chunks):
+        """
+        Hands chunks to the process pool, keeping at most `max_pending` of them queued
+        so that chunks are only read from the database as the workers need them
+        """
+        def get_result(chunk, async_result):
+            # regrade_chunk reports its own errors, this covers workers which die
+            try:
+                return async_result.get()
+            except Exception as ex:  # pylint: disable=broad-except
+                return chunk, get_failed_chunk_result(course_id, chunk, ex)
+
+        pending = deque()
+        for chunk in chunks:
+            pending.append((chunk, pool.apply_async(regrade_chunk, (course_id, bulk, chunk))))
+            if len(pending) >= max_pending:
+                yield get_result(*pending.popleft())
+        while pending:
+            yield get_result(*pending.popleft())
+
+    def _regrade_with_celery(self, course_id, bulk, chunks):
+        """
+        Queues every chunk and yields their results as the tasks finish
+        """
+        async_results = [(chunk, regrade_course_chunk.delay(course_id, chunk, bulk)) for chunk in chunks]
+        for chunk, async_result in async_results:
+            try:
+                yield chunk, async_result.get()
+            except Exception as ex:  # pylint: disable=broad-except
+                yield chunk, get_failed_chunk_result(course_id, chunk, ex)
+
+    def _collect_results(self, course_key, checkpoint, results, users_total, started):
+        """
+        Records chunk results in the checkpoint and logs the final summary
+        """
+        users_regraded = 0
+        users_failed = 0
+        stage_summaries = []
+        for user_ids, result in results:
+            checkpoint.record(user_ids, result['failed'])
+            stage_summaries.append(result.get('stages'))
+            users_regraded += result['regraded']
+            users_failed += len(result['failed'])
+            log.info(
+                "Regrade of Course %s: %d/%d users processed",
+                course_key, users_regraded + users_failed, users_total
+            )
+
+        elapsed = time.time() - started
+        log.info(
+            "%d users regraded, %d failed in %.1f seconds (%.1f users/second)",
+            users_regraded, users_failed, elapsed, users_regraded / elapsed if elapsed else 0.0
+        )
+        if checkpoint.failed_user_ids:
+            log.info("Failed user ids: %s", sorted(checkpoint.failed_user_ids))
+        # only reflects regrades done in this process
+        log.info("Course grading cache: %s", course_grading_cache.stats())
+        instrumentation.log_summary(log, instrumentation.merge_summaries(stage_summaries))
@@ -0,0 +1,79 @@
+"""
+Command to regrade a course offline from the stored progress summaries under a new grading policy
+./manage.py lms replay_gradebook -c {course_id} --settings=aws
+./manage.py lms replay_gradebook -c {course_id} --policy-file grading_policy.json --dry-run --settings=aws
+"""
+import json
+import logging
+import time
+
+from django.core.management import BaseCommand, CommandError
+
+from gradebook.replay import replay_course_gradebook
+from opaque_keys.edx.keys import CourseKey
+from xmodule.modulestore.django import modulestore
+
+log = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """
+    Recomputes gradebook grades of a course from stored section scores, for grading policy
+    changes which do not change the course content
+    """
+    help = "Command to regrade a course from stored progress summaries under a new grading policy"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "-c",
+            "--course_id",
+            dest="course_id",
+            help="course id to regrade",
+            metavar="any/course/id"
+        )
+        parser.add_argument(
+            "--policy-file",
+            dest="policy_file",
+            help="JSON file with the GRADER and GRADE_CUTOFFS to apply, defaults to the current course policy",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            dest="chunk_size",
+            type=int,
+            default=500,
+            help="number of gradebook entries replayed and written per chunk",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            dest="dry_run",
+            default=False,
+            help="only count the entries whose grades would change",
+        )
+
+    def handle(self, *args, **options):
+
+        course_id = options.get('course_id')
+        course_key = CourseKey.from_string(course_id)
+
+        if options.get('policy_file'):
+            with open(options.get('policy_file')) as policy_file:
+                grading_policy = json.load(policy_file)
+        else:
+            # only the course root is loaded, for its grading policy
+            course = modulestore().get_course(course_key, depth=0)
+            if not course:
+                raise CommandError('Course with course id {} does not exist'.format(course_id))
+            grading_policy = course.grading_policy
+        if 'GRADER' not in grading_policy or 'GRADE_CUTOFFS' not in grading_policy:
+            raise CommandError('The grading policy needs GRADER and GRADE_CUTOFFS')
+
+        started = time.time()
+        entries_replayed, entries_changed = replay_course_gradebook(
+            course_key, grading_policy, chunk_size=options.get('chunk_size'), dry_run=options.get('dry_run')
+        )
+        log.info(
+            "%d gradebook entries of Course %s replayed in %.1f seconds, %d with changed grades%s",
+            entries_replayed, course_key, time.time() - started, entries_changed,
+            " (dry run, nothing written)" if options.get('dry_run') else ""
+        )
@@ -1,13 +1,17 @@
 """
 Command to update pass status of users in a course
 ./manage.py lms update_pass_status -c {course_id} --settings=aws
+./manage.py lms update_pass_status -c {course_id} --chunk-size 1000 --settings=aws
+./manage.py lms update_pass_status -c {course_id} --fast --verify 50 --settings=aws
 """
 import logging
-from optparse import make_option
 
-from django.core.management import BaseCommand
+from django.core.management import BaseCommand, CommandError
+from django.db import transaction
 
 from gradebook.models import StudentGradebook
+from gradebook.replay import get_passing_cutoff
+from gradebook.utils import iter_keyset_chunks
 from lms.djangoapps.grades.course_grade_factory import CourseGradeFactory
 from opaque_keys.edx.keys import CourseKey
 from student.models import CourseEnrollment
@@ -30,10 +34,34 @@ class Command(BaseCommand):
             help="course id to regrade",
             metavar="any/course/id"
         ),
+        parser.add_argument(
+            "--fast",
+            action="store_true",
+            dest="fast",
+            default=False,
+            help="derive pass status from the stored grades and the current grade cutoffs",
+        )
+        parser.add_argument(
+            "--verify",
+            dest="verify",
+            type=int,
+            default=0,
+            help="with --fast, number of random learners to cross-check against a full grade read",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            dest="chunk_size",
+            type=int,
+            default=500,
+            help="number of users read and updated per chunk",
+        )
 
     def handle(self, *args, **options):
 
         course_id = options.get('course_id')
+        chunk_size = options.get('chunk_size')
+        if chunk_size < 1:
+            raise CommandError('--chunk-size must be positive')
 
         users_updated = 0
 
@@ -41,25 +69,94 @@ class Command(BaseCommand):
         users = CourseEnrollment.objects.users_enrolled_in(course_key)
         course = modulestore().get_course(course_key, depth=None)
 
-        if course:
-            # For each user...
-            for user in users:
-                is_passed = False
-                try:
-                    course_grade = CourseGradeFactory().read(user, course)
-                    is_passed = course_grade.passed
-                    StudentGradebook.objects.filter(user=user, course_id=course_key).update(is_passed=is_passed)
-                except Exception as ex:  # pylint: disable=broad-except
-                    log.info(
-                        "Failed to update pass status for user %s in course %s. Error: %s",
-                        user.id, course_key, ex.message
-                    )
-
-                users_updated += 1
+        if course and options.get('fast'):
+            users_updated = self._update_from_stored_grades(course_key, course, users)
+            if options.get('verify'):
+                self._verify(course_key, course, users, options.get('verify'))
+        elif course:
+            users_total = users.count()
+            users_processed = 0
+            for chunk in iter_keyset_chunks(users, chunk_size):
+                users_updated += self._update_chunk(course_key, course, chunk)
+                users_processed += len(chunk)
                 log.info(
-                    "Gradebook entry updated in Course %s for User id %s with pass status: %s",
-                    course.id, user.id, is_passed
+                    "Pass status of Course %s: %d/%d users processed",
+                    course_key, users_processed, users_total
                 )
         else:
             log.info("Course with course id %s does not exist", course_id)
         log.info("%d users have their pass status updated", users_updated)
+
+    def _update_chunk(self, course_key, course, users):
+        """
+        Reads the pass status of a chunk of users, then writes it in one transaction with
+        one update for passing and one for failing users.  Returns the number of users
+        whose pass status was read.
+        """
+        passed_user_ids = []
+        failed_user_ids = []
+        for user in users:
+            try:
+                is_passed = CourseGradeFactory().read(user, course).passed
+            except Exception as ex:  # pylint: disable=broad-except
+                log.info(
+                    "Failed to update pass status for user %s in course %s. Error: %s",
+                    user.id, course_key, str(ex)
+                )
+                continue
+            (passed_user_ids if is_passed else failed_user_ids).append(user.id)
+
+        gradebook_entries = StudentGradebook.objects.filter(course_id=course_key)
+        with transaction.atomic():
+            gradebook_entries.filter(user_id__in=passed_user_ids).update(is_passed=True)
+            gradebook_entries.filter(user_id__in=failed_user_ids).update(is_passed=False)
+        return len(passed_user_ids) + len(failed_user_ids)
+
+    def _update_from_stored_grades(self, course_key, course, users):
+        """
+        Sets the pass status of the gradebook entries of the enrolled users from their stored
+        grade, with one update for entries which start passing and one for entries which stop.
+        Returns the number of entries changed.
+        """
+        gradebook_entries = StudentGradebook.objects.filter(course_id=course_key, user_id__in=users.values('id'))
+        passing_cutoff = get_passing_cutoff(course.grade_cutoffs)
+        with transaction.atomic():
+            if passing_cutoff is None:
+                passed_count = 0
+                failed_count = gradebook_entries.filter(is_passed=True).update(is_passed=False)
+            else:
+                passed_count = gradebook_entries.filter(
+                    grade__gte=passing_cutoff, is_passed=False
+                ).update(is_passed=True)
+                failed_count = gradebook_entries.filter(
+                    grade__lt=passing_cutoff, is_passed=True
+                ).update(is_passed=False)
+        log.info(
+            "Pass status in Course %s from cutoff %s: %d entries now passed, %d no longer passed",
+            course_key, passing_cutoff, passed_count, failed_count
+        )
+        return passed_count + failed_count
+
+    def _verify(self, course_key, course, users, sample_size):
+        """
+        Compares the stored pass status of random enrolled learners with a full grade read
+        """
+        # the sample is drawn by the database, without loading every enrolled user id
+        stored_status = dict(StudentGradebook.objects.filter(
+            course_id=course_key, user_id__in=users.values('id')
+        ).order_by('?').values_list('user_id', 'is_passed')[:sample_size])
+        sample_user_ids = list(stored_status)
+
+        mismatches = 0
+        for user in users.filter(id__in=sample_user_ids):
+            is_passed = CourseGradeFactory().read(user, course).passed
+            if bool(is_passed) != stored_status[user.id]:
+                mismatches += 1
+                log.info(
+                    "Pass status mismatch in Course %s for User id %s: stored %s, graded %s",
+                    course_key, user.id, stored_status[user.id], is_passed
+                )
+        log.info(
+            "%d of %d sampled learners in Course %s have a stale pass status",
+            mismatches, len(sample_user_ids), course_key
+        )
@@ -0,0 +1,112 @@
+"""
+Synthetic gradebook data used to benchmark gradebook queries on a local database
+"""
+import random
+
+from django.contrib.auth.models import Group, User
+
+from edx_solutions_organizations.models import Organization
+from gradebook.models import StudentGradebook
+from opaque_keys.edx.keys import CourseKey
+from student.models import CourseEnrollment
+
+SYNTHETIC_USERNAME_PREFIX = 'gradebook_synthetic_'
+
+
+def get_synthetic_course_key(learners):
+    return CourseKey.from_string('course-v1:GradebookSynthetic+L{}+synthetic'.format(learners))
+
+
+def _get_username_prefix(course_key):
+    return '{}{}_'.format(SYNTHETIC_USERNAME_PREFIX, course_key.course)
+
+
+def create_synthetic_course(course_key, learners, ungraded_ratio=0.15, batch_size=5000, seed=0):
+    """
+    Creates `learners` active users enrolled in the course, and gradebook entries for all
+    but `ungraded_ratio` of them.  Rows are bulk inserted, so no gradebook signal fires.
+    Returns the ids of the created users.
+    """
+    rng = random.Random(seed)
+    username_prefix = _get_username_prefix(course_key)
+    user_ids = []
+    for start in range(0, learners, batch_size):
+        usernames = ['{}{}'.format(username_prefix, index) for index in range(start, min(start + batch_size, learners))]
+        User.objects.bulk_create([
+            User(username=username, email='{}@example.com'.format(username), is_active=True)
+            for username in usernames
+        ])
+        # not every database returns primary keys from bulk inserts
+        batch_user_ids = list(User.objects.filter(username__in=usernames).values_list('id', flat=True))
+        user_ids.extend(batch_user_ids)
+
+        CourseEnrollment.objects.bulk_create([
+            CourseEnrollment(user_id=user_id, course_id=course_key, mode='audit', is_active=True)
+            for user_id in batch_user_ids
+        ])
+
+        gradebook_entries = []
+        for user_id in batch_user_ids:
+            if rng.random() < ungraded_ratio:
+                continue
+            grade = round(rng.random(), 2)
+            gradebook_entries.append(StudentGradebook(
+                user_id=user_id,
+                course_id=course_key,
+                grade=grade,
+                proforma_grade=round(min(1.0, grade + rng.random() * 0.3), 2),
+                progress_summary='[]',
+                grade_summary='{}',
+                grading_policy='{}',
+                is_passed=grade >= 0.5,
+            ))
+        StudentGradebook.objects.bulk_create(gradebook_entries)
+    return user_ids
+
+
+def get_synthetic_filters(course_key, segments=4):
+    """
+    Returns the leaderboard filters of a synthetic course: `segments` groups and organizations
+    each holding an interleaved share of the learners, a cohort of every other learner and
+    one excluded learner in a hundred.  Groups and organizations are created on first use.
+    """
+    username_prefix = _get_username_prefix(course_key)
+    user_ids = list(User.objects.filter(username__startswith=username_prefix).order_by('id').values_list(
+        'id', flat=True
+    ))
+    group_ids = []
+    org_ids = []
+    for segment in range(segments):
+        segment_user_ids = user_ids[segment::segments]
+        group, created = Group.objects.get_or_create(name='{}group_{}'.format(username_prefix, segment))
+        if created:
+            User.groups.through.objects.bulk_create([
+                User.groups.through(user_id=user_id, group_id=group.id) for user_id in segment_user_ids
+            ])
+        group_ids.append(group.id)
+
+        organization, created = Organization.objects.get_or_create(name='{}org_{}'.format(username_prefix, segment))
+        if created:
+            Organization.users.through.objects.bulk_create([
+                Organization.users.through(user_id=user_id, organization_id=organization.id)
+                for user_id in segment_user_ids
+            ])
+        org_ids.append(organization.id)
+
+    return {
+        'group_ids': group_ids[:1],
+        'org_ids': org_ids[:1],
+        'cohort_user_ids': user_ids[::2],
+        'exclude_users': user_ids[::100],
+    }
+
+
+def delete_synthetic_course(course_key):
+    """
+    Removes every row created by create_synthetic_course and get_synthetic_filters for the course
+    """
+    Group.objects.filter(name__startswith=_get_username_prefix(course_key)).delete()
+    Organization.objects.filter(name__startswith=_get_username_prefix(course_key)).delete()
+    StudentGradebook.delete_course_entries(course_key)
+    CourseEnrollment.objects.filter(course_id=course_key).delete()
+    User.objects.filter(username__startswith=_get_username_prefix(course_key)).delete()
@@ -0,0 +1,35 @@
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+from opaque_keys.edx.django.models import CourseKeyField
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('gradebook', '0002_auto_20170619_0538'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StudentGradebookRank',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('course_id', CourseKeyField(db_index=True, max_length=255, blank=True)),
+                ('position', models.PositiveIntegerField()),
+                ('grade', models.FloatField()),
+                ('modified', models.DateTimeField()),
+                ('user', models.ForeignKey(to=settings.AUTH_USER_MODEL, on_delete=django.db.models.deletion.CASCADE)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='studentgradebookrank',
+            unique_together=set([('user', 'course_id')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='studentgradebookrank',
+            index_together=set([('course_id', 'position'), ('course_id', 'grade', 'modified')]),
+        ),
+    ]
@@ -0,0 +1,22 @@
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('gradebook', '0003_studentgradebookrank'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='studentgradebookhistory',
+            name='fingerprint',
+            field=models.CharField(blank=True, default='', max_length=40),
+        ),
+        migrations.AlterIndexTogether(
+            name='studentgradebookhistory',
+            index_together=set([('user', 'course_id')]),
+        ),
+    ]
@@ -0,0 +1,50 @@
+from django.db import migrations, models
+
+import gradebook.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gradebook', '0004_studentgradebookhistory_fingerprint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GradebookGradingPolicy',
+            fields=[
+                ('digest', models.CharField(max_length=40, primary_key=True, serialize=False)),
+                ('policy', models.TextField()),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='studentgradebook',
+            name='progress_summary',
+            field=gradebook.fields.CompressedTextField(blank=True),
+        ),
+        migrations.AlterField(
+            model_name='studentgradebook',
+            name='grade_summary',
+            field=gradebook.fields.CompressedTextField(),
+        ),
+        migrations.AlterField(
+            model_name='studentgradebook',
+            name='grading_policy',
+            field=gradebook.fields.GradingPolicyField(),
+        ),
+        migrations.AlterField(
+            model_name='studentgradebookhistory',
+            name='progress_summary',
+            field=gradebook.fields.CompressedTextField(blank=True),
+        ),
+        migrations.AlterField(
+            model_name='studentgradebookhistory',
+            name='grade_summary',
+            field=gradebook.fields.CompressedTextField(),
+        ),
+        migrations.AlterField(
+            model_name='studentgradebookhistory',
+            name='grading_policy',
+            field=gradebook.fields.GradingPolicyField(),
+        ),
+    ]
@@ -0,0 +1,28 @@
+import django.utils.timezone
+from django.db import migrations, models
+
+import model_utils.fields
+from opaque_keys.edx.django.models import CourseKeyField
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gradebook', '0005_compact_storage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StudentGradebookCourseAggregate',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('course_id', CourseKeyField(max_length=255, unique=True)),
+                ('grade_sum', models.FloatField(default=0.0)),
+                ('grade_count', models.PositiveIntegerField(default=0)),
+                ('grade_min', models.FloatField(null=True)),
+                ('grade_max', models.FloatField(null=True)),
+                ('enrollment_count', models.PositiveIntegerField(default=0)),
+                ('modified', model_utils.fields.AutoLastModifiedField(default=django.utils.timezone.now, verbose_name='modified', editable=False)),
+            ],
+        ),
+    ]
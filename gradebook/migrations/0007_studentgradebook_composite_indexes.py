@@ -0,0 +1,23 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gradebook', '0006_studentgradebookcourseaggregate'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='studentgradebook',
+            index=models.Index(fields=['course_id', '-grade', 'modified'], name='gradebook_leaderboard_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='studentgradebook',
+            index=models.Index(fields=['course_id', 'proforma_grade', 'grade'], name='gradebook_completed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='studentgradebook',
+            index=models.Index(fields=['course_id', 'is_passed'], name='gradebook_passed_idx'),
+        ),
+    ]
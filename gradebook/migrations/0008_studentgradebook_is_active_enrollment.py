@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gradebook', '0007_studentgradebook_composite_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='studentgradebook',
+            name='is_active_enrollment',
+            field=models.BooleanField(db_index=True, default=True),
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gradebook', '0008_studentgradebook_is_active_enrollment'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='studentgradebook',
+            name='fingerprint',
+            field=models.CharField(blank=True, default='', max_length=40),
+        ),
+    ]
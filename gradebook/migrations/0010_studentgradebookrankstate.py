@@ -0,0 +1,24 @@
+import django.utils.timezone
+from django.db import migrations, models
+
+import model_utils.fields
+from opaque_keys.edx.django.models import CourseKeyField
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gradebook', '0009_studentgradebook_fingerprint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StudentGradebookRankState',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('course_id', CourseKeyField(max_length=255, unique=True)),
+                ('exclusion_digest', models.CharField(blank=True, default='', max_length=40)),
+                ('modified', model_utils.fields.AutoLastModifiedField(default=django.utils.timezone.now, verbose_name='modified', editable=False)),
+            ],
+        ),
+    ]
@@ -0,0 +1,24 @@
+from django.db import migrations, models
+
+
+def drop_course_aggregates(apps, schema_editor):
+    """
+    Aggregates built before entries recorded their counted grade are rebuilt on the next save
+    """
+    apps.get_model('gradebook', 'StudentGradebookCourseAggregate').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gradebook', '0010_studentgradebookrankstate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='studentgradebook',
+            name='aggregated_grade',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.RunPython(drop_course_aggregates, migrations.RunPython.noop),
+    ]
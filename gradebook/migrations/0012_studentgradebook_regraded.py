@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gradebook', '0011_studentgradebook_aggregated_grade'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='studentgradebook',
+            name='regraded',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -1,23 +1,108 @@
 """
 Django database models supporting the gradebook app
 """
+import hashlib
+import json
+import threading
+import uuid
+
 from django.conf import settings
 from django.contrib.auth.models import User
-from django.db import models
-from django.db.models import Avg, Count, F, Max, Min, Q
-from django.db.models.signals import post_save
+from django.core.cache import cache
+from django.db import connection, models, transaction
+from django.db.models import (Avg, Count, Exists, F, Max, Min, OuterRef, Q,
+                              Sum, Window)
+from django.db.models.functions import Rank
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.dispatch import receiver
 from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 
 from edx_solutions_api_integration.courses.utils import get_course_enrollment_count
+from edx_solutions_api_integration.utils import get_aggregate_exclusion_user_ids
+from gradebook.fields import CompressedTextField, GradingPolicyField
 from model_utils.fields import AutoCreatedField, AutoLastModifiedField
 from model_utils.models import TimeStampedModel
 from opaque_keys.edx.django.models import CourseKeyField
 from student.models import CourseEnrollment
 
+# Fields holding the calculated values of a gradebook entry
+GRADEBOOK_VALUE_FIELDS = (
+    'grade',
+    'proforma_grade',
+    'progress_summary',
+    'grade_summary',
+    'grading_policy',
+    'is_passed',
+)
+# The large text fields among them
+GRADEBOOK_SUMMARY_FIELDS = ('progress_summary', 'grade_summary', 'grading_policy')
+
+# Courses whose entries are being deleted by StudentGradebook.delete_course_entries
+_course_deletions = threading.local()
+
+
+def _get_deleting_courses():
+    return _course_deletions.__dict__.setdefault('course_keys', set())
+
+
+def is_course_being_deleted(course_key):
+    """
+    Tells whether the current thread is deleting every gradebook entry of the course, in
+    which case the per-entry delete hooks have nothing to maintain
+    """
+    return course_key in _get_deleting_courses()
+
+
+def gradebook_fingerprint(values):
+    """
+    Returns a content hash of the calculated values of a gradebook entry, given
+    as a dict keyed by the GRADEBOOK_VALUE_FIELDS
+    """
+    content = json.dumps([values[field] for field in GRADEBOOK_VALUE_FIELDS])
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+class DecodedSummariesMixin:
+    """
+    Lazily decoded views of the JSON summary fields.  Each is decoded on first access and
+    memoized until the field is assigned a new value; the returned objects are shared, so
+    callers must not modify them.
+    """
+
+    def _get_decoded_summary(self, field, empty):
+        raw_value = getattr(self, field)
+        decoded_summaries = self.__dict__.setdefault('_decoded_summaries', {})
+        memoized = decoded_summaries.get(field)
+        if memoized is not None and memoized[0] is raw_value:
+            return memoized[1]
+        decoded_value = json.loads(raw_value) if raw_value else empty()
+        decoded_summaries[field] = (raw_value, decoded_value)
+        return decoded_value
+
+    @property
+    def progress_summary_data(self):
+        """
+        The decoded progress_summary, a list of chapter dicts
+        """
+        return self._get_decoded_summary('progress_summary', list)
+
+    @property
+    def grade_summary_data(self):
+        """
+        The decoded grade_summary dict
+        """
+        return self._get_decoded_summary('grade_summary', dict)
+
+    @property
+    def grading_policy_data(self):
+        """
+        The decoded grading_policy dict
+        """
+        return self._get_decoded_summary('grading_policy', dict)
+
 
-class StudentGradebook(models.Model):
+class StudentGradebook(DecodedSummariesMixin, models.Model):
     """
     StudentGradebook is essentially a container used to cache calculated
     grades (see courseware.grades.grade), which can be an expensive operation.
@@ -26,10 +111,19 @@ class StudentGradebook(models.Model):
     course_id = CourseKeyField(db_index=True, max_length=255, blank=True)
     grade = models.FloatField(db_index=True)
     proforma_grade = models.FloatField()
-    progress_summary = models.TextField(blank=True)
-    grade_summary = models.TextField()
-    grading_policy = models.TextField()
+    progress_summary = CompressedTextField(blank=True)
+    grade_summary = CompressedTextField()
+    grading_policy = GradingPolicyField()
     is_passed = models.BooleanField(db_index=True, default=False)
+    # content hash of the values above, see gradebook_fingerprint
+    fingerprint = models.CharField(max_length=40, blank=True, default='')
+    # Denormalized from User.is_active and CourseEnrollment.is_active, kept in sync by signals
+    is_active_enrollment = models.BooleanField(db_index=True, default=True)
+    # when the entry was last recalculated from the learner's scores, whether or not its values changed;
+    # modified only moves with the grade, as it is the time scored of the leaderboard
+    regraded = models.DateTimeField(null=True, blank=True)
+    # grade counted in the course aggregate, None while not counted, see StudentGradebookCourseAggregate
+    aggregated_grade = models.FloatField(null=True, blank=True)
     # We can't use TimeStampedModel here because those fields are not indexed.
     created = AutoCreatedField(_('created'), db_index=True)
     modified = AutoLastModifiedField(_('modified'), db_index=True)
@@ -39,6 +133,21 @@ class StudentGradebook(models.Model):
         Meta information for this Django model
         """
         unique_together = (('user', 'course_id'),)
+        indexes = [
+            # leaderboards and positions: filter on course, order by grade then time scored
+            models.Index(fields=['course_id', '-grade', 'modified'], name='gradebook_leaderboard_idx'),
+            # completions compare proforma_grade against grade within a course
+            models.Index(fields=['course_id', 'proforma_grade', 'grade'], name='gradebook_completed_idx'),
+            models.Index(fields=['course_id', 'is_passed'], name='gradebook_passed_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if 'grade' in field_names:
+            # the stored grade, so that the next save does not have to read it again
+            instance._loaded_grade = values[field_names.index('grade')]  # pylint: disable=protected-access
+        return instance
 
     @classmethod
     def generate_leaderboard(cls, course_key, exclude_aggregate_scores=False, **kwargs):
@@ -103,7 +212,15 @@ class StudentGradebook(models.Model):
 
             # only include aggregates if required
             if not exclude_aggregate_scores:
-                aggregates = queryset.aggregate(Avg('grade'), Max('grade'), Min('grade'), Count('user'))
+                course_aggregate = StudentGradebookCourseAggregate.get_for_scope(
+                    course_key,
+                    exclude_users=kwargs.get('exclude_users', []),
+                    cohort_user_ids=kwargs.get('cohort_user_ids', []),
+                )
+                if course_aggregate is not None:
+                    aggregates = course_aggregate.as_aggregates()
+                else:
+                    aggregates = queryset.aggregate(Avg('grade'), Max('grade'), Min('grade'), Count('user'))
                 gradebook_user_count = aggregates['user__count']
 
                 if gradebook_user_count:
@@ -148,6 +265,18 @@ class StudentGradebook(models.Model):
             - `cohort_user_ids`
         """
         data = {'user_position': 0, 'user_grade': 0}
+
+        if StudentGradebookRank.is_enabled() and cls._is_default_scope(course_key, **kwargs):
+            materialized_rank = StudentGradebookRank.get_current_ranks(
+                course_key, kwargs.get('exclude_users'),
+            ).filter(
+                user__id=kwargs.get('user_id'),
+            ).values('position', 'grade').first()
+            if materialized_rank:
+                data['user_position'] = materialized_rank['position']
+                data['user_grade'] = materialized_rank['grade']
+                return data
+
         user_grade = 0
         user_time_scored = timezone.now()
 
@@ -171,6 +300,320 @@ class StudentGradebook(models.Model):
 
         return data
 
+    @classmethod
+    def get_user_positions(cls, course_key, user_ids, **kwargs):
+        """
+        Batch version of get_user_position, returning {user_id: {'user_position', 'user_grade'}}
+        for every given user.  Positions come from one windowed rank query; users outside the
+        ranked entries, or every user where the database has no window functions, are placed
+        with conditional counts in one more query, with the same tie-breaking on `modified`
+        as get_user_position.
+        :param kwargs:
+            - `exclude_users`
+            - `group_ids`
+            - `org_ids`
+            - `cohort_user_ids`
+        """
+        user_ids = list(user_ids)
+        data = {}
+        if not user_ids:
+            return data
+
+        if StudentGradebookRank.is_enabled() and cls._is_default_scope(course_key, **kwargs):
+            for user_id, position, grade in StudentGradebookRank.get_current_ranks(
+                    course_key, kwargs.get('exclude_users'),
+            ).filter(
+                    user_id__in=user_ids,
+            ).values_list('user_id', 'position', 'grade'):
+                data[user_id] = {'user_position': position, 'user_grade': grade}
+
+        pending_user_ids = [user_id for user_id in user_ids if user_id not in data]
+        if not pending_user_ids:
+            return data
+
+        entries = {
+            user_id: (grade, modified) for user_id, grade, modified in cls.objects.filter(
+                course_id__exact=course_key,
+                user_id__in=pending_user_ids,
+            ).values_list('user_id', 'grade', 'modified')
+        }
+        queryset = cls._build_queryset(course_key, **kwargs)
+        if kwargs.get('group_ids'):
+            # rank distinct entries, not one row per matching group
+            queryset = cls.objects.filter(pk__in=queryset.values('pk'))
+
+        positions = {}
+        if connection.features.supports_over_clause:
+            ranked = queryset.annotate(position=Window(
+                expression=Rank(),
+                order_by=[F('grade').desc(), F('modified').asc()],
+            )).order_by().values('user_id', 'position')
+            sql, params = ranked.query.sql_with_params()
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT user_id, position FROM ({}) ranked WHERE user_id IN ({})'.format(
+                        sql, ', '.join(['%s'] * len(pending_user_ids))
+                    ),
+                    list(params) + pending_user_ids,
+                )
+                positions = dict(cursor.fetchall())
+
+        # users outside the ranked entries are placed as get_user_position does
+        now = timezone.now()
+        users_above = cls._count_entries_above(queryset, {
+            user_id: entries.get(user_id, (0, now)) for user_id in pending_user_ids if user_id not in positions
+        })
+        for user_id in pending_user_ids:
+            data[user_id] = {
+                'user_position': positions[user_id] if user_id in positions else users_above[user_id] + 1,
+                'user_grade': entries.get(user_id, (0, now))[0],
+            }
+        return data
+
+    @classmethod
+    def _count_entries_above(cls, queryset, scores, chunk_size=100):
+        """
+        Returns {user_id: number of entries of the queryset ranked strictly above the user}
+        for `scores` given as {user_id: (grade, modified)}, with one conditional count per
+        user in a single query per chunk of users
+        """
+        users_above = {}
+        scores = list(scores.items())
+        for start in range(0, len(scores), chunk_size):
+            counts = queryset.aggregate(**{
+                'above_{}'.format(user_id): Count(
+                    'id', filter=Q(grade__gt=grade) | Q(grade=grade, modified__lt=modified),
+                )
+                for user_id, (grade, modified) in scores[start:start + chunk_size]
+            })
+            for user_id, __ in scores[start:start + chunk_size]:
+                users_above[user_id] = counts['above_{}'.format(user_id)]
+        return users_above
+
+    @classmethod
+    def _get_leaderboard_cutoff_cache_key(cls, course_key):
+        return 'gradebook.leaderboard_cutoff.{}'.format(course_key)
+
+    @classmethod
+    def get_leaderboard_cutoff(cls, course_key):
+        """
+        Returns the grade and modified time of the entry in the last place (LEADERBOARD_SIZE)
+        of the course-wide leaderboard, both None while the leaderboard is not full.
+        The cutoff is cached until a save reaches the leaderboard, for at most
+        GRADEBOOK_LEADERBOARD_CUTOFF_TIMEOUT seconds.
+        """
+        cache_key = cls._get_leaderboard_cutoff_cache_key(course_key)
+        cutoff = cache.get(cache_key)
+        if cutoff is None:
+            leaderboard_size = getattr(settings, 'LEADERBOARD_SIZE', 3)
+            queryset = cls._build_queryset(
+                course_key,
+                exclude_users=get_aggregate_exclusion_user_ids(course_key),
+            ).order_by('-grade', 'modified').values('grade', 'modified')
+            entries = list(queryset[leaderboard_size - 1:leaderboard_size])
+            cutoff = entries[0] if entries else {'grade': None, 'modified': None}
+            cache.set(cache_key, cutoff, getattr(settings, 'GRADEBOOK_LEADERBOARD_CUTOFF_TIMEOUT', 300))
+        return cutoff
+
+    @classmethod
+    def is_below_leaderboard_cutoff(cls, course_key, grade, cached_only=False):
+        """
+        Tells whether an entry with the given grade is certainly outside the course-wide
+        leaderboard, i.e. strictly below the grade of its last place.  With `cached_only`
+        the cutoff is never calculated and a missing cutoff answers False.
+        """
+        if cached_only:
+            cutoff = cache.get(cls._get_leaderboard_cutoff_cache_key(course_key))
+        else:
+            cutoff = cls.get_leaderboard_cutoff(course_key)
+        return bool(cutoff) and cutoff['grade'] is not None and grade < cutoff['grade']
+
+    @classmethod
+    def invalidate_leaderboard_cutoff(cls, course_key):
+        cache.delete(cls._get_leaderboard_cutoff_cache_key(course_key))
+
+    @classmethod
+    def _get_percentile_histogram_cache_key(cls, course_key, generation=None, bucket=None):
+        """
+        Returns the cache key of the current histogram generation of the course, or with
+        `generation` and `bucket` the key of one bucket count of that generation
+        """
+        cache_key = 'gradebook.percentile_histogram.{}'.format(course_key)
+        if generation is None:
+            return cache_key
+        return '{}.{}.{}'.format(cache_key, generation, bucket)
+
+    @classmethod
+    def _get_grade_bucket(cls, grade, buckets):
+        # the margin keeps a grade stored as 0.29 out of the 0.28 bucket, and a grade of
+        # exactly 1.0 belongs to the last bucket
+        return max(0, min(int((grade or 0.0) * buckets + 1e-9), buckets - 1))
+
+    @classmethod
+    def get_percentile_histogram(cls, course_key):
+        """
+        Returns the grade histogram of the course-wide leaderboard as a dict of `bucket_size`
+        and `counts`, the number of entries in each of GRADEBOOK_PERCENTILE_BUCKETS (default
+        100) equal-width grade buckets.  Enrolled users without an entry count as zero grades.
+        Every bucket count is cached under a key of its own for GRADEBOOK_PERCENTILE_CACHE_TIMEOUT
+        seconds and incremented in place on grade saves.
+        """
+        buckets = getattr(settings, 'GRADEBOOK_PERCENTILE_BUCKETS', 100)
+        cache_key = cls._get_percentile_histogram_cache_key(course_key)
+        generation = cache.get(cache_key)
+        if generation is not None:
+            bucket_keys = [
+                cls._get_percentile_histogram_cache_key(course_key, generation, bucket) for bucket in range(buckets)
+            ]
+            cached_counts = cache.get_many(bucket_keys)
+            if len(cached_counts) == buckets:
+                return {'bucket_size': 1.0 / buckets, 'counts': [cached_counts[key] for key in bucket_keys]}
+
+        exclude_users = get_aggregate_exclusion_user_ids(course_key)
+        counts = [0] * buckets
+        for grade, count in cls._build_queryset(course_key, exclude_users=exclude_users).order_by().values(
+                'grade'
+        ).annotate(count=Count('id')).values_list('grade', 'count'):
+            counts[cls._get_grade_bucket(grade, buckets)] += count
+        course_aggregate = StudentGradebookCourseAggregate.get_for_scope(course_key, exclude_users=exclude_users)
+        if course_aggregate is not None:
+            enrollment_count = course_aggregate.enrollment_count
+        else:
+            enrollment_count = cls._build_enrollment_queryset(course_key, exclude_users=exclude_users).count()
+        counts[0] += max(enrollment_count - sum(counts), 0)
+
+        # a new generation, so that updates to the counts of a previous one are never mixed in
+        generation = uuid.uuid4().hex
+        timeout = getattr(settings, 'GRADEBOOK_PERCENTILE_CACHE_TIMEOUT', 3600)
+        cache.set_many({
+            cls._get_percentile_histogram_cache_key(course_key, generation, bucket): count
+            for bucket, count in enumerate(counts)
+        }, timeout)
+        cache.set(cache_key, generation, timeout)
+        return {'bucket_size': 1.0 / buckets, 'counts': counts}
+
+    @classmethod
+    def update_percentile_histogram(cls, gradebook_entry, previous_grade):
+        """
+        Moves the saved entry from the bucket of its previous grade to the bucket of its new
+        one in the cached histogram, if there is one.  A new entry replaces the implicit zero
+        grade of its user.  Counts are changed with atomic cache increments, so concurrent
+        saves do not overwrite each other.
+        """
+        course_key = gradebook_entry.course_id
+        generation = cache.get(cls._get_percentile_histogram_cache_key(course_key))
+        if generation is None:
+            return
+        buckets = getattr(settings, 'GRADEBOOK_PERCENTILE_BUCKETS', 100)
+        previous_bucket = cls._get_grade_bucket(previous_grade, buckets)
+        bucket = cls._get_grade_bucket(gradebook_entry.grade, buckets)
+        if previous_bucket == bucket:
+            return
+        if not cls._build_queryset(
+                course_key,
+                exclude_users=get_aggregate_exclusion_user_ids(course_key),
+        ).filter(pk=gradebook_entry.pk).exists():
+            return
+
+        try:
+            cache.decr(cls._get_percentile_histogram_cache_key(course_key, generation, previous_bucket))
+            cache.incr(cls._get_percentile_histogram_cache_key(course_key, generation, bucket))
+        except ValueError:
+            # a bucket count was evicted
+            cls.invalidate_percentile_histogram(course_key)
+
+    @classmethod
+    def invalidate_percentile_histogram(cls, course_key):
+        cache.delete(cls._get_percentile_histogram_cache_key(course_key))
+
+    @classmethod
+    def delete_course_entries(cls, course_key):
+        """
+        Deletes the gradebook entries of a course along with the data derived from them.
+        The per-entry delete hooks skip the course meanwhile, and the ranks and aggregates
+        are dropped once the entries are gone instead of being maintained row by row.
+        """
+        deleting_courses = _get_deleting_courses()
+        deleting_courses.add(course_key)
+        try:
+            with transaction.atomic():
+                cls.objects.filter(course_id=course_key).delete()
+                StudentGradebookRank.objects.filter(course_id=course_key).delete()
+                StudentGradebookRankState.objects.filter(course_id=course_key).delete()
+                StudentGradebookCourseAggregate.objects.filter(course_id=course_key).delete()
+        finally:
+            deleting_courses.discard(course_key)
+        cls.invalidate_leaderboard_cutoff(course_key)
+        cls.invalidate_percentile_histogram(course_key)
+
+    @classmethod
+    def get_grade_percentile(cls, course_key, grade):
+        """
+        Returns the share of the course-wide leaderboard, in percent, ranked at or above an
+        entry with the given grade, i.e. the X of "top X%"; None for a course without learners.
+        Only entries in higher buckets count as ranked above; the other entries of the grade's
+        own bucket count as ranked below it.
+        """
+        counts = cls.get_percentile_histogram(course_key)['counts']
+        total_count = sum(counts)
+        if not total_count:
+            return None
+        entries_above = sum(counts[cls._get_grade_bucket(grade, len(counts)) + 1:])
+        return min(100.0, 100.0 * (entries_above + 1) / total_count)
+
+    @classmethod
+    def get_user_percentile(cls, course_key, user_id):
+        """
+        Helper method to return the user's grade and percentile in the course-wide leaderboard
+        """
+        user_grade = cls.get_user_grade(course_key, user_id)
+        return {
+            'user_grade': user_grade,
+            'user_percentile': cls.get_grade_percentile(course_key, user_grade),
+        }
+
+    @classmethod
+    def _is_default_scope(cls, course_key, **kwargs):
+        """
+        Helper method to tell whether the filters describe the course-wide leaderboard,
+        i.e. no group, organization or cohort filtering and the standard aggregate exclusions.
+        :param kwargs:
+            - `exclude_users`
+            - `group_ids`
+            - `org_ids`
+            - `cohort_user_ids`
+        """
+        if kwargs.get('group_ids') or kwargs.get('org_ids') or kwargs.get('cohort_user_ids'):
+            return False
+
+        return set(kwargs.get('exclude_users') or []) == set(get_aggregate_exclusion_user_ids(course_key))
+
+    @classmethod
+    def _active_enrollment_filter(cls, course_key):
+        """
+        Helper method to return the filter matching active users actively enrolled in the course,
+        read from the denormalized flag once GRADEBOOK_USE_ACTIVE_ENROLLMENT_FLAG is enabled
+        """
+        if getattr(settings, 'GRADEBOOK_USE_ACTIVE_ENROLLMENT_FLAG', False):
+            return Q(is_active_enrollment=True)
+        return Q(
+            user__is_active=True,
+            user__courseenrollment__is_active=True,
+            user__courseenrollment__course_id__exact=course_key,
+        )
+
+    @classmethod
+    def active_enrollment_expression(cls):
+        """
+        Returns an expression computing is_active_enrollment from the user and enrollment tables
+        """
+        return Exists(CourseEnrollment.objects.filter(
+            user_id=OuterRef('user_id'),
+            course_id=OuterRef('course_id'),
+            is_active=True,
+            user__is_active=True,
+        ))
+
     @classmethod
     def _build_queryset(cls, course_key, **kwargs):
         """
@@ -182,10 +625,8 @@ class StudentGradebook(models.Model):
             - `cohort_user_ids`
         """
         queryset = cls.objects.filter(
+            cls._active_enrollment_filter(course_key),
             course_id__exact=course_key,
-            user__is_active=True,
-            user__courseenrollment__is_active=True,
-            user__courseenrollment__course_id__exact=course_key,
         ).exclude(
             user__in=kwargs.get('exclude_users') or []
         )
@@ -235,12 +676,19 @@ class StudentGradebook(models.Model):
             - `org_ids`
         """
         course_avg = 0.0
-        total_user_count = cls._build_enrollment_queryset(course_key, **kwargs).count()
+        course_aggregate = StudentGradebookCourseAggregate.get_for_scope(course_key, **kwargs)
+        if course_aggregate is not None:
+            total_user_count = course_aggregate.enrollment_count
+        else:
+            total_user_count = cls._build_enrollment_queryset(course_key, **kwargs).count()
 
         if total_user_count:
-            # Generate the base data set we're going to work with
-            queryset = cls._build_queryset(course_key, **kwargs)
-            aggregates = queryset.aggregate(Avg('grade'), Count('user'))
+            if course_aggregate is not None:
+                aggregates = course_aggregate.as_aggregates()
+            else:
+                # Generate the base data set we're going to work with
+                queryset = cls._build_queryset(course_key, **kwargs)
+                aggregates = queryset.aggregate(Avg('grade'), Count('user'))
             gradebook_user_count = aggregates['user__count']
 
             if gradebook_user_count:
@@ -252,6 +700,47 @@ class StudentGradebook(models.Model):
                     course_avg = float("{:.3f}".format(course_avg))
         return course_avg
 
+    @classmethod
+    def grade_histogram(cls, course_key, buckets=10, **kwargs):
+        """
+        Returns the distribution of grades over `buckets` equal-width buckets from 0 to 1,
+        counted in one grouped query.  Enrolled users without a gradebook entry are counted
+        in the first bucket with an assumed zero grade, as in course_grade_avg.
+        {
+            'bucket_size': 0.1,
+            'counts': [12, 0, 3, 5, 9, 14, 20, 11, 6, 2],
+            'graded_count': 70,
+            'enrollment_count': 82,
+        }
+        :param kwargs:
+            - `exclude_users`
+            - `group_ids`
+            - `org_ids`
+            - `cohort_user_ids`
+        """
+        counts = [0] * buckets
+        # grouped by grade and bucketed like the percentile histogram, so both agree at bucket edges
+        graded_rows = cls._build_queryset(course_key, **kwargs).order_by().values('grade').annotate(
+            count=Count('id', distinct=True)
+        ).values_list('grade', 'count')
+        for grade, count in graded_rows:
+            counts[cls._get_grade_bucket(grade, buckets)] += count
+        graded_count = sum(counts)
+
+        course_aggregate = StudentGradebookCourseAggregate.get_for_scope(course_key, **kwargs)
+        if course_aggregate is not None:
+            enrollment_count = course_aggregate.enrollment_count
+        else:
+            enrollment_count = cls._build_enrollment_queryset(course_key, **kwargs).count()
+        counts[0] += max(enrollment_count - graded_count, 0)
+
+        return {
+            'bucket_size': 1.0 / buckets,
+            'counts': counts,
+            'graded_count': graded_count,
+            'enrollment_count': enrollment_count,
+        }
+
     @classmethod
     def get_user_grade(cls, course_key, user_id):
         """
@@ -264,6 +753,30 @@ class StudentGradebook(models.Model):
         except StudentGradebook.DoesNotExist:
             return user_grade
 
+    @classmethod
+    def get_user_grades(cls, course_keys, user_ids, chunk_size=500):
+        """
+        Bulk version of get_user_grade, returning {(course_key, user_id): {'grade', 'proforma_grade',
+        'is_passed'}} for every pair with a gradebook entry.  Only those columns are loaded, with
+        one query per chunk of at most `chunk_size` course keys and `chunk_size` user ids.
+        """
+        course_keys = list(course_keys)
+        user_ids = list(user_ids)
+        grades = {}
+        for course_start in range(0, len(course_keys), chunk_size):
+            for user_start in range(0, len(user_ids), chunk_size):
+                rows = cls.objects.filter(
+                    course_id__in=course_keys[course_start:course_start + chunk_size],
+                    user_id__in=user_ids[user_start:user_start + chunk_size],
+                ).order_by().values_list('course_id', 'user_id', 'grade', 'proforma_grade', 'is_passed')
+                for course_key, user_id, grade, proforma_grade, is_passed in rows:
+                    grades[(course_key, user_id)] = {
+                        'grade': grade,
+                        'proforma_grade': proforma_grade,
+                        'is_passed': is_passed,
+                    }
+        return grades
+
     @classmethod
     def get_num_users_completed(
             cls,
@@ -279,10 +792,8 @@ class StudentGradebook(models.Model):
         exclude_users = exclude_users or []
         grade_complete_match_range = getattr(settings, 'GRADEBOOK_GRADE_COMPLETE_PROFORMA_MATCH_RANGE', 0.01)
         queryset = cls.objects.filter(
+            cls._active_enrollment_filter(course_key),
             course_id__exact=course_key,
-            user__is_active=True,
-            user__courseenrollment__is_active=True,
-            user__courseenrollment__course_id__exact=course_key,
             proforma_grade__lte=F('grade') + grade_complete_match_range,
             proforma_grade__gt=0
         ).exclude(user__id__in=exclude_users)
@@ -309,10 +820,8 @@ class StudentGradebook(models.Model):
         """
         exclude_users = exclude_users or []
         queryset = StudentGradebook.objects.select_related('user').filter(
+            cls._active_enrollment_filter(course_key),
             course_id__exact=course_key,
-            user__is_active=True,
-            user__courseenrollment__is_active=True,
-            user__courseenrollment__course_id__exact=course_key,
             is_passed=True
         ).exclude(user__id__in=exclude_users)
         if org_ids:
@@ -325,7 +834,425 @@ class StudentGradebook(models.Model):
         return queryset
 
 
-class StudentGradebookHistory(TimeStampedModel):
+class GradebookGradingPolicy(models.Model):
+    """
+    Content-addressed store of the grading policies referenced by gradebook entries
+    written in compact storage mode.  A policy is stored once, under the SHA-1 digest
+    of its JSON text, and shared by every entry of every course using it.
+    """
+    digest = models.CharField(max_length=40, primary_key=True)
+    policy = models.TextField()
+
+
+class StudentGradebookRank(models.Model):
+    """
+    Materialized leaderboard position of a StudentGradebook entry.  Positions are kept
+    in step with grade changes so that StudentGradebook.get_user_position can read them
+    instead of counting every entry above the user.  They follow the same ordering and
+    tie semantics (grade descending, earlier modified first) over the course-wide
+    queryset with the aggregate exclusions applied.  Changes to the ranks of a course
+    are serialized by locking its StudentGradebookRankState row.
+    """
+    user = models.ForeignKey(User, db_index=True, on_delete=models.CASCADE)
+    course_id = CourseKeyField(db_index=True, max_length=255, blank=True)
+    position = models.PositiveIntegerField()
+    grade = models.FloatField()
+    modified = models.DateTimeField()
+
+    class Meta:
+        """
+        Meta information for this Django model
+        """
+        unique_together = (('user', 'course_id'),)
+        index_together = (
+            ('course_id', 'position'),
+            ('course_id', 'grade', 'modified'),
+        )
+
+    @classmethod
+    def is_enabled(cls):
+        """
+        Materialized ranks are opt-in through the GRADEBOOK_MATERIALIZED_RANKS setting
+        """
+        return getattr(settings, 'GRADEBOOK_MATERIALIZED_RANKS', False)
+
+    @classmethod
+    def get_exclusion_digest(cls, exclude_users):
+        """
+        Returns a hash of the excluded user ids the ranks of a course are built for
+        """
+        content = ','.join(str(user_id) for user_id in sorted(set(exclude_users or [])))
+        return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+    @classmethod
+    def get_current_ranks(cls, course_key, exclude_users):
+        """
+        Returns the ranks of the course, or none at all unless they were built with the
+        given exclusions, so that a change of the exclusion set is never read from stale ranks
+        """
+        return cls.objects.filter(course_id__exact=course_key).annotate(
+            is_current=Exists(StudentGradebookRankState.objects.filter(
+                course_id=course_key,
+                exclusion_digest=cls.get_exclusion_digest(exclude_users),
+            )),
+        ).filter(is_current=True)
+
+    @classmethod
+    def _build_ranked_queryset(cls, course_key, exclude_users=None):
+        """
+        Helper method to return the gradebook entries which hold a position in the course
+        """
+        if exclude_users is None:
+            exclude_users = get_aggregate_exclusion_user_ids(course_key)
+        return StudentGradebook._build_queryset(course_key, exclude_users=exclude_users)
+
+    @classmethod
+    def compute_positions(cls, course_key, exclude_users=None):
+        """
+        Returns a list of (user_id, position, grade, modified) tuples computed from the
+        live gradebook.  Entries sharing both grade and modified share a position, exactly
+        as get_user_position counts only the entries strictly above the user.
+        """
+        queryset = cls._build_ranked_queryset(course_key, exclude_users).order_by('-grade', 'modified').values_list(
+            'user_id', 'grade', 'modified'
+        )
+        positions = []
+        position = 0
+        previous = None
+        for index, (user_id, grade, modified) in enumerate(queryset, start=1):
+            if (grade, modified) != previous:
+                position = index
+                previous = (grade, modified)
+            positions.append((user_id, position, grade, modified))
+        return positions
+
+    @classmethod
+    def rebuild(cls, course_key, batch_size=1000):
+        """
+        Replaces the materialized ranks of a course with freshly computed ones
+        """
+        with transaction.atomic():
+            StudentGradebookRankState.objects.get_or_create(course_id=course_key)
+            rank_state = StudentGradebookRankState.objects.select_for_update().get(course_id=course_key)
+            return cls._rebuild_locked(course_key, rank_state, batch_size)
+
+    @classmethod
+    def _rebuild_locked(cls, course_key, rank_state, batch_size=1000):
+        """
+        Rebuilds the ranks of a course whose state row is locked by the current transaction
+        """
+        exclude_users = get_aggregate_exclusion_user_ids(course_key)
+        ranks = [
+            cls(user_id=user_id, course_id=course_key, position=position, grade=grade, modified=modified)
+            for user_id, position, grade, modified in cls.compute_positions(course_key, exclude_users)
+        ]
+        cls.objects.filter(course_id=course_key).delete()
+        cls.objects.bulk_create(ranks, batch_size=batch_size)
+        rank_state.exclusion_digest = cls.get_exclusion_digest(exclude_users)
+        rank_state.save()
+        return len(ranks)
+
+    @classmethod
+    def _lock_course(cls, course_key):
+        """
+        Locks the rank state row of the course for the current transaction.  Returns
+        the exclusions the ranks are built for, or None after rebuilding ranks which were
+        never built or were built for other exclusions.
+        """
+        exclude_users = get_aggregate_exclusion_user_ids(course_key)
+        rank_state = StudentGradebookRankState.objects.select_for_update().filter(course_id=course_key).first()
+        if rank_state is not None and rank_state.exclusion_digest == cls.get_exclusion_digest(exclude_users):
+            return exclude_users
+        if rank_state is None:
+            StudentGradebookRankState.objects.get_or_create(course_id=course_key)
+            rank_state = StudentGradebookRankState.objects.select_for_update().get(course_id=course_key)
+        cls._rebuild_locked(course_key, rank_state)
+        return None
+
+    @classmethod
+    def check_consistency(cls, course_key):
+        """
+        Compares the materialized ranks of a course against positions computed from the
+        live gradebook.  Returns a list of (user_id, expected_position, stored_position)
+        tuples for every mismatch, where None means the rank is missing on that side.
+        """
+        expected = {user_id: position for user_id, position, __, __ in cls.compute_positions(course_key)}
+        stored = dict(cls.objects.filter(course_id=course_key).values_list('user_id', 'position'))
+        discrepancies = []
+        for user_id in set(expected) | set(stored):
+            if expected.get(user_id) != stored.get(user_id):
+                discrepancies.append((user_id, expected.get(user_id), stored.get(user_id)))
+        return sorted(discrepancies)
+
+    @classmethod
+    def remove_entry(cls, course_key, user_id):
+        """
+        Removes the user's rank and moves every entry ranked below it up by one
+        """
+        with transaction.atomic():
+            if cls._lock_course(course_key) is None:
+                return
+            ranks = cls.objects.filter(course_id=course_key)
+            current = ranks.filter(user_id=user_id).first()
+            if current is None:
+                return
+            current.delete()
+            ranks.filter(position__gt=current.position).update(position=F('position') - 1)
+
+    @classmethod
+    def update_entry(cls, gradebook_entry):
+        """
+        Moves the gradebook entry to its new position.  Only the entries ranked between its
+        previous and its new position are shifted.
+        """
+        course_key = gradebook_entry.course_id
+        grade = gradebook_entry.grade
+        modified = gradebook_entry.modified
+        with transaction.atomic():
+            exclude_users = cls._lock_course(course_key)
+            if exclude_users is None:
+                return
+
+            ranks = cls.objects.filter(course_id=course_key)
+            current = ranks.filter(user_id=gradebook_entry.user_id).first()
+            is_ranked = cls._build_ranked_queryset(course_key, exclude_users).filter(pk=gradebook_entry.pk).exists()
+            if current is not None and is_ranked and (current.grade, current.modified) == (grade, modified):
+                return
+
+            other_ranks = ranks.exclude(user_id=gradebook_entry.user_id)
+            below_new = Q(grade__lt=grade) | Q(grade=grade, modified__gt=modified)
+            if current is not None:
+                current.delete()
+                if not is_ranked:
+                    other_ranks.filter(position__gt=current.position).update(position=F('position') - 1)
+                    return
+                if grade > current.grade or (grade == current.grade and modified < current.modified):
+                    # moved up: entries from the new position down to the previous one move down
+                    other_ranks.filter(below_new, position__lte=current.position).update(position=F('position') + 1)
+                else:
+                    # moved down: entries from below the previous position to the new one move up
+                    other_ranks.filter(position__gt=current.position).exclude(below_new).update(
+                        position=F('position') - 1
+                    )
+            elif is_ranked:
+                other_ranks.filter(below_new).update(position=F('position') + 1)
+            else:
+                return
+
+            # the first entry which is not strictly above the new grade tells the new position
+            first_below = other_ranks.filter(
+                Q(grade__lt=grade) | Q(grade=grade, modified__gte=modified),
+            ).order_by('position').first()
+            if first_below is not None:
+                position = first_below.position
+                if (first_below.grade, first_below.modified) != (grade, modified):
+                    position -= 1
+            else:
+                last = other_ranks.order_by('-position').first()
+                position = 1
+                if last is not None:
+                    position = last.position + other_ranks.filter(grade=last.grade, modified=last.modified).count()
+
+            cls.objects.create(
+                user_id=gradebook_entry.user_id,
+                course_id=course_key,
+                position=position,
+                grade=grade,
+                modified=modified,
+            )
+
+
+class StudentGradebookRankState(models.Model):
+    """
+    One row per course with materialized ranks, locked while the ranks of the course
+    change.  Records the aggregate exclusions the ranks were built for.
+    """
+    course_id = CourseKeyField(max_length=255, unique=True)
+    exclusion_digest = models.CharField(max_length=40, blank=True, default='')
+    modified = AutoLastModifiedField(_('modified'))
+
+
+class StudentGradebookCourseAggregate(models.Model):
+    """
+    Grade aggregates of the course-wide gradebook (aggregate exclusions applied, no other
+    filters), maintained as entries and enrollments change so that unfiltered course
+    averages are answered without scanning the course's entries.
+    """
+    course_id = CourseKeyField(max_length=255, unique=True)
+    grade_sum = models.FloatField(default=0.0)
+    grade_count = models.PositiveIntegerField(default=0)
+    grade_min = models.FloatField(null=True)
+    grade_max = models.FloatField(null=True)
+    enrollment_count = models.PositiveIntegerField(default=0)
+    modified = AutoLastModifiedField(_('modified'))
+
+    # tolerance of the drift check, as incremental sums accumulate rounding errors
+    GRADE_SUM_TOLERANCE = 1e-6
+
+    @classmethod
+    def is_enabled(cls):
+        """
+        Course aggregates are opt-in through the GRADEBOOK_COURSE_AGGREGATES setting
+        """
+        return getattr(settings, 'GRADEBOOK_COURSE_AGGREGATES', False)
+
+    @classmethod
+    def get_for_scope(cls, course_key, **kwargs):
+        """
+        Returns the course aggregate if it can answer a query with the given filters,
+        otherwise None
+        :param kwargs:
+            - `exclude_users`
+            - `group_ids`
+            - `org_ids`
+            - `cohort_user_ids`
+        """
+        if not cls.is_enabled() or not StudentGradebook._is_default_scope(course_key, **kwargs):
+            return None
+        return cls.objects.filter(course_id=course_key).first()
+
+    @classmethod
+    def compute(cls, course_key):
+        """
+        Returns the aggregate values of the course computed from the live gradebook
+        """
+        exclude_users = get_aggregate_exclusion_user_ids(course_key)
+        aggregates = StudentGradebook._build_queryset(course_key, exclude_users=exclude_users).aggregate(
+            Sum('grade'), Count('user'), Min('grade'), Max('grade')
+        )
+        return {
+            'grade_sum': aggregates['grade__sum'] or 0.0,
+            'grade_count': aggregates['user__count'],
+            'grade_min': aggregates['grade__min'],
+            'grade_max': aggregates['grade__max'],
+            'enrollment_count': StudentGradebook._build_enrollment_queryset(
+                course_key, exclude_users=exclude_users
+            ).count(),
+        }
+
+    @classmethod
+    def rebuild(cls, course_key):
+        """
+        Replaces the aggregate of a course with freshly computed values, and marks the grade
+        every entry is counted with
+        """
+        with transaction.atomic():
+            cls.objects.select_for_update().filter(course_id=course_key).first()
+            values = cls.compute(course_key)
+            StudentGradebook.objects.filter(course_id=course_key, aggregated_grade__isnull=False).update(
+                aggregated_grade=None
+            )
+            StudentGradebook._build_queryset(
+                course_key,
+                exclude_users=get_aggregate_exclusion_user_ids(course_key),
+            ).update(aggregated_grade=F('grade'))
+            course_aggregate, __ = cls.objects.update_or_create(course_id=course_key, defaults=values)
+        return course_aggregate
+
+    @classmethod
+    def check_drift(cls, course_key):
+        """
+        Compares the stored aggregate of a course against values computed from the live
+        gradebook.  Returns a dict of {field: (expected, stored)} for every mismatch.
+        """
+        expected = cls.compute(course_key)
+        course_aggregate = cls.objects.filter(course_id=course_key).first()
+        drift = {}
+        for field, expected_value in expected.items():
+            stored_value = getattr(course_aggregate, field) if course_aggregate else None
+            if field == 'grade_sum' and stored_value is not None:
+                if abs(expected_value - stored_value) > cls.GRADE_SUM_TOLERANCE:
+                    drift[field] = (expected_value, stored_value)
+            elif expected_value != stored_value:
+                drift[field] = (expected_value, stored_value)
+        return drift
+
+    @classmethod
+    def sync_entries(cls, course_key, gradebook_entry_ids, enrollment_delta=0):
+        """
+        Applies the stored grades of the given entries, and a change in the number of enrolled
+        users, to the course aggregate.  Under the lock of the aggregate row, each entry's
+        current grade and leaderboard membership is compared with the grade it was counted
+        with, so concurrent or repeated calls count every change exactly once.
+        """
+        with transaction.atomic():
+            course_aggregate = cls.objects.select_for_update().filter(course_id=course_key).first()
+            if course_aggregate is None:
+                cls.rebuild(course_key)
+                return
+
+            counted_ids = set(StudentGradebook._build_queryset(
+                course_key,
+                exclude_users=get_aggregate_exclusion_user_ids(course_key),
+            ).filter(pk__in=gradebook_entry_ids).values_list('pk', flat=True))
+            recompute_bounds = False
+            for pk, grade, aggregated_grade in StudentGradebook.objects.filter(
+                    pk__in=gradebook_entry_ids,
+            ).values_list('pk', 'grade', 'aggregated_grade'):
+                new_aggregated_grade = grade if pk in counted_ids else None
+                if new_aggregated_grade == aggregated_grade:
+                    continue
+                if aggregated_grade is not None:
+                    course_aggregate.grade_count -= 1
+                    course_aggregate.grade_sum -= aggregated_grade
+                    if aggregated_grade in (course_aggregate.grade_min, course_aggregate.grade_max):
+                        recompute_bounds = True
+                if new_aggregated_grade is not None:
+                    course_aggregate.grade_count += 1
+                    course_aggregate.grade_sum += new_aggregated_grade
+                    if course_aggregate.grade_min is None or new_aggregated_grade < course_aggregate.grade_min:
+                        course_aggregate.grade_min = new_aggregated_grade
+                    if course_aggregate.grade_max is None or new_aggregated_grade > course_aggregate.grade_max:
+                        course_aggregate.grade_max = new_aggregated_grade
+                StudentGradebook.objects.filter(pk=pk).update(aggregated_grade=new_aggregated_grade)
+
+            if recompute_bounds:
+                bounds = StudentGradebook.objects.filter(
+                    course_id=course_key, aggregated_grade__isnull=False,
+                ).aggregate(Min('aggregated_grade'), Max('aggregated_grade'))
+                course_aggregate.grade_min = bounds['aggregated_grade__min']
+                course_aggregate.grade_max = bounds['aggregated_grade__max']
+            course_aggregate.enrollment_count = max(course_aggregate.enrollment_count + enrollment_delta, 0)
+            course_aggregate.save()
+
+    @classmethod
+    def remove_entry(cls, gradebook_entry):
+        """
+        Takes a deleted gradebook entry out of the course aggregate
+        """
+        if 'aggregated_grade' in gradebook_entry.get_deferred_fields():
+            cls.rebuild(gradebook_entry.course_id)
+            return
+        aggregated_grade = gradebook_entry.aggregated_grade
+        if aggregated_grade is None:
+            return
+        with transaction.atomic():
+            course_aggregate = cls.objects.select_for_update().filter(course_id=gradebook_entry.course_id).first()
+            if course_aggregate is None:
+                return
+            course_aggregate.grade_count = max(course_aggregate.grade_count - 1, 0)
+            course_aggregate.grade_sum -= aggregated_grade
+            if aggregated_grade in (course_aggregate.grade_min, course_aggregate.grade_max):
+                bounds = StudentGradebook.objects.filter(
+                    course_id=gradebook_entry.course_id, aggregated_grade__isnull=False,
+                ).aggregate(Min('aggregated_grade'), Max('aggregated_grade'))
+                course_aggregate.grade_min = bounds['aggregated_grade__min']
+                course_aggregate.grade_max = bounds['aggregated_grade__max']
+            course_aggregate.save()
+
+    def as_aggregates(self):
+        """
+        Returns the values in the shape of the gradebook queryset aggregates
+        """
+        return {
+            'grade__avg': self.grade_sum / self.grade_count if self.grade_count else None,
+            'grade__max': self.grade_max,
+            'grade__min': self.grade_min,
+            'user__count': self.grade_count,
+        }
+
+
+class StudentGradebookHistory(DecodedSummariesMixin, TimeStampedModel):
     """
     A running audit trail for the StudentGradebook model.  Listens for
     post_save events and creates/stores copies of gradebook entries.
@@ -334,44 +1261,233 @@ class StudentGradebookHistory(TimeStampedModel):
     course_id = CourseKeyField(db_index=True, max_length=255, blank=True)
     grade = models.FloatField()
     proforma_grade = models.FloatField()
-    progress_summary = models.TextField(blank=True)
-    grade_summary = models.TextField()
-    grading_policy = models.TextField()
+    progress_summary = CompressedTextField(blank=True)
+    grade_summary = CompressedTextField()
+    grading_policy = GradingPolicyField()
     is_passed = models.BooleanField(db_index=True, default=False)
+    # content hash of the values above, see gradebook_fingerprint
+    fingerprint = models.CharField(max_length=40, blank=True, default='')
+
+    class Meta:
+        """
+        Meta information for this Django model
+        """
+        index_together = (('user', 'course_id'),)
+
+    @classmethod
+    def from_gradebook(cls, gradebook_entry):
+        """
+        Returns an unsaved copy of the gradebook entry
+        """
+        values = {field: getattr(gradebook_entry, field) for field in GRADEBOOK_VALUE_FIELDS}
+        return cls(
+            user_id=gradebook_entry.user_id,
+            course_id=gradebook_entry.course_id,
+            fingerprint=gradebook_fingerprint(values),
+            **values
+        )
 
     @receiver(post_save, sender=StudentGradebook)
     def save_history(sender, instance, **kwargs):  # pylint: disable=no-self-argument, unused-argument
         """
         Event hook for creating gradebook entry copies
         """
-        history_entries = StudentGradebookHistory.objects.filter(user=instance.user, course_id=instance.course_id)
-        latest_history_entry = None
-        if len(history_entries):
-            latest_history_entry = history_entries[0]
+        new_history_entry = StudentGradebookHistory.from_gradebook(instance)
+
+        # only the fingerprint of the latest entry is needed to detect a change
+        latest_history_entry = StudentGradebookHistory.objects.filter(
+            user_id=instance.user_id,
+            course_id=instance.course_id,
+        ).order_by('-id').values('id', 'fingerprint').first()
 
-        create_history_entry = False
+        create_history_entry = True
         if latest_history_entry is not None:
-            if (
-                latest_history_entry.grade != instance.grade or
-                latest_history_entry.proforma_grade != instance.proforma_grade or
-                latest_history_entry.progress_summary != instance.progress_summary or
-                latest_history_entry.grade_summary != instance.grade_summary or
-                latest_history_entry.grading_policy != instance.grading_policy or
-                latest_history_entry.is_passed != instance.is_passed
-            ):
-                create_history_entry = True
-        else:
-            create_history_entry = True
+            latest_fingerprint = latest_history_entry['fingerprint']
+            if not latest_fingerprint:
+                # entries written before fingerprints were stored
+                latest_fingerprint = gradebook_fingerprint(
+                    StudentGradebookHistory.objects.filter(
+                        id=latest_history_entry['id']
+                    ).values(*GRADEBOOK_VALUE_FIELDS).get()
+                )
+            create_history_entry = latest_fingerprint != new_history_entry.fingerprint
 
         if create_history_entry:
-            new_history_entry = StudentGradebookHistory(
-                user=instance.user,
-                course_id=instance.course_id,
-                grade=instance.grade,
-                proforma_grade=instance.proforma_grade,
-                progress_summary=instance.progress_summary,
-                grade_summary=instance.grade_summary,
-                grading_policy=instance.grading_policy,
-                is_passed=instance.is_passed
-            )
             new_history_entry.save()
+
+
+def is_previous_grade_needed(course_key):
+    """
+    Tells whether a save handler uses the previous grade of an entry: leaderboard
+    notifications, or a cached leaderboard cutoff or percentile histogram of the course
+    """
+    if settings.FEATURES.get('ENABLE_NOTIFICATIONS'):
+        return True
+    return bool(cache.get_many([
+        StudentGradebook._get_leaderboard_cutoff_cache_key(course_key),  # pylint: disable=protected-access
+        StudentGradebook._get_percentile_histogram_cache_key(course_key),  # pylint: disable=protected-access
+    ]))
+
+
+@receiver(pre_save, sender=StudentGradebook)
+def capture_previous_grade(sender, instance, **kwargs):  # pylint: disable=unused-argument
+    """
+    Event hook for remembering the stored grade of an entry about to be saved, None for
+    a new entry.  The grade loaded with the entry is reused; it is only read from the
+    database when the entry was not loaded from it and a save handler needs it.
+    """
+    instance.previous_grade = None
+    if instance.pk and not instance._state.adding:  # pylint: disable=protected-access
+        if hasattr(instance, '_loaded_grade'):
+            instance.previous_grade = instance._loaded_grade  # pylint: disable=protected-access
+        elif is_previous_grade_needed(instance.course_id):
+            instance.previous_grade = StudentGradebook.objects.filter(
+                pk=instance.pk
+            ).values_list('grade', flat=True).first()
+    instance._loaded_grade = instance.grade  # pylint: disable=protected-access
+
+
+@receiver(post_save, sender=StudentGradebook)
+def refresh_leaderboard_cutoff(sender, instance, **kwargs):  # pylint: disable=unused-argument
+    """
+    Event hook for dropping the cached leaderboard cutoff once a save reaches the leaderboard
+    """
+    previous_grade = getattr(instance, 'previous_grade', None) or 0.0
+    if not (
+        StudentGradebook.is_below_leaderboard_cutoff(instance.course_id, previous_grade, cached_only=True) and
+        StudentGradebook.is_below_leaderboard_cutoff(instance.course_id, instance.grade, cached_only=True)
+    ):
+        StudentGradebook.invalidate_leaderboard_cutoff(instance.course_id)
+
+
+@receiver(post_save, sender=StudentGradebook)
+def update_materialized_rank(sender, instance, **kwargs):  # pylint: disable=unused-argument
+    """
+    Event hook for keeping the materialized rank in step with the saved entry
+    """
+    if StudentGradebookRank.is_enabled():
+        StudentGradebookRank.update_entry(instance)
+
+
+@receiver(post_save, sender=StudentGradebook)
+def update_percentile_histogram(sender, instance, **kwargs):  # pylint: disable=unused-argument
+    """
+    Event hook for keeping the cached percentile histogram in step with the saved entry
+    """
+    StudentGradebook.update_percentile_histogram(instance, getattr(instance, 'previous_grade', None))
+
+
+@receiver(post_delete, sender=StudentGradebook)
+def remove_materialized_rank(sender, instance, **kwargs):  # pylint: disable=unused-argument
+    """
+    Event hook for removing the materialized rank of a deleted entry
+    """
+    if is_course_being_deleted(instance.course_id):
+        return
+    StudentGradebook.invalidate_leaderboard_cutoff(instance.course_id)
+    StudentGradebook.invalidate_percentile_histogram(instance.course_id)
+    if StudentGradebookRank.is_enabled():
+        StudentGradebookRank.remove_entry(instance.course_id, instance.user_id)
+
+
+@receiver(pre_save, sender=StudentGradebook)
+def initialize_active_enrollment(sender, instance, **kwargs):  # pylint: disable=unused-argument
+    """
+    Event hook for setting the active enrollment flag of a new entry
+    """
+    if instance._state.adding:  # pylint: disable=protected-access
+        instance.is_active_enrollment = CourseEnrollment.objects.filter(
+            user_id=instance.user_id,
+            course_id=instance.course_id,
+            is_active=True,
+            user__is_active=True,
+        ).exists()
+
+
+def sync_active_enrollment(gradebook_entries):
+    """
+    Recomputes the active enrollment flag of the given entries and refreshes the derived
+    data of those whose flag changed
+    """
+    changed_entry_ids = list(gradebook_entries.exclude(
+        is_active_enrollment=StudentGradebook.active_enrollment_expression()
+    ).values_list('id', flat=True))
+    if not changed_entry_ids:
+        return
+    changed_entries = StudentGradebook.objects.filter(id__in=changed_entry_ids)
+    changed_entries.update(is_active_enrollment=StudentGradebook.active_enrollment_expression())
+
+    # the derived data is refreshed from the entries as stored now, not as first read
+    changed_entries = list(changed_entries.only('id', 'user_id', 'course_id', 'grade', 'modified'))
+    for course_key in {gradebook_entry.course_id for gradebook_entry in changed_entries}:
+        StudentGradebook.invalidate_leaderboard_cutoff(course_key)
+        StudentGradebook.invalidate_percentile_histogram(course_key)
+        if StudentGradebookCourseAggregate.is_enabled():
+            StudentGradebookCourseAggregate.sync_entries(course_key, [
+                gradebook_entry.id for gradebook_entry in changed_entries if gradebook_entry.course_id == course_key
+            ])
+    if StudentGradebookRank.is_enabled():
+        for gradebook_entry in changed_entries:
+            StudentGradebookRank.update_entry(gradebook_entry)
+
+
+@receiver(pre_save, sender=CourseEnrollment)
+def capture_previous_enrollment(sender, instance, **kwargs):  # pylint: disable=unused-argument
+    """
+    Event hook for remembering whether an enrollment about to be saved was active,
+    which tells the change of the enrolled count of the course aggregate
+    """
+    if StudentGradebookCourseAggregate.is_enabled():
+        instance.previous_is_active = bool(instance.pk) and CourseEnrollment.objects.filter(
+            pk=instance.pk, is_active=True,
+        ).exists()
+
+
+@receiver(post_save, sender=CourseEnrollment)
+def sync_enrollment_active_enrollment(sender, instance, **kwargs):  # pylint: disable=unused-argument
+    """
+    Event hook for keeping the active enrollment flag and the enrolled count of the course
+    aggregate in step with the enrollment, and dropping the leaderboard cutoff and the
+    percentile histogram, which both depend on who is enrolled
+    """
+    StudentGradebook.invalidate_leaderboard_cutoff(instance.course_id)
+    StudentGradebook.invalidate_percentile_histogram(instance.course_id)
+    sync_active_enrollment(StudentGradebook.objects.filter(user_id=instance.user_id, course_id=instance.course_id))
+
+    previous_is_active = getattr(instance, 'previous_is_active', None)
+    if StudentGradebookCourseAggregate.is_enabled() and previous_is_active is not None:
+        enrollment_delta = int(bool(instance.is_active)) - int(previous_is_active)
+        if enrollment_delta and instance.user_id not in get_aggregate_exclusion_user_ids(instance.course_id):
+            StudentGradebookCourseAggregate.sync_entries(instance.course_id, [], enrollment_delta)
+
+
+@receiver(post_save, sender=User)
+def sync_user_active_enrollment(sender, instance, update_fields=None, **kwargs):  # pylint: disable=unused-argument
+    """
+    Event hook for keeping the active enrollment flag in step with user activation
+    """
+    if update_fields and 'is_active' not in update_fields:
+        return
+    gradebook_entries = StudentGradebook.objects.filter(user_id=instance.id)
+    sync_active_enrollment(gradebook_entries)
+    # the leaderboards the user appears on
+    for course_key in gradebook_entries.values_list('course_id', flat=True):
+        StudentGradebook.invalidate_leaderboard_cutoff(course_key)
+
+
+@receiver(post_save, sender=StudentGradebook)
+def update_course_aggregate(sender, instance, **kwargs):  # pylint: disable=unused-argument
+    """
+    Event hook for applying a saved entry to the course aggregate
+    """
+    if StudentGradebookCourseAggregate.is_enabled():
+        StudentGradebookCourseAggregate.sync_entries(instance.course_id, [instance.pk])
+
+
+@receiver(post_delete, sender=StudentGradebook)
+def remove_from_course_aggregate(sender, instance, **kwargs):  # pylint: disable=unused-argument
+    """
+    Event hook for taking a deleted entry out of the course aggregate
+    """
+    if StudentGradebookCourseAggregate.is_enabled() and not is_course_being_deleted(instance.course_id):
+        StudentGradebookCourseAggregate.remove_entry(instance)
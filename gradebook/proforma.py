@@ -0,0 +1,98 @@
+"""
+Batch calculation of proforma grades for the learners of a course.  The graded totals of
+all learners are packed into arrays, one set per grader category, so that the proforma
+grades of a whole chunk of learners take a few array operations per subsection column.
+Every learner's values are combined in the same order as calculate_proforma_grade does,
+so the results are identical to it, not just close.
+"""
+import numpy as np
+
+
+def pack_graded_subsections(course_grades, categories):
+    """
+    Returns a boolean array telling which learners have any graded subsection, and the
+    (earned, possible, attempted) arrays of every category, of shape (learners, items).
+    Items keep each learner's subsection order; shorter rows are padded with unattempted items.
+    """
+    learners = len(course_grades)
+    has_subsections = np.zeros(learners, dtype=bool)
+    graded_totals = {category: [] for category in categories}
+    for index, course_grade in enumerate(course_grades):
+        graded_subsections = course_grade.graded_subsections_by_format
+        has_subsections[index] = bool(graded_subsections)
+        for category, learner_totals in graded_totals.items():
+            learner_totals.append([
+                subsection_grade.graded_total
+                for subsection_grade in (graded_subsections.get(category) or {}).values()
+            ])
+
+    packed = {}
+    for category, learner_totals in graded_totals.items():
+        items = max((len(totals) for totals in learner_totals), default=0)
+        earned = np.zeros((learners, items))
+        possible = np.ones((learners, items))
+        attempted = np.zeros((learners, items), dtype=bool)
+        for index, totals in enumerate(learner_totals):
+            for column, graded_total in enumerate(totals):
+                earned[index, column] = graded_total.earned
+                possible[index, column] = graded_total.possible
+                attempted[index, column] = bool(graded_total.first_attempted)
+        packed[category] = (earned, possible, attempted)
+    return has_subsections, packed
+
+
+def compute_proforma_grades(has_subsections, packed, grading_policy):
+    """
+    Returns the proforma grades of packed learners as an array, see calculate_proforma_grade
+    """
+    graders = grading_policy['GRADER']
+    learners = len(has_subsections)
+    proforma_grades = np.zeros(learners)
+    averages_total = np.zeros(learners)
+    averages_count = np.zeros(learners, dtype=int)
+    scored_categories = []
+    for grader in graders:
+        earned, possible, attempted = packed[grader['type']]
+        if np.any(attempted & (possible == 0)):
+            raise ZeroDivisionError('attempted {} item without possible score'.format(grader['type']))
+
+        item_total = np.zeros(learners)
+        items_considered = np.zeros(learners, dtype=int)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for column in range(earned.shape[1]):
+                column_attempted = attempted[:, column]
+                item_total = np.where(
+                    column_attempted, item_total + earned[:, column] / possible[:, column], item_total
+                )
+                items_considered += column_attempted
+
+        scored = items_considered > 0
+        category_average = np.divide(item_total, items_considered, out=np.zeros(learners), where=scored)
+        proforma_grades = np.where(scored, proforma_grades + category_average * grader['weight'], proforma_grades)
+        averages_total = np.where(scored, averages_total + category_average, averages_total)
+        averages_count += scored
+        scored_categories.append(scored)
+
+    assumed_average = np.divide(
+        averages_total, averages_count, out=np.zeros(learners), where=averages_count > 0
+    )
+    # unscored categories are estimated with the weight of the first grader of their type
+    category_weights = {}
+    for grader in graders:
+        category_weights.setdefault(grader['type'], grader['weight'])
+    for grader, scored in zip(graders, scored_categories):
+        proforma_grades = np.where(
+            scored, proforma_grades, proforma_grades + assumed_average * category_weights[grader['type']]
+        )
+    return np.where(has_subsections, proforma_grades, 0.0)
+
+
+def calculate_proforma_grades(course_grades, grading_policy):
+    """
+    Returns the proforma grade of every CourseGrade, in order, as calculate_proforma_grade
+    would calculate them one by one
+    """
+    has_subsections, packed = pack_graded_subsections(
+        course_grades, [grader['type'] for grader in grading_policy['GRADER']]
+    )
+    return [float(proforma_grade) for proforma_grade in compute_proforma_grades(has_subsections, packed, grading_policy)]
@@ -0,0 +1,127 @@
+"""
+Offline regrading of a course from the section scores stored in gradebook progress
+summaries.  Grades are recomputed for a new grading policy with the platform graders,
+without loading the course from the modulestore or reading any learner's scores.
+"""
+import json
+from collections import OrderedDict, namedtuple
+
+from gradebook.models import StudentGradebook
+from gradebook.proforma import calculate_proforma_grades
+from gradebook.utils import (bulk_save_user_gradebooks,
+                             finish_bulk_gradebook_update, get_json_data)
+from openedx.core.lib.grade_utils import compute_percent, round_away_from_zero
+from xmodule.graders import grader_from_conf
+
+StoredScore = namedtuple('StoredScore', ['earned', 'possible', 'graded', 'first_attempted'])
+
+
+class StoredSubsectionGrade:
+    """
+    Subsection grade rebuilt from a progress summary section, with the attributes read by
+    the graders and by calculate_proforma_grade
+    """
+
+    def __init__(self, section):
+        self.location = section['location']
+        self.display_name = section['display_name']
+        self.graded_total = StoredScore(*section['graded_total'])
+        self.percent_graded = compute_percent(self.graded_total.earned, self.graded_total.possible)
+
+
+class StoredCourseGrade:
+    """
+    Course grade rebuilt from a stored progress summary
+    """
+
+    def __init__(self, progress_summary):
+        self.graded_subsections_by_format = OrderedDict()
+        for chapter in json.loads(progress_summary or '[]'):
+            for section in chapter['sections']:
+                if section['graded']:
+                    self.graded_subsections_by_format.setdefault(section['format'], OrderedDict())[
+                        section['location']
+                    ] = StoredSubsectionGrade(section)
+
+
+def get_passing_cutoff(grade_cutoffs):
+    """
+    Returns the lowest non-zero grade cutoff, the grade from which a learner passes as
+    CourseGrade.passed decides it, or None if no grade passes
+    """
+    nonzero_cutoffs = [cutoff for cutoff in grade_cutoffs.values() if cutoff > 0]
+    return min(nonzero_cutoffs) if nonzero_cutoffs else None
+
+
+def get_letter_grade(grade_cutoffs, percent):
+    """
+    Returns the highest letter grade whose cutoff the percent reaches, None if it reaches none
+    """
+    for letter_grade in sorted(grade_cutoffs, key=grade_cutoffs.get, reverse=True):
+        if percent >= grade_cutoffs[letter_grade]:
+            return letter_grade
+    return None
+
+
+def replay_course_grade(course_grade, grader, grade_cutoffs):
+    """
+    Returns the grade summary, grade and pass status of a stored course grade under the
+    given grader and cutoffs, computed as CourseGrade does
+    """
+    grade_summary = grader.grade(course_grade.graded_subsections_by_format, generate_random_scores=False)
+    # see CourseGrade._compute_percent for the added .05
+    percent = round_away_from_zero(grade_summary['percent'] * 100 + 0.05) / 100
+    grade_summary['percent'] = percent
+    grade_summary['grade'] = get_letter_grade(grade_cutoffs, percent)
+    passing_cutoff = get_passing_cutoff(grade_cutoffs)
+    return grade_summary, percent, passing_cutoff is not None and percent >= passing_cutoff
+
+
+def replay_course_gradebook(course_key, grading_policy, chunk_size=500, dry_run=False):
+    """
+    Recomputes the grade, proforma grade, grade summary and pass status of every gradebook
+    entry of the course from its stored progress summary under `grading_policy`, a dict with
+    the GRADER and GRADE_CUTOFFS of the course.  Entries are read in id-ordered chunks and
+    written in bulk.  Returns the number of entries replayed and of entries whose grades changed.
+    """
+    grader = grader_from_conf(grading_policy['GRADER'])
+    grade_cutoffs = grading_policy['GRADE_CUTOFFS']
+    grading_policy_json = get_json_data(grading_policy)
+    gradebook_entries = StudentGradebook.objects.filter(course_id=course_key)
+
+    entries_replayed = 0
+    entries_changed = 0
+    last_id = 0
+    while True:
+        rows = list(gradebook_entries.filter(id__gt=last_id).order_by('id').values_list(
+            'id', 'user_id', 'progress_summary', 'grade', 'proforma_grade', 'is_passed'
+        )[:chunk_size])
+        if not rows:
+            break
+        last_id = rows[-1][0]
+
+        course_grades = [StoredCourseGrade(progress_summary) for __, __, progress_summary, __, __, __ in rows]
+        proforma_grades = calculate_proforma_grades(course_grades, grading_policy)
+        gradebook_values = {}
+        for (__, user_id, progress_summary, grade, proforma_grade, is_passed), course_grade, new_proforma_grade in zip(
+                rows, course_grades, proforma_grades
+        ):
+            grade_summary, new_grade, new_is_passed = replay_course_grade(course_grade, grader, grade_cutoffs)
+            gradebook_values[user_id] = {
+                'grade': new_grade,
+                'proforma_grade': new_proforma_grade,
+                'progress_summary': progress_summary,
+                'grade_summary': get_json_data(grade_summary),
+                'grading_policy': grading_policy_json,
+                'is_passed': new_is_passed,
+            }
+            if (grade, proforma_grade, is_passed) != (new_grade, new_proforma_grade, new_is_passed):
+                entries_changed += 1
+
+        if not dry_run:
+            bulk_save_user_gradebooks(course_key, gradebook_values)
+        entries_replayed += len(rows)
+
+    if not dry_run:
+        finish_bulk_gradebook_update(course_key)
+    return entries_replayed, entries_changed
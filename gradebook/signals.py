@@ -14,7 +14,7 @@ from edx_notifications.lib.publisher import (get_notification_type,
 from edx_solutions_api_integration.utils import (
     get_aggregate_exclusion_user_ids, invalid_user_data_cache)
 from gradebook.models import StudentGradebook, StudentGradebookHistory
-from gradebook.tasks import update_user_gradebook
+from gradebook.tasks import enqueue_user_gradebook_update
 from lms.djangoapps.grades.signals.signals import PROBLEM_WEIGHTED_SCORE_CHANGED
 from xmodule.modulestore.django import SignalHandler
 
@@ -24,11 +24,12 @@ log = logging.getLogger(__name__)
 @receiver(PROBLEM_WEIGHTED_SCORE_CHANGED)
 def on_course_grade_changed(**kwargs):
     """
-    Listens for a 'COURSE_GRADE_CHANGED' signal invoke grade book update task
+    Listens for a 'COURSE_GRADE_CHANGED' signal invoke grade book update task,
+    coalescing it with any update already pending for the same course and user
     """
     user_id = kwargs.get('user_id')
     course_id = kwargs.get('course_id')
-    update_user_gradebook.delay(course_id, user_id)
+    enqueue_user_gradebook_update(course_id, user_id)
 
 
 @receiver(SignalHandler.course_deleted)
@@ -38,7 +39,7 @@ def on_course_deleted(sender, **kwargs):  # pylint: disable=W0613
     removes model entries for the specified course
     """
     course_key = kwargs['course_key']
-    StudentGradebook.objects.filter(course_id=course_key).delete()
+    StudentGradebook.delete_course_entries(course_key)
     StudentGradebookHistory.objects.filter(course_id=course_key).delete()
 
 
@@ -54,6 +55,17 @@ def handle_studentgradebook_pre_save_signal(sender, instance, **kwargs):
     """
 
     if settings.FEATURES['ENABLE_NOTIFICATIONS']:
+        # an entry below the leaderboard cutoff both before and after the save cannot
+        # enter the leaderboard, so there is no need to rank it
+        previous_grade = getattr(instance, 'previous_grade', None) or 0.0
+        instance.below_leaderboard_cutoff = (
+            StudentGradebook.is_below_leaderboard_cutoff(instance.course_id, previous_grade) and
+            StudentGradebook.is_below_leaderboard_cutoff(instance.course_id, instance.grade)
+        )
+        if instance.below_leaderboard_cutoff:
+            instance.presave_leaderboard_rank = 0
+            return
+
         # attach the rank of the user before the save is completed
         data = StudentGradebook.get_user_position(
             instance.course_id,
@@ -74,7 +86,7 @@ def handle_studentgradebook_post_save_signal(sender, instance, **kwargs):
     """
     invalid_user_data_cache('grade', instance.course_id, instance.user.id)
 
-    if settings.FEATURES['ENABLE_NOTIFICATIONS']:
+    if settings.FEATURES['ENABLE_NOTIFICATIONS'] and not getattr(instance, 'below_leaderboard_cutoff', False):
         # attach the rank of the user before the save is completed
         data = StudentGradebook.get_user_position(
             instance.course_id,
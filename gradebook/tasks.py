@@ -1,18 +1,49 @@
 """
 This module has implementation of celery tasks for learner gradebook use cases
 """
-import json
 import logging
 
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.cache import cache
 
 from celery.task import task  # pylint: disable=import-error,no-name-in-module
-from gradebook.utils import generate_user_gradebook
+from gradebook import instrumentation
+from gradebook.utils import generate_user_gradebook, regrade_users
 from opaque_keys.edx.keys import CourseKey
 
 log = logging.getLogger('edx.celery.task')
 
 
+def _get_coalesce_cache_keys(course_key, user_id):
+    """
+    Returns the (in-flight, dirty) cache keys used to coalesce gradebook updates
+    """
+    cache_key = 'gradebook.update_user_gradebook.{}.{}'.format(course_key, user_id)
+    return '{}.inflight'.format(cache_key), '{}.dirty'.format(cache_key)
+
+
+def enqueue_user_gradebook_update(course_key, user_id):
+    """
+    Queues update_user_gradebook for the user unless a task for the same course
+    and user is already queued or running.  In that case the pending task is only
+    flagged dirty, which makes it run once more after it finishes.
+
+    Coalescing is disabled by setting GRADEBOOK_TASK_COALESCE_TIMEOUT to 0; otherwise
+    the setting bounds (in seconds) how long a lost task can hold back new ones.
+    """
+    timeout = getattr(settings, 'GRADEBOOK_TASK_COALESCE_TIMEOUT', 300)
+    if not timeout:
+        update_user_gradebook.delay(course_key, user_id)
+        return
+
+    inflight_key, dirty_key = _get_coalesce_cache_keys(course_key, user_id)
+    if cache.add(inflight_key, True, timeout):
+        update_user_gradebook.delay(course_key, user_id)
+    else:
+        cache.set(dirty_key, True, timeout)
+
+
 @task(name='lms.djangoapps.gradebook.tasks.update_user_gradebook')
 def update_user_gradebook(course_key, user_id):
     """
@@ -21,10 +52,34 @@ def update_user_gradebook(course_key, user_id):
     if not isinstance(course_key, str):
         raise ValueError('course_key must be a string. {} is not acceptable.'.format(type(course_key)))
 
-    course_key = CourseKey.from_string(course_key)
+    inflight_key, dirty_key = _get_coalesce_cache_keys(course_key, user_id)
+    # changes signalled before this point are picked up by the grade read below
+    cache.delete(dirty_key)
+
     try:
         user = User.objects.get(id=user_id)
-        generate_user_gradebook(course_key, user)
+        generate_user_gradebook(CourseKey.from_string(course_key), user)
     except Exception as ex:
-        log.exception('An error occurred while generating gradebook: %s', ex.message)
+        log.exception('An error occurred while generating gradebook: %s', str(ex))
         raise
+    finally:
+        # release the slot before looking for changes signalled while running, so a
+        # signal arriving in between either sees no task in flight or is seen here
+        cache.delete(inflight_key)
+        if cache.get(dirty_key):
+            cache.delete(dirty_key)
+            enqueue_user_gradebook_update(course_key, user_id)
+
+
+@task(name='lms.djangoapps.gradebook.tasks.regrade_course_chunk')
+def regrade_course_chunk(course_key, user_ids, bulk=False):
+    """
+    Task to recalculate the gradebook entries of a chunk of users in a course
+    """
+    if not isinstance(course_key, str):
+        raise ValueError('course_key must be a string. {} is not acceptable.'.format(type(course_key)))
+
+    users_regraded, failed_user_ids = regrade_users(CourseKey.from_string(course_key), user_ids, bulk=bulk)
+    stages = instrumentation.pop_summary()
+    instrumentation.log_summary(log, stages)
+    return {'regraded': users_regraded, 'failed': failed_user_ids, 'stages': stages}
@@ -3,10 +3,22 @@
 Run these tests @ Devstack:
     paver test_system -s lms --test_id=lms/djangoapps/gradebook/tests.py
 """
+import csv
 import json
+import os
+import random
+import tempfile
+import time
+from collections import OrderedDict
 from datetime import datetime
+from io import StringIO
+from types import SimpleNamespace
 
 from django.conf import settings
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase
+from django.test.utils import override_settings
 from pytz import utc
 
 from lms.djangoapps.courseware.tests.factories import StaffFactory
@@ -14,14 +26,37 @@ from edx_notifications.lib.consumer import get_notifications_count_for_user
 from edx_notifications.startup import initialize as initialize_notifications
 from edx_solutions_api_integration.test_utils import (
     CourseGradingMixin, SignalDisconnectTestMixin, make_non_atomic)
+from edx_solutions_api_integration.utils import get_aggregate_exclusion_user_ids
 from freezegun import freeze_time
-from gradebook.models import StudentGradebook, StudentGradebookHistory
-from mock import MagicMock, patch
+from gradebook import instrumentation
+from gradebook.fields import (COMPRESSED_TEXT_PREFIX,
+                              GRADING_POLICY_REFERENCE_PREFIX)
+from gradebook.management.commands.benchmark_gradebook_json import \
+    build_progress_summary
+from gradebook.management.commands.regrade_course import RegradeCheckpoint
+from gradebook.management.synthetic import get_synthetic_course_key
+from gradebook.models import (GradebookGradingPolicy, StudentGradebook,
+                              StudentGradebookCourseAggregate,
+                              StudentGradebookHistory, StudentGradebookRank,
+                              capture_previous_grade, gradebook_fingerprint)
+from gradebook.proforma import calculate_proforma_grades
+from gradebook.replay import replay_course_gradebook
+from gradebook.tasks import enqueue_user_gradebook_update, update_user_gradebook
+from gradebook.utils import (CourseGradingContextCache,
+                             bulk_save_user_gradebooks,
+                             calculate_proforma_grade, filter_stale_users,
+                             generate_user_gradebook, get_json_data,
+                             iter_keyset_chunks, make_courseware_summary)
+from mock import patch
+from openedx.core.djangoapps.content.course_overviews.models import CourseOverview
+from student.models import CourseEnrollment
 from student.tests.factories import (AdminFactory, CourseEnrollmentFactory,
                                      UserFactory)
+from xmodule.modulestore import EdxJSONEncoder
 from xmodule.modulestore.django import SignalHandler
 from xmodule.modulestore.tests.django_utils import (
     TEST_DATA_SPLIT_MODULESTORE, ModuleStoreTestCase)
+from xmodule.modulestore.tests.factories import CourseFactory
 
 
 class GradebookTests(SignalDisconnectTestMixin, CourseGradingMixin, ModuleStoreTestCase):
@@ -270,10 +305,36 @@ class GradebookTests(SignalDisconnectTestMixin, CourseGradingMixin, ModuleStoreT
         user = UserFactory()
         module = self.get_module_for_user(user, course, course.homework_assignment)
         grade_dict = {'value': 0.75, 'max_value': 1, 'user_id': user.id}
-        with patch('gradebook.signals.update_user_gradebook.delay') as mock_task:
+        with patch('gradebook.tasks.update_user_gradebook.delay') as mock_task:
             module.system.publish(module, 'grade', grade_dict)
             mock_task.assert_called_with(str(course.id), user.id)
 
+    def test_update_user_gradebook_task_coalescing(self):
+        """
+        Tests repeated signals for the same user only queue one task plus one trailing rerun
+        """
+        course_id = 'course-v1:edX+Coalesce+2020'
+
+        def regrade_with_new_scores(*args):  # pylint: disable=unused-argument
+            enqueue_user_gradebook_update(course_id, self.user.id)
+            enqueue_user_gradebook_update(course_id, self.user.id)
+
+        with patch('gradebook.tasks.update_user_gradebook.delay') as mock_task:
+            enqueue_user_gradebook_update(course_id, self.user.id)
+            enqueue_user_gradebook_update(course_id, self.user.id)
+            self.assertEqual(mock_task.call_count, 1)
+
+            with patch('gradebook.tasks.generate_user_gradebook') as mock_generate:
+                update_user_gradebook(course_id, self.user.id)
+                self.assertEqual(mock_generate.call_count, 1)
+            self.assertEqual(mock_task.call_count, 1)
+
+            enqueue_user_gradebook_update(course_id, self.user.id)
+            self.assertEqual(mock_task.call_count, 2)
+            with patch('gradebook.tasks.generate_user_gradebook', side_effect=regrade_with_new_scores):
+                update_user_gradebook(course_id, self.user.id)
+            self.assertEqual(mock_task.call_count, 3)
+
     @patch.dict(settings.FEATURES, {
         'ALLOW_STUDENT_STATE_UPDATES_ON_CLOSED_COURSE': False,
         'SIGNAL_ON_SCORE_CHANGED': True
@@ -329,3 +390,1075 @@ class GradebookTests(SignalDisconnectTestMixin, CourseGradingMixin, ModuleStoreT
             course2.id, exclude_users=[self.user.id]
         ).count()
         self.assertEqual(passed_count, 0)
+
+
+@override_settings(GRADEBOOK_MATERIALIZED_RANKS=True)
+class GradebookRankTests(ModuleStoreTestCase):
+    """ Test suite for materialized gradebook ranks """
+
+    def setUp(self):
+        super().setUp()
+        self.course = CourseFactory.create()
+        self.users = [UserFactory() for __ in range(4)]
+        for user in self.users:
+            CourseEnrollmentFactory.create(user=user, course_id=self.course.id)
+
+    def _set_grade(self, user, grade):
+        """
+        creates or updates the user's gradebook entry with the given grade
+        """
+        gradebook, __ = StudentGradebook.objects.get_or_create(
+            user=user,
+            course_id=self.course.id,
+            defaults={'grade': grade, 'proforma_grade': grade, 'grade_summary': '{}', 'grading_policy': '{}'}
+        )
+        gradebook.grade = grade
+        gradebook.save()
+
+    def _get_position(self, user):
+        return StudentGradebook.get_user_position(
+            self.course.id,
+            user_id=user.id,
+            exclude_users=get_aggregate_exclusion_user_ids(self.course.id)
+        )['user_position']
+
+    def test_ranks_follow_grade_changes(self):
+        for user, grade in zip(self.users, [0.5, 0.9, 0.5, 0.2]):
+            self._set_grade(user, grade)
+        self.assertEqual(StudentGradebookRank.check_consistency(self.course.id), [])
+        self.assertEqual(self._get_position(self.users[1]), 1)
+        self.assertEqual(self._get_position(self.users[3]), 4)
+
+        self._set_grade(self.users[3], 0.95)
+        self._set_grade(self.users[1], 0.1)
+        self.assertEqual(StudentGradebookRank.check_consistency(self.course.id), [])
+        self.assertEqual(self._get_position(self.users[3]), 1)
+        self.assertEqual(self._get_position(self.users[1]), 4)
+
+        StudentGradebook.objects.get(user=self.users[3], course_id=self.course.id).delete()
+        self.assertEqual(StudentGradebookRank.check_consistency(self.course.id), [])
+        self.assertEqual(self._get_position(self.users[1]), 3)
+
+    def test_rebuild_repairs_drift(self):
+        for user, grade in zip(self.users, [0.3, 0.6, 0.9, 0.1]):
+            self._set_grade(user, grade)
+        StudentGradebookRank.objects.filter(course_id=self.course.id).update(position=1)
+        self.assertEqual(len(StudentGradebookRank.check_consistency(self.course.id)), 3)
+
+        self.assertEqual(StudentGradebookRank.rebuild(self.course.id), 4)
+        self.assertEqual(StudentGradebookRank.check_consistency(self.course.id), [])
+        self.assertEqual(self._get_position(self.users[2]), 1)
+
+    def test_exclusion_change_rebuilds_ranks(self):
+        for user, grade in zip(self.users, [0.5, 0.9, 0.5, 0.2]):
+            self._set_grade(user, grade)
+        with patch('gradebook.models.get_aggregate_exclusion_user_ids', return_value=[self.users[1].id]):
+            # ranks built for the previous exclusions are not read
+            self.assertEqual(self._get_position(self.users[0]), 1)
+
+            self._set_grade(self.users[3], 0.3)
+            self.assertEqual(StudentGradebookRank.check_consistency(self.course.id), [])
+            self.assertFalse(StudentGradebookRank.objects.filter(user=self.users[1]).exists())
+            self.assertEqual(self._get_position(self.users[3]), 3)
+
+    def test_course_entries_are_deleted_without_per_row_rank_updates(self):
+        for user, grade in zip(self.users, [0.5, 0.9, 0.5, 0.2]):
+            self._set_grade(user, grade)
+        with patch.object(StudentGradebookRank, 'remove_entry') as mock_remove_entry:
+            StudentGradebook.delete_course_entries(self.course.id)
+        self.assertFalse(mock_remove_entry.called)
+        self.assertFalse(StudentGradebook.objects.filter(course_id=self.course.id).exists())
+        self.assertFalse(StudentGradebookRank.objects.filter(course_id=self.course.id).exists())
+
+    def test_batch_positions_match_single_positions(self):
+        for user, grade in zip(self.users, [0.5, 0.8, 0.5]):
+            self._set_grade(user, grade)
+        user_ids = [user.id for user in self.users] + [UserFactory().id]
+        expected = {
+            user_id: StudentGradebook.get_user_position(self.course.id, user_id=user_id, exclude_users=[])
+            for user_id in user_ids
+        }
+        with override_settings(GRADEBOOK_MATERIALIZED_RANKS=False):
+            # the entries, the window ranking and one count for the users outside it
+            with self.assertNumQueries(3):
+                positions = StudentGradebook.get_user_positions(self.course.id, user_ids, exclude_users=[])
+            self.assertEqual(positions, expected)
+            with patch.object(connection.features, 'supports_over_clause', False):
+                with self.assertNumQueries(2):
+                    positions = StudentGradebook.get_user_positions(self.course.id, user_ids, exclude_users=[])
+                self.assertEqual(positions, expected)
+
+
+class GradebookGradeLookupTests(ModuleStoreTestCase):
+    """ Test suite for bulk gradebook grade lookups """
+
+    def setUp(self):
+        super().setUp()
+        self.course = CourseFactory.create()
+        self.users = [UserFactory() for __ in range(4)]
+
+    def test_bulk_grade_lookup(self):
+        other_course = CourseFactory.create()
+        for user, grade in zip(self.users, [0.5, 0.8, 0.3]):
+            StudentGradebook.objects.create(
+                user=user, course_id=self.course.id, grade=grade, proforma_grade=grade,
+                grade_summary='{}', grading_policy='{}'
+            )
+        StudentGradebook.objects.create(
+            user=self.users[0], course_id=other_course.id, grade=0.7, proforma_grade=0.9, is_passed=True,
+            grade_summary='{}', grading_policy='{}'
+        )
+        # one chunk of course keys by two chunks of user ids
+        with self.assertNumQueries(2):
+            grades = StudentGradebook.get_user_grades(
+                [self.course.id, other_course.id], [user.id for user in self.users], chunk_size=2
+            )
+        self.assertEqual(len(grades), 4)
+        self.assertEqual(
+            grades[(other_course.id, self.users[0].id)],
+            {'grade': 0.7, 'proforma_grade': 0.9, 'is_passed': True}
+        )
+        self.assertEqual(grades[(self.course.id, self.users[2].id)]['grade'], 0.3)
+        self.assertNotIn((self.course.id, self.users[3].id), grades)
+
+
+class GradebookBulkWriteTests(ModuleStoreTestCase):
+    """ Test suite for bulk gradebook writes """
+
+    def setUp(self):
+        super().setUp()
+        self.course = CourseFactory.create()
+        self.users = [UserFactory() for __ in range(3)]
+
+    def _get_values(self, grade):
+        return {
+            'grade': grade,
+            'proforma_grade': grade,
+            'progress_summary': '[]',
+            'grade_summary': '{}',
+            'grading_policy': '{}',
+            'is_passed': grade >= 0.5,
+        }
+
+    def test_bulk_save_writes_only_changed_entries(self):
+        updated_user_ids = bulk_save_user_gradebooks(
+            self.course.id, {user.id: self._get_values(0.4) for user in self.users}
+        )
+        self.assertEqual(sorted(updated_user_ids), sorted(user.id for user in self.users))
+        self.assertEqual(StudentGradebook.objects.filter(course_id=self.course.id).count(), 3)
+        self.assertEqual(StudentGradebookHistory.objects.filter(course_id=self.course.id).count(), 3)
+
+        updated_user_ids = bulk_save_user_gradebooks(self.course.id, {
+            self.users[0].id: self._get_values(0.4),
+            self.users[1].id: self._get_values(0.8),
+        })
+        self.assertEqual(updated_user_ids, [self.users[1].id])
+        gradebook = StudentGradebook.objects.get(user=self.users[1], course_id=self.course.id)
+        self.assertEqual(gradebook.grade, 0.8)
+        self.assertTrue(gradebook.is_passed)
+        self.assertEqual(StudentGradebookHistory.objects.filter(course_id=self.course.id).count(), 4)
+
+    def test_concurrently_created_entries_are_updated(self):
+        original_bulk_create = StudentGradebook.objects.bulk_create
+
+        def bulk_create_after_concurrent_save(gradebook_entries, **kwargs):
+            StudentGradebook.objects.create(user=self.users[0], course_id=self.course.id, **self._get_values(0.2))
+            return original_bulk_create(gradebook_entries, **kwargs)
+
+        with patch.object(StudentGradebook.objects, 'bulk_create', side_effect=bulk_create_after_concurrent_save):
+            updated_user_ids = bulk_save_user_gradebooks(
+                self.course.id, {user.id: self._get_values(0.4) for user in self.users[:2]}
+            )
+        self.assertEqual(sorted(updated_user_ids), sorted(user.id for user in self.users[:2]))
+        self.assertEqual(StudentGradebook.objects.get(user=self.users[0], course_id=self.course.id).grade, 0.4)
+        # one history row of the concurrent save, and one of each entry the batch wrote
+        self.assertEqual(StudentGradebookHistory.objects.filter(course_id=self.course.id).count(), 3)
+
+    def test_bulk_inserted_entries_get_the_active_enrollment_flag(self):
+        for user in self.users:
+            CourseEnrollmentFactory.create(user=user, course_id=self.course.id)
+        self.users[1].is_active = False
+        self.users[1].save()
+
+        bulk_save_user_gradebooks(self.course.id, {user.id: self._get_values(0.4) for user in self.users[:2]})
+        flags = dict(StudentGradebook.objects.filter(course_id=self.course.id).values_list(
+            'user_id', 'is_active_enrollment'
+        ))
+        self.assertEqual(flags, {self.users[0].id: True, self.users[1].id: False})
+
+    def test_changed_summaries_are_written_without_moving_time_scored(self):
+        bulk_save_user_gradebooks(self.course.id, {self.users[0].id: self._get_values(0.4)})
+        modified = StudentGradebook.objects.get(user=self.users[0], course_id=self.course.id).modified
+
+        values = dict(self._get_values(0.4), progress_summary='[{"sections": []}]')
+        self.assertEqual(bulk_save_user_gradebooks(self.course.id, {self.users[0].id: values}), [])
+        gradebook = StudentGradebook.objects.get(user=self.users[0], course_id=self.course.id)
+        self.assertEqual(gradebook.progress_summary, values['progress_summary'])
+        self.assertEqual(gradebook.fingerprint, gradebook_fingerprint(values))
+        self.assertEqual(gradebook.modified, modified)
+
+        values = dict(values, grade_summary='{"percent": 0.4}')
+        with patch('gradebook.utils.calculate_user_gradebook', return_value=values):
+            gradebook = generate_user_gradebook(self.course.id, self.users[0])
+        gradebook.refresh_from_db()
+        self.assertEqual(gradebook.grade_summary, values['grade_summary'])
+        self.assertEqual(gradebook.modified, modified)
+
+        # unchanged values are compared without loading the summaries, only the regraded time is written
+        with patch('gradebook.utils.calculate_user_gradebook', return_value=values):
+            with self.assertNumQueries(2):
+                generate_user_gradebook(self.course.id, self.users[0])
+
+
+class CourseGradingContextCacheTests(ModuleStoreTestCase):
+    """ Test suite for the course grading context cache """
+
+    MODULESTORE = TEST_DATA_SPLIT_MODULESTORE
+    ENABLED_SIGNALS = ['course_published']
+
+    def _create_course(self):
+        course = CourseFactory.create()
+        CourseOverview.get_from_id(course.id)
+        return course
+
+    def _publish_grade_cutoffs(self, course, grade_cutoffs):
+        """
+        changes the course's grade cutoffs and publishes it, which refreshes its course overview
+        """
+        course.grade_cutoffs = grade_cutoffs
+        self.store.update_item(course, self.user.id)
+
+    def test_publish_reloads_the_course(self):
+        course = self._create_course()
+        grading_cache = CourseGradingContextCache(max_size=1)
+
+        context = grading_cache.get(course.id)
+        self.assertIs(grading_cache.get(course.id), context)
+        self.assertEqual(json.loads(context.grading_policy_json), course.grading_policy)
+
+        self._publish_grade_cutoffs(course, {'Pass': 0.8})
+        published_context = grading_cache.get(course.id)
+        self.assertIsNot(published_context, context)
+        self.assertEqual(published_context.grading_policy['GRADE_CUTOFFS'], {'Pass': 0.8})
+        self.assertEqual(grading_cache.stats(), {'size': 1, 'hits': 1, 'misses': 2, 'evictions': 0})
+
+        grading_cache.get(self._create_course().id)
+        self.assertEqual(grading_cache.stats(), {'size': 1, 'hits': 1, 'misses': 3, 'evictions': 1})
+
+    def test_version_is_read_once_per_ttl(self):
+        course = self._create_course()
+        grading_cache = CourseGradingContextCache(max_size=1, version_ttl=60)
+        context = grading_cache.get(course.id)
+        with self.assertNumQueries(0):
+            self.assertIs(grading_cache.get(course.id), context)
+
+        self._publish_grade_cutoffs(course, {'Pass': 0.8})
+        self.assertIs(grading_cache.get(course.id), context)
+        with patch('gradebook.utils.time.monotonic', return_value=time.monotonic() + 61):
+            self.assertIsNot(grading_cache.get(course.id), context)
+
+
+class GradebookInstrumentationTests(ModuleStoreTestCase):
+    """ Test suite for gradebook stage instrumentation """
+
+    def test_disabled_instrumentation_records_nothing(self):
+        self.assertIs(instrumentation.stage('gradebook.total'), instrumentation.NULL_STAGE)
+        self.assertIsNone(instrumentation.get_summary())
+
+    @override_settings(GRADEBOOK_INSTRUMENTATION_SINK='memory')
+    def test_memory_sink_aggregates_stages(self):
+        instrumentation.pop_summary()
+        for __ in range(2):
+            with instrumentation.stage('gradebook.save'):
+                StudentGradebook.objects.count()
+        summary = instrumentation.pop_summary()
+        self.assertEqual(summary['gradebook.save']['count'], 2)
+        self.assertEqual(summary['gradebook.save']['queries'], 2)
+        self.assertEqual(instrumentation.get_summary(), {})
+
+        merged = instrumentation.merge_summaries([summary, summary, None])
+        self.assertEqual(merged['gradebook.save']['count'], 4)
+        self.assertEqual(merged['gradebook.save']['mean_ms'], summary['gradebook.save']['mean_ms'])
+
+
+class GradebookJsonTests(ModuleStoreTestCase):
+    """ Test suite for gradebook summary encoding and decoding """
+
+    def test_get_json_data_matches_edx_encoder(self):
+        due = datetime(2030, 1, 1, tzinfo=utc)
+        for value in [{'percent': 0.5, 'grade': None}, [{'due': due, 'sections': []}]]:
+            self.assertEqual(get_json_data(value), json.dumps(value, cls=EdxJSONEncoder))
+        with self.assertRaises(TypeError):
+            get_json_data({'value': object()})
+
+    def test_courseware_summary_of_attempted_sections_holds_json_types(self):
+        first_attempted = datetime(2029, 6, 1, 12, 30, tzinfo=utc)
+        total = SimpleNamespace(earned=1.0, possible=2.0, graded=True, first_attempted=first_attempted)
+        sub_section = SimpleNamespace(
+            location='block-v1:Org+Course+Run+type@sequential+block@s1', display_name='Section', url_name='s1',
+            due=datetime(2030, 1, 1, tzinfo=utc), graded=True, format='Homework', all_total=total, graded_total=total,
+        )
+        course_grade = SimpleNamespace(chapter_grades=OrderedDict([
+            ('chapter', {'url_name': 'chapter', 'display_name': 'Chapter', 'sections': [sub_section]}),
+        ]))
+        summary = make_courseware_summary(course_grade)
+        section = summary[0]['sections'][0]
+        self.assertEqual(json.loads(json.dumps(summary))[0]['sections'][0], section)
+        self.assertEqual(section['section_total'][3], json.loads(json.dumps(first_attempted, cls=EdxJSONEncoder)))
+
+        raw_summary = build_progress_summary(2, 2, encode_datetimes=False)
+        self.assertEqual(get_json_data(build_progress_summary(2, 2)), json.dumps(raw_summary, cls=EdxJSONEncoder))
+
+    def test_decoded_summaries_are_memoized(self):
+        gradebook = StudentGradebook(progress_summary='[{"sections": []}]', grade_summary='', grading_policy='{}')
+        progress_summary_data = gradebook.progress_summary_data
+        self.assertEqual(progress_summary_data, [{'sections': []}])
+        self.assertIs(gradebook.progress_summary_data, progress_summary_data)
+        self.assertEqual(gradebook.grade_summary_data, {})
+
+        gradebook.progress_summary = '[]'
+        self.assertEqual(gradebook.progress_summary_data, [])
+
+    def test_benchmark_command(self):
+        output = StringIO()
+        call_command('benchmark_gradebook_json', chapters=2, sections=2, iterations=5, stdout=output)
+        self.assertEqual(len(json.loads(output.getvalue())['operations_per_second']), 4)
+
+
+class GradebookHistoryTests(ModuleStoreTestCase):
+    """ Test suite for gradebook history change detection """
+
+    def setUp(self):
+        super().setUp()
+        self.course = CourseFactory.create()
+        self.user = UserFactory()
+
+    def test_history_follows_latest_fingerprint(self):
+        gradebook = StudentGradebook.objects.create(
+            user=self.user,
+            course_id=self.course.id,
+            grade=0.5,
+            proforma_grade=0.5,
+            grade_summary='{}',
+            grading_policy='{}',
+        )
+        gradebook.save()
+        self.assertEqual(StudentGradebookHistory.objects.filter(user=self.user).count(), 1)
+
+        gradebook.progress_summary = '[{"sections": []}]'
+        gradebook.save()
+        self.assertEqual(StudentGradebookHistory.objects.filter(user=self.user).count(), 2)
+
+        # entries stored before fingerprints existed are compared by content
+        StudentGradebookHistory.objects.filter(user=self.user).update(fingerprint='')
+        gradebook.save()
+        self.assertEqual(StudentGradebookHistory.objects.filter(user=self.user).count(), 2)
+
+        gradebook.grade = 0.75
+        gradebook.save()
+        history = StudentGradebookHistory.objects.filter(user=self.user).order_by('-id')
+        self.assertEqual(history.count(), 3)
+        self.assertEqual(history[0].grade, 0.75)
+
+
+@override_settings(GRADEBOOK_COMPACT_STORAGE=True)
+class GradebookCompactStorageTests(ModuleStoreTestCase):
+    """ Test suite for compact storage of gradebook summaries """
+
+    def setUp(self):
+        super().setUp()
+        self.course = CourseFactory.create()
+        self.progress_summary = json.dumps([{'display_name': 'Chapter', 'sections': []}] * 50)
+        self.grading_policy = json.dumps(self.course.grading_policy)
+
+    def _create_gradebook(self):
+        return StudentGradebook.objects.create(
+            user=UserFactory(),
+            course_id=self.course.id,
+            grade=0.5,
+            proforma_grade=0.5,
+            progress_summary=self.progress_summary,
+            grade_summary='{"percent": 0.5}',
+            grading_policy=self.grading_policy,
+        )
+
+    def test_summaries_are_stored_compact_and_read_back_transparently(self):
+        gradebooks = [self._create_gradebook(), self._create_gradebook()]
+        self.assertEqual(GradebookGradingPolicy.objects.count(), 1)
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT progress_summary, grading_policy FROM gradebook_studentgradebook WHERE id = %s',
+                [gradebooks[0].id]
+            )
+            stored_progress_summary, stored_grading_policy = cursor.fetchone()
+        self.assertTrue(stored_progress_summary.startswith(COMPRESSED_TEXT_PREFIX))
+        self.assertLess(len(stored_progress_summary), len(self.progress_summary))
+        self.assertTrue(stored_grading_policy.startswith(GRADING_POLICY_REFERENCE_PREFIX))
+
+        gradebook = StudentGradebook.objects.get(id=gradebooks[0].id)
+        self.assertEqual(gradebook.progress_summary, self.progress_summary)
+        self.assertEqual(gradebook.grading_policy, self.grading_policy)
+        history = StudentGradebookHistory.objects.filter(user=gradebook.user).get()
+        self.assertEqual(history.progress_summary, self.progress_summary)
+
+        with override_settings(GRADEBOOK_COMPACT_STORAGE=False):
+            gradebook.save()
+            self.assertEqual(StudentGradebook.objects.get(id=gradebook.id).progress_summary, self.progress_summary)
+
+    def test_bulk_update_then_save_writes_no_duplicate_history(self):
+        user = UserFactory()
+        values = {
+            'grade': 0.4,
+            'proforma_grade': 0.4,
+            'progress_summary': self.progress_summary,
+            'grade_summary': '{}',
+            'grading_policy': self.grading_policy,
+            'is_passed': False,
+        }
+        bulk_save_user_gradebooks(self.course.id, {user.id: values})
+        bulk_save_user_gradebooks(self.course.id, {user.id: dict(values, grade=0.6, is_passed=True)})
+        history = StudentGradebookHistory.objects.filter(user=user, course_id=self.course.id)
+        self.assertEqual(history.count(), 2)
+
+        gradebook = StudentGradebook.objects.get(user=user, course_id=self.course.id)
+        self.assertEqual(history.order_by('-id').first().fingerprint, gradebook.fingerprint)
+        gradebook.save()
+        self.assertEqual(history.count(), 2)
+
+    def test_policy_lookup_stores_nothing(self):
+        self.assertFalse(StudentGradebook.objects.filter(grading_policy='{"GRADER": []}').exists())
+        self.assertFalse(GradebookGradingPolicy.objects.exists())
+
+
+@override_settings(LEADERBOARD_SIZE=2)
+class LeaderboardCutoffTests(ModuleStoreTestCase):
+    """ Test suite for the cached leaderboard cutoff """
+
+    def setUp(self):
+        super().setUp()
+        self.course = CourseFactory.create()
+        self.gradebooks = []
+        for grade in [0.9, 0.7, 0.4]:
+            user = UserFactory()
+            CourseEnrollmentFactory.create(user=user, course_id=self.course.id)
+            self.gradebooks.append(StudentGradebook.objects.create(
+                user=user,
+                course_id=self.course.id,
+                grade=grade,
+                proforma_grade=grade,
+                grade_summary='{}',
+                grading_policy='{}',
+            ))
+
+    @patch.dict(settings.FEATURES, {'ENABLE_NOTIFICATIONS': False})
+    def test_previous_grade_is_read_only_when_needed(self):
+        gradebook = StudentGradebook.objects.get(pk=self.gradebooks[1].pk)
+        gradebook.grade = 0.2
+        with self.assertNumQueries(0):
+            capture_previous_grade(StudentGradebook, gradebook)
+        self.assertEqual(gradebook.previous_grade, 0.7)
+
+        gradebook = StudentGradebook(pk=self.gradebooks[1].pk, course_id=self.course.id, grade=0.2)
+        gradebook._state.adding = False  # pylint: disable=protected-access
+        with self.assertNumQueries(0):
+            capture_previous_grade(StudentGradebook, gradebook)
+        self.assertIsNone(gradebook.previous_grade)
+
+        StudentGradebook.get_leaderboard_cutoff(self.course.id)
+        del gradebook._loaded_grade  # pylint: disable=protected-access
+        with self.assertNumQueries(1):
+            capture_previous_grade(StudentGradebook, gradebook)
+        self.assertEqual(gradebook.previous_grade, 0.7)
+
+    def test_enrollment_change_drops_cutoff(self):
+        StudentGradebook.get_leaderboard_cutoff(self.course.id)
+        CourseEnrollment.unenroll(self.gradebooks[0].user, self.course.id)
+        self.assertFalse(StudentGradebook.is_below_leaderboard_cutoff(self.course.id, 0.1, cached_only=True))
+        self.assertEqual(StudentGradebook.get_leaderboard_cutoff(self.course.id)['grade'], 0.4)
+
+    def test_cutoff_is_cached_until_leaderboard_changes(self):
+        self.assertEqual(StudentGradebook.get_leaderboard_cutoff(self.course.id)['grade'], 0.7)
+        self.assertTrue(StudentGradebook.is_below_leaderboard_cutoff(self.course.id, 0.5, cached_only=True))
+
+        self.gradebooks[2].grade = 0.5
+        self.gradebooks[2].save()
+        self.assertTrue(StudentGradebook.is_below_leaderboard_cutoff(self.course.id, 0.5, cached_only=True))
+
+        self.gradebooks[2].grade = 0.8
+        self.gradebooks[2].save()
+        self.assertFalse(StudentGradebook.is_below_leaderboard_cutoff(self.course.id, 0.5, cached_only=True))
+        self.assertEqual(StudentGradebook.get_leaderboard_cutoff(self.course.id)['grade'], 0.8)
+
+    @patch.dict(settings.FEATURES, {'ENABLE_NOTIFICATIONS': True})
+    def test_notification_handlers_skip_ranking_below_cutoff(self):
+        StudentGradebook.get_leaderboard_cutoff(self.course.id)
+        with patch('gradebook.signals.StudentGradebook.get_user_position') as mock_get_user_position:
+            self.gradebooks[2].grade = 0.6
+            self.gradebooks[2].save()
+            self.assertFalse(mock_get_user_position.called)
+
+
+class GradebookPercentileTests(ModuleStoreTestCase):
+    """ Test suite for percentiles served from the cached grade histogram """
+
+    def setUp(self):
+        super().setUp()
+        self.course = CourseFactory.create()
+        self.users = [UserFactory() for __ in range(4)]
+        self.gradebooks = []
+        for user, grade in zip(self.users, [0.9, 0.6, 0.6]):
+            CourseEnrollmentFactory.create(user=user, course_id=self.course.id)
+            self.gradebooks.append(StudentGradebook.objects.create(
+                user=user, course_id=self.course.id, grade=grade, proforma_grade=grade,
+                grade_summary='{}', grading_policy='{}'
+            ))
+        # enrolled without a gradebook entry
+        CourseEnrollmentFactory.create(user=self.users[3], course_id=self.course.id)
+
+    def test_percentiles(self):
+        self.assertEqual(StudentGradebook.get_grade_percentile(self.course.id, 0.9), 25.0)
+        self.assertEqual(StudentGradebook.get_grade_percentile(self.course.id, 0.6), 50.0)
+        self.assertEqual(StudentGradebook.get_user_percentile(self.course.id, self.users[3].id), {
+            'user_grade': 0.0,
+            'user_percentile': 100.0,
+        })
+
+    def test_histogram_is_updated_on_save(self):
+        StudentGradebook.get_percentile_histogram(self.course.id)
+        self.gradebooks[1].grade = 0.95
+        self.gradebooks[1].save()
+        StudentGradebook.objects.create(
+            user=self.users[3], course_id=self.course.id, grade=0.3, proforma_grade=0.3,
+            grade_summary='{}', grading_policy='{}'
+        )
+        with self.assertNumQueries(0):
+            histogram = StudentGradebook.get_percentile_histogram(self.course.id)
+        self.assertEqual(
+            [bucket for bucket, count in enumerate(histogram['counts']) for __ in range(count)], [30, 60, 90, 95]
+        )
+
+        StudentGradebook.invalidate_percentile_histogram(self.course.id)
+        self.assertEqual(StudentGradebook.get_percentile_histogram(self.course.id), histogram)
+
+
+@override_settings(GRADEBOOK_COURSE_AGGREGATES=True)
+class GradebookCourseAggregateTests(ModuleStoreTestCase):
+    """ Test suite for incrementally maintained course aggregates """
+
+    def setUp(self):
+        super().setUp()
+        self.course = CourseFactory.create()
+        self.users = [UserFactory() for __ in range(4)]
+        for user in self.users:
+            CourseEnrollmentFactory.create(user=user, course_id=self.course.id)
+
+    def _set_grade(self, user, grade):
+        gradebook, __ = StudentGradebook.objects.get_or_create(
+            user=user,
+            course_id=self.course.id,
+            defaults={'grade': grade, 'proforma_grade': grade, 'grade_summary': '{}', 'grading_policy': '{}'}
+        )
+        gradebook.grade = grade
+        gradebook.save()
+
+    def test_aggregate_follows_grade_changes(self):
+        StudentGradebookCourseAggregate.rebuild(self.course.id)
+        for user, grade in zip(self.users[:3], [0.2, 0.6, 0.9]):
+            self._set_grade(user, grade)
+        self._set_grade(self.users[2], 0.4)
+        self._set_grade(self.users[0], 0.5)
+        self.assertEqual(StudentGradebookCourseAggregate.check_drift(self.course.id), {})
+
+        course_aggregate = StudentGradebookCourseAggregate.objects.get(course_id=self.course.id)
+        self.assertEqual(course_aggregate.grade_count, 3)
+        self.assertEqual(course_aggregate.enrollment_count, 4)
+        self.assertEqual(course_aggregate.grade_min, 0.4)
+        self.assertEqual(course_aggregate.grade_max, 0.6)
+
+        exclude_users = get_aggregate_exclusion_user_ids(self.course.id)
+        course_avg = StudentGradebook.course_grade_avg(self.course.id, exclude_users=exclude_users)
+        with override_settings(GRADEBOOK_COURSE_AGGREGATES=False):
+            self.assertEqual(
+                StudentGradebook.course_grade_avg(self.course.id, exclude_users=exclude_users),
+                course_avg
+            )
+        self.assertEqual(course_avg, 0.375)
+
+    def test_enrollment_changes_apply_deltas(self):
+        for user, grade in zip(self.users[:3], [0.2, 0.6, 0.9]):
+            self._set_grade(user, grade)
+        with patch.object(StudentGradebookCourseAggregate, 'rebuild') as mock_rebuild:
+            CourseEnrollment.unenroll(self.users[2], self.course.id)
+            CourseEnrollment.unenroll(self.users[3], self.course.id)
+            course_aggregate = StudentGradebookCourseAggregate.objects.get(course_id=self.course.id)
+            self.assertEqual(course_aggregate.grade_count, 2)
+            self.assertEqual(course_aggregate.enrollment_count, 2)
+            self.assertEqual(course_aggregate.grade_max, 0.6)
+
+            CourseEnrollment.enroll(self.users[2], self.course.id)
+            self.assertFalse(mock_rebuild.called)
+        self.assertEqual(StudentGradebookCourseAggregate.check_drift(self.course.id), {})
+
+    def test_repeated_sync_counts_entries_once(self):
+        for user, grade in zip(self.users[:2], [0.2, 0.6]):
+            self._set_grade(user, grade)
+        gradebook = StudentGradebook.objects.get(user=self.users[1], course_id=self.course.id)
+        # a concurrent save already applied by the first sync
+        StudentGradebook.objects.filter(pk=gradebook.pk).update(grade=0.8)
+        StudentGradebookCourseAggregate.sync_entries(self.course.id, [gradebook.pk])
+        StudentGradebookCourseAggregate.sync_entries(self.course.id, [gradebook.pk])
+        self.assertEqual(StudentGradebookCourseAggregate.check_drift(self.course.id), {})
+
+    def test_course_entries_are_deleted_without_per_row_aggregate_updates(self):
+        for user, grade in zip(self.users[:3], [0.2, 0.6, 0.9]):
+            self._set_grade(user, grade)
+        with patch.object(StudentGradebookCourseAggregate, 'remove_entry') as mock_remove_entry:
+            StudentGradebook.delete_course_entries(self.course.id)
+        self.assertFalse(mock_remove_entry.called)
+        self.assertFalse(StudentGradebookCourseAggregate.objects.filter(course_id=self.course.id).exists())
+
+    def test_grade_histogram(self):
+        for user, grade in zip(self.users[:3], [0.1, 0.3, 1.0]):
+            self._set_grade(user, grade)
+        exclude_users = get_aggregate_exclusion_user_ids(self.course.id)
+        histogram = StudentGradebook.grade_histogram(self.course.id, buckets=4, exclude_users=exclude_users)
+        self.assertEqual(histogram['counts'], [2, 1, 0, 1])
+        self.assertEqual(histogram['graded_count'], 3)
+        self.assertEqual(histogram['enrollment_count'], 4)
+
+    def test_grade_histogram_matches_percentile_buckets_at_edges(self):
+        self._set_grade(self.users[0], 0.57)
+        exclude_users = get_aggregate_exclusion_user_ids(self.course.id)
+        histogram = StudentGradebook.grade_histogram(self.course.id, buckets=100, exclude_users=exclude_users)
+        with override_settings(GRADEBOOK_PERCENTILE_BUCKETS=100):
+            percentile_histogram = StudentGradebook.get_percentile_histogram(self.course.id)
+        self.assertEqual(histogram['counts'][57], 1)
+        self.assertEqual(histogram['counts'], percentile_histogram['counts'])
+
+        histogram = StudentGradebook.grade_histogram(
+            self.course.id, buckets=4, cohort_user_ids=[user.id for user in self.users[1:3]]
+        )
+        self.assertEqual(histogram['counts'], [0, 1, 0, 1])
+
+    def test_drift_is_detected_and_repaired(self):
+        for user, grade in zip(self.users, [0.2, 0.6, 0.9, 0.1]):
+            self._set_grade(user, grade)
+        StudentGradebookCourseAggregate.rebuild(self.course.id)
+        StudentGradebookCourseAggregate.objects.filter(course_id=self.course.id).update(grade_count=7)
+        self.assertEqual(StudentGradebookCourseAggregate.check_drift(self.course.id), {'grade_count': (4, 7)})
+
+        StudentGradebookCourseAggregate.rebuild(self.course.id)
+        self.assertEqual(StudentGradebookCourseAggregate.check_drift(self.course.id), {})
+
+
+@override_settings(GRADEBOOK_USE_ACTIVE_ENROLLMENT_FLAG=True)
+class GradebookActiveEnrollmentTests(ModuleStoreTestCase):
+    """ Test suite for the denormalized active enrollment flag """
+
+    def setUp(self):
+        super().setUp()
+        self.course = CourseFactory.create()
+        self.users = [UserFactory() for __ in range(3)]
+        for user, grade in zip(self.users, [0.9, 0.6, 0.3]):
+            CourseEnrollmentFactory.create(user=user, course_id=self.course.id)
+            StudentGradebook.objects.create(
+                user=user, course_id=self.course.id, grade=grade, proforma_grade=grade,
+                grade_summary='{}', grading_policy='{}'
+            )
+
+    def _leaderboard_user_ids(self):
+        leaderboard = StudentGradebook.generate_leaderboard(self.course.id, count=3)
+        return [entry['user__id'] for entry in leaderboard['queryset']]
+
+    def test_flag_follows_enrollment_and_user_activation(self):
+        self.assertEqual(self._leaderboard_user_ids(), [user.id for user in self.users])
+
+        CourseEnrollment.unenroll(self.users[0], self.course.id)
+        self.users[1].is_active = False
+        self.users[1].save()
+        self.assertEqual(self._leaderboard_user_ids(), [self.users[2].id])
+
+        CourseEnrollment.enroll(self.users[0], self.course.id)
+        self.users[1].is_active = True
+        self.users[1].save()
+        self.assertEqual(self._leaderboard_user_ids(), [user.id for user in self.users])
+
+    def test_new_entry_of_unenrolled_user_is_inactive(self):
+        user = UserFactory()
+        gradebook = StudentGradebook.objects.create(
+            user=user, course_id=self.course.id, grade=1.0, proforma_grade=1.0,
+            grade_summary='{}', grading_policy='{}'
+        )
+        self.assertFalse(gradebook.is_active_enrollment)
+
+    def test_backfill_command(self):
+        StudentGradebook.objects.filter(user=self.users[0]).update(is_active_enrollment=False)
+        call_command('backfill_gradebook_active_enrollment', course_id=str(self.course.id))
+        self.assertEqual(StudentGradebook.objects.filter(is_active_enrollment=True).count(), 3)
+
+
+class ExportGradebookTests(ModuleStoreTestCase):
+    """ Test suite for the export_gradebook command """
+
+    def setUp(self):
+        super().setUp()
+        self.course = CourseFactory.create()
+        self.progress_summary = json.dumps([{
+            'url_name': 'chapter',
+            'display_name': 'Chapter',
+            'sections': [
+                {'url_name': 'quiz', 'graded_total': [1.0, 2.0, True, None]},
+                {'url_name': 'exam', 'graded_total': [3.0, 4.0, True, None]},
+            ],
+        }])
+        self.users = [UserFactory() for __ in range(3)]
+        for user, grade in zip(self.users, [0.2, 0.5, 0.9]):
+            StudentGradebook.objects.create(
+                user=user, course_id=self.course.id, grade=grade, proforma_grade=grade,
+                progress_summary=self.progress_summary, grade_summary='{}', grading_policy='{}'
+            )
+
+    def _export(self, **options):
+        output = StringIO()
+        call_command('export_gradebook', course_id=str(self.course.id), chunk_size=2, stdout=output, **options)
+        return output.getvalue()
+
+    def test_export_csv_with_expanded_progress(self):
+        rows = list(csv.DictReader(StringIO(self._export(columns='username,grade', expand_progress=True))))
+        self.assertEqual([row['username'] for row in rows], [user.username for user in self.users])
+        self.assertEqual(
+            list(rows[0]),
+            ['username', 'grade', 'progress:quiz:earned', 'progress:quiz:possible',
+             'progress:exam:earned', 'progress:exam:possible']
+        )
+        self.assertEqual(rows[2]['grade'], '0.9')
+        self.assertEqual(rows[2]['progress:exam:possible'], '4.0')
+
+    def test_export_jsonl(self):
+        rows = [json.loads(line) for line in self._export(format='jsonl', columns='user_id,is_passed').splitlines()]
+        self.assertEqual(rows, [{'user_id': user.id, 'is_passed': False} for user in self.users])
+
+
+class ExplainGradebookQueriesTests(ModuleStoreTestCase):
+    """ Test suite for the composite gradebook indexes and the explain_gradebook_queries command """
+
+    def test_composite_indexes_are_created(self):
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, StudentGradebook._meta.db_table)
+        indexes = {name: constraint['columns'] for name, constraint in constraints.items() if constraint['index']}
+        self.assertEqual(indexes['gradebook_leaderboard_idx'], ['course_id', 'grade', 'modified'])
+        self.assertEqual(indexes['gradebook_completed_idx'], ['course_id', 'proforma_grade', 'grade'])
+        self.assertEqual(indexes['gradebook_passed_idx'], ['course_id', 'is_passed'])
+
+    def test_explain_report(self):
+        output = StringIO()
+        call_command('explain_gradebook_queries', learners=20, repeat=1, stdout=output)
+        report = json.loads(output.getvalue())
+        self.assertEqual(report['course_id'], str(get_synthetic_course_key(20)))
+        self.assertGreater(report['gradebook_rows'], 0)
+        self.assertGreaterEqual(report['gradebook_migration'], '0007_studentgradebook_composite_indexes')
+        self.assertEqual(set(report['queries']), {
+            'generate_leaderboard', 'get_user_position', 'get_num_users_completed', 'get_passed_users_gradebook',
+        })
+        for result in report['queries'].values():
+            self.assertEqual(len(result['timings']), 1)
+            self.assertTrue(result['plans'])
+        self.assertFalse(StudentGradebook.objects.filter(course_id=get_synthetic_course_key(20)).exists())
+
+
+class BenchmarkGradebookQueriesTests(ModuleStoreTestCase):
+    """ Test suite for the benchmark_gradebook_queries command """
+
+    def test_benchmark_report(self):
+        output = StringIO()
+        call_command('benchmark_gradebook_queries', sizes='20', repeat=1, stdout=output)
+        report = json.loads(output.getvalue())
+        self.assertEqual(set(report['results']['20']), {'course', 'group', 'organization', 'cohort'})
+        for benchmarks in report['results']['20'].values():
+            self.assertEqual(len(benchmarks), 5)
+            self.assertTrue(all(result['query_count'] > 0 for result in benchmarks.values()))
+        self.assertFalse(StudentGradebook.objects.filter(course_id=get_synthetic_course_key(20)).exists())
+
+
+class ProformaGradeEquivalenceTests(SimpleTestCase):
+    """ Test suite checking batch proforma grades against calculate_proforma_grade """
+
+    grading_policy = {
+        'GRADER': [
+            {'type': 'Homework', 'weight': 0.15},
+            {'type': 'Lab', 'weight': 0.15},
+            {'type': 'MidtermExam', 'weight': 0.3},
+            {'type': 'FinalExam', 'weight': 0.4},
+        ],
+    }
+
+    def _course_grade(self, graded_subsections):
+        """
+        returns a course grade stub from {category: [(earned, possible, first_attempted), ...]}
+        """
+        return SimpleNamespace(graded_subsections_by_format=OrderedDict(
+            (category, OrderedDict(
+                (index, SimpleNamespace(graded_total=SimpleNamespace(
+                    earned=earned, possible=possible, first_attempted=first_attempted
+                )))
+                for index, (earned, possible, first_attempted) in enumerate(items)
+            ))
+            for category, items in graded_subsections.items()
+        ))
+
+    def _random_course_grades(self, rng, learners, categories):
+        course_grades = []
+        for __ in range(learners):
+            graded_subsections = {}
+            for category in categories:
+                if rng.random() < 0.2:
+                    continue
+                items = []
+                for __ in range(rng.randint(0, 10)):
+                    possible = rng.choice([1, 2, 5, 0.5, 10])
+                    items.append((rng.choice([0, possible, rng.random() * possible]), possible, rng.random() < 0.7))
+                graded_subsections[category] = items
+            course_grades.append(self._course_grade(graded_subsections if rng.random() > 0.05 else {}))
+        return course_grades
+
+    def _assert_equivalent(self, course_grades, grading_policy):
+        self.assertEqual(
+            calculate_proforma_grades(course_grades, grading_policy),
+            [calculate_proforma_grade(course_grade, grading_policy) for course_grade in course_grades]
+        )
+
+    def test_documented_example(self):
+        course_grade = self._course_grade({
+            'Homework': [(0.7, 1.0, True)],
+            'MidtermExam': [(0.8, 1.0, True)],
+            'FinalExam': [(0.95, 1.0, True)],
+        })
+        self.assertAlmostEqual(calculate_proforma_grades([course_grade], self.grading_policy)[0], 0.8475)
+        self._assert_equivalent([course_grade], self.grading_policy)
+
+    def test_random_courses_are_identical(self):
+        rng = random.Random(0)
+        categories = [grader['type'] for grader in self.grading_policy['GRADER']] + ['Ungraded']
+        self._assert_equivalent(self._random_course_grades(rng, 2000, categories), self.grading_policy)
+
+    def test_duplicate_grader_types_use_first_weight_for_estimates(self):
+        grading_policy = {'GRADER': self.grading_policy['GRADER'] + [{'type': 'Lab', 'weight': 0.05}]}
+        rng = random.Random(1)
+        self._assert_equivalent(self._random_course_grades(rng, 500, ['Homework', 'FinalExam']), grading_policy)
+
+    def test_edge_cases(self):
+        self._assert_equivalent([
+            self._course_grade({}),
+            self._course_grade({'Homework': []}),
+            self._course_grade({'Homework': [(1, 2, False)]}),
+            self._course_grade({'Ungraded': [(1, 2, True)]}),
+        ], self.grading_policy)
+        self.assertEqual(calculate_proforma_grades([], self.grading_policy), [])
+
+    def test_zero_possible_score_raises_like_scalar(self):
+        course_grade = self._course_grade({'Homework': [(0, 0, True)]})
+        with self.assertRaises(ZeroDivisionError):
+            calculate_proforma_grade(course_grade, self.grading_policy)
+        with self.assertRaises(ZeroDivisionError):
+            calculate_proforma_grades([course_grade], self.grading_policy)
+
+
+class UpdatePassStatusTests(ModuleStoreTestCase):
+    """ Test suite for the update_pass_status command """
+
+    def setUp(self):
+        super().setUp()
+        self.course = CourseFactory.create(grading_policy={
+            'GRADER': [{'type': 'Homework', 'min_count': 1, 'drop_count': 0, 'short_label': 'HW', 'weight': 1.0}],
+            'GRADE_CUTOFFS': {'Pass': 0.5},
+        })
+        self.gradebooks = []
+        for grade, is_passed in [(0.4, True), (0.5, False), (0.9, True)]:
+            user = UserFactory()
+            CourseEnrollmentFactory.create(user=user, course_id=self.course.id)
+            self.gradebooks.append(StudentGradebook.objects.create(
+                user=user, course_id=self.course.id, grade=grade, proforma_grade=grade, is_passed=is_passed,
+                grade_summary='{}', grading_policy='{}'
+            ))
+
+    def test_fast_mode_uses_stored_grades(self):
+        with patch('gradebook.management.commands.update_pass_status.CourseGradeFactory') as mock_factory:
+            call_command('update_pass_status', course_id=str(self.course.id), fast=True)
+            self.assertFalse(mock_factory.called)
+        for gradebook, is_passed in zip(self.gradebooks, [False, True, True]):
+            gradebook.refresh_from_db()
+            self.assertEqual(gradebook.is_passed, is_passed)
+
+    def test_fast_mode_skips_unenrolled_learners(self):
+        CourseEnrollment.unenroll(self.gradebooks[0].user, self.course.id)
+        call_command('update_pass_status', course_id=str(self.course.id), fast=True)
+        for gradebook, is_passed in zip(self.gradebooks, [True, True, True]):
+            gradebook.refresh_from_db()
+            self.assertEqual(gradebook.is_passed, is_passed)
+
+    def test_fast_mode_verification_sample(self):
+        with patch('gradebook.management.commands.update_pass_status.CourseGradeFactory') as mock_factory:
+            mock_factory.return_value.read.return_value.passed = True
+            call_command('update_pass_status', course_id=str(self.course.id), fast=True, verify=2)
+            self.assertEqual(mock_factory.return_value.read.call_count, 2)
+
+    def test_keyset_chunks(self):
+        users = CourseEnrollment.objects.users_enrolled_in(self.course.id)
+        chunks = list(iter_keyset_chunks(users.values_list('id', flat=True), 2))
+        user_ids = [gradebook.user_id for gradebook in self.gradebooks]
+        self.assertEqual(chunks, [user_ids[:2], user_ids[2:]])
+
+    def test_full_mode_updates_in_chunks(self):
+        with patch('gradebook.management.commands.update_pass_status.CourseGradeFactory') as mock_factory:
+            mock_factory.return_value.read.side_effect = [
+                SimpleNamespace(passed=False), SimpleNamespace(passed=True), Exception('read failed'),
+            ]
+            call_command('update_pass_status', course_id=str(self.course.id), chunk_size=2)
+            self.assertEqual(mock_factory.return_value.read.call_count, 3)
+        for gradebook, is_passed in zip(self.gradebooks, [False, True, True]):
+            gradebook.refresh_from_db()
+            self.assertEqual(gradebook.is_passed, is_passed)
+
+
+class ReplayGradebookTests(ModuleStoreTestCase):
+    """ Test suite for regrading from stored progress summaries """
+
+    def setUp(self):
+        super().setUp()
+        self.course = CourseFactory.create()
+        self.users = [UserFactory() for __ in range(2)]
+        for user, scores in zip(self.users, [[(1.0, 2.0), (2.0, 2.0)], [(0.0, 2.0), (0.5, 2.0)]]):
+            progress_summary = json.dumps([{
+                'url_name': 'chapter',
+                'display_name': 'Chapter',
+                'sections': [{
+                    'location': 'block-v1:Org+Course+Run+type@sequential+block@{}'.format(index),
+                    'display_name': 'Homework {}'.format(index),
+                    'url_name': str(index),
+                    'due': None,
+                    'graded': True,
+                    'format': 'Homework',
+                    'section_total': [earned, possible, True, '2030-01-01T00:00:00Z'],
+                    'graded_total': [earned, possible, True, '2030-01-01T00:00:00Z'],
+                } for index, (earned, possible) in enumerate(scores)],
+            }])
+            StudentGradebook.objects.create(
+                user=user, course_id=self.course.id, grade=0.0, proforma_grade=0.0,
+                progress_summary=progress_summary, grade_summary='{}', grading_policy='{}'
+            )
+        self.grading_policy = {
+            'GRADER': [{'type': 'Homework', 'min_count': 2, 'drop_count': 0, 'short_label': 'HW', 'weight': 1.0}],
+            'GRADE_CUTOFFS': {'Pass': 0.5},
+        }
+
+    def test_replay_recomputes_grades(self):
+        self.assertEqual(replay_course_gradebook(self.course.id, self.grading_policy, chunk_size=1), (2, 2))
+
+        gradebook = StudentGradebook.objects.get(user=self.users[0], course_id=self.course.id)
+        self.assertEqual(gradebook.grade, 0.75)
+        self.assertEqual(gradebook.proforma_grade, 0.75)
+        self.assertTrue(gradebook.is_passed)
+        self.assertEqual(gradebook.grade_summary_data['grade'], 'Pass')
+        self.assertEqual(gradebook.grading_policy_data, self.grading_policy)
+
+        gradebook = StudentGradebook.objects.get(user=self.users[1], course_id=self.course.id)
+        self.assertEqual(gradebook.grade, 0.13)
+        self.assertFalse(gradebook.is_passed)
+
+    def test_dry_run_writes_nothing(self):
+        self.assertEqual(
+            replay_course_gradebook(self.course.id, self.grading_policy, dry_run=True), (2, 2)
+        )
+        self.assertFalse(StudentGradebook.objects.filter(course_id=self.course.id, grade__gt=0).exists())
+
+
+class StaleRegradeTests(ModuleStoreTestCase):
+    """ Test suite for selecting stale learners to regrade """
+
+    def setUp(self):
+        super().setUp()
+        self.course = CourseFactory.create()
+        self.users = [UserFactory() for __ in range(3)]
+        for user in self.users:
+            CourseEnrollmentFactory.create(user=user, course_id=self.course.id)
+        for user in self.users[:2]:
+            StudentGradebook.objects.create(
+                user=user, course_id=self.course.id, grade=0.5, proforma_grade=0.5,
+                grade_summary='{}', grading_policy='{}'
+            )
+        StudentGradebook.objects.filter(user=self.users[1]).update(modified=datetime(2020, 1, 1, tzinfo=utc))
+
+    def test_filter_stale_users(self):
+        users = CourseEnrollment.objects.users_enrolled_in(self.course.id)
+        stale_users = filter_stale_users(self.course.id, users, datetime(2021, 1, 1, tzinfo=utc))
+        self.assertEqual(list(stale_users.values_list('id', flat=True)), [self.users[1].id])
+
+    def test_regrade_with_unchanged_grade_is_not_stale(self):
+        StudentGradebook.objects.filter(user=self.users[1]).update(regraded=datetime(2022, 1, 1, tzinfo=utc))
+        users = CourseEnrollment.objects.users_enrolled_in(self.course.id)
+        stale_users = filter_stale_users(self.course.id, users, datetime(2021, 1, 1, tzinfo=utc))
+        self.assertFalse(stale_users.exists())
+
+    def test_dry_run_regrades_nothing(self):
+        with patch('gradebook.management.commands.regrade_course.regrade_users') as mock_regrade_users:
+            call_command(
+                'regrade_course', course_id=str(self.course.id), since='2021-01-01T00:00:00', dry_run=True
+            )
+            self.assertFalse(mock_regrade_users.called)
+
+
+class RegradeCourseTests(ModuleStoreTestCase):
+    """ Test suite for the regrade_course command """
+
+    def setUp(self):
+        super().setUp()
+        self.course = CourseFactory.create()
+        self.users = [UserFactory() for __ in range(3)]
+        for user in self.users:
+            CourseEnrollmentFactory.create(user=user, course_id=self.course.id)
+        self.checkpoint_path = os.path.join(tempfile.mkdtemp(), 'checkpoint')
+
+    def _regrade(self, **options):
+        call_command(
+            'regrade_course', course_id=str(self.course.id), chunk_size=1, checkpoint=self.checkpoint_path, **options
+        )
+
+    def test_failing_chunk_does_not_stop_the_run(self):
+        with patch('gradebook.management.commands.regrade_course.regrade_users') as mock_regrade_users:
+            mock_regrade_users.side_effect = [(1, []), Exception('bulk save failed'), (1, [])]
+            self._regrade(bulk=True)
+        self.assertEqual(mock_regrade_users.call_count, 3)
+
+        checkpoint = RegradeCheckpoint(self.checkpoint_path, str(self.course.id))
+        checkpoint.load()
+        self.assertEqual(checkpoint.failed_user_ids, {self.users[1].id})
+        self.assertEqual(checkpoint.done_user_ids, {self.users[0].id, self.users[2].id})
+
+    def test_resumed_run_counts_only_users_left(self):
+        RegradeCheckpoint(self.checkpoint_path, str(self.course.id)).record(
+            [self.users[0].id, self.users[1].id], failed_user_ids=[]
+        )
+        with patch('gradebook.management.commands.regrade_course.regrade_users', return_value=(1, [])):
+            with self.assertLogs('gradebook.management.commands.regrade_course', 'INFO') as logs:
+                self._regrade(resume=True)
+        self.assertIn('1/1 users processed', '\n'.join(logs.output))
+
+
+class RegradeCheckpointTests(SimpleTestCase):
+    """ Test suite for the regrade_course checkpoint """
+
+    def setUp(self):
+        super().setUp()
+        checkpoint_dir = tempfile.mkdtemp()
+        self.path = os.path.join(checkpoint_dir, 'checkpoint')
+
+    def test_resume_skips_only_recorded_users(self):
+        checkpoint = RegradeCheckpoint(self.path, 'course-v1:edX+Test+1')
+        checkpoint.record([1, 2, 5, 9], failed_user_ids=[5])
+        checkpoint.record([5, 12], failed_user_ids=[])
+
+        resumed = RegradeCheckpoint(self.path, 'course-v1:edX+Test+1')
+        resumed.load()
+        self.assertEqual([user_id for user_id in range(1, 13) if resumed.is_done(user_id)], [1, 2, 5, 9, 12])
+        self.assertEqual(resumed.failed_user_ids, set())
@@ -3,66 +3,504 @@ Utils methods for gradebook app
 """
 import json
 import logging
+import threading
+import time
+from collections import OrderedDict, namedtuple
 
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from edx_solutions_api_integration.utils import invalid_user_data_cache
+from gradebook import instrumentation
+from gradebook.fields import prepare_grading_policy
 from lms.djangoapps.courseware.courses import get_course
-from gradebook.models import StudentGradebook
+from gradebook.models import (GRADEBOOK_SUMMARY_FIELDS, GRADEBOOK_VALUE_FIELDS,
+                              StudentGradebook,
+                              StudentGradebookCourseAggregate,
+                              StudentGradebookHistory, StudentGradebookRank,
+                              gradebook_fingerprint)
+from gradebook.proforma import calculate_proforma_grades
 from lms.djangoapps.grades.course_grade_factory import CourseGradeFactory
+from lms.djangoapps.grades.models import PersistentSubsectionGrade
+from openedx.core.djangoapps.content.course_overviews.models import CourseOverview
 from xmodule.modulestore import EdxJSONEncoder
 from xmodule.modulestore.django import modulestore
 
 log = logging.getLogger(__name__)
 
+CourseGradingContext = namedtuple(
+    'CourseGradingContext',
+    ['course', 'grading_policy', 'grading_policy_json'],
+)
 
-def generate_user_gradebook(course_key, user):
+
+class CourseGradingContextCache:
     """
-    Recalculates the specified user's gradebook entry
+    In-process LRU cache of the course descriptor and grading policy used to calculate
+    gradebook entries.  Entries are keyed by course key plus the time the CourseOverview
+    was last refreshed, which happens on every publish, so a publish makes the next lookup
+    load the course again.  That time is read at most once every `version_ttl` seconds per
+    course, so a publish is picked up within that delay.  Courses without a CourseOverview
+    are never cached.
     """
-    with modulestore().bulk_operations(course_key):
+
+    def __init__(self, max_size, version_ttl=0):
+        self.max_size = max_size
+        self.version_ttl = version_ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._versions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get_version(self, course_key):
+        """
+        Returns the time the course overview was last refreshed, reusing a recent read
+        """
+        now = time.monotonic()
+        with self._lock:
+            version, read_at = self._versions.get(str(course_key), (None, None))
+        if read_at is not None and now - read_at < self.version_ttl:
+            return version
+        version = CourseOverview.objects.filter(id=course_key).values_list('modified', flat=True).first()
+        with self._lock:
+            self._versions.pop(str(course_key), None)
+            self._versions[str(course_key)] = (version, now)
+            while len(self._versions) > self.max_size:
+                self._versions.popitem(last=False)
+        return version
+
+    def get(self, course_key):
+        """
+        Returns the CourseGradingContext of the last published version of the course
+        """
+        version = self._get_version(course_key) if self.max_size else None
+        cache_key = (str(course_key), version)
+
+        with self._lock:
+            context = self._entries.get(cache_key) if version else None
+            if context is not None:
+                self._entries.move_to_end(cache_key)
+                self.hits += 1
+                return context
+            self.misses += 1
+
         course_descriptor = get_course(course_key, depth=None)
-        course_grade = CourseGradeFactory().read(user, course_descriptor)
-        grade_summary = course_grade.summary
-        is_passed = course_grade.passed
-        progress_summary = make_courseware_summary(course_grade)
         grading_policy = course_descriptor.grading_policy
-        grade = grade_summary['percent']
-        proforma_grade = calculate_proforma_grade(course_grade, grading_policy)
-
-    progress_summary = get_json_data(progress_summary)
-    grade_summary = get_json_data(grade_summary)
-    grading_policy = get_json_data(grading_policy)
-    gradebook_entry, created = StudentGradebook.objects.get_or_create(
-        user=user,
-        course_id=course_key,
-        defaults={
-            'grade': grade,
-            'proforma_grade': proforma_grade,
-            'progress_summary': progress_summary,
-            'grade_summary': grade_summary,
-            'grading_policy': grading_policy,
+        context = CourseGradingContext(
+            course=course_descriptor,
+            grading_policy=grading_policy,
+            grading_policy_json=get_json_data(grading_policy),
+        )
+        if version:
+            with self._lock:
+                for stale_key in [key for key in self._entries if key[0] == cache_key[0]]:
+                    del self._entries[stale_key]
+                self._entries[cache_key] = context
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+        return context
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._versions.clear()
+
+    def stats(self):
+        """
+        Returns the hit/miss counters of the cache
+        """
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+
+course_grading_cache = CourseGradingContextCache(
+    getattr(settings, 'GRADEBOOK_COURSE_CACHE_SIZE', 16),
+    version_ttl=getattr(settings, 'GRADEBOOK_COURSE_VERSION_TTL', 10),
+)
+
+
+def read_user_gradebook(course_key, user):
+    """
+    Reads the specified user's course grade.  Returns the course grading context, the
+    CourseGrade and the gradebook field values other than proforma_grade.
+    """
+    with modulestore().bulk_operations(course_key):
+        with instrumentation.stage('gradebook.course_load'):
+            course_context = course_grading_cache.get(course_key)
+        with instrumentation.stage('gradebook.grade_read'):
+            course_grade = CourseGradeFactory().read(user, course_context.course)
+            grade_summary = course_grade.summary
+            is_passed = course_grade.passed
+        with instrumentation.stage('gradebook.courseware_summary'):
+            progress_summary = make_courseware_summary(course_grade)
+
+    with instrumentation.stage('gradebook.json_encode'):
+        values = {
+            'grade': grade_summary['percent'],
+            'progress_summary': get_json_data(progress_summary),
+            'grade_summary': get_json_data(grade_summary),
+            'grading_policy': course_context.grading_policy_json,
             'is_passed': is_passed,
         }
-    )
+    return course_context, course_grade, values
+
+
+def calculate_user_gradebook(course_key, user):
+    """
+    Calculates the field values of the specified user's gradebook entry without saving them
+    """
+    with modulestore().bulk_operations(course_key):
+        course_context, course_grade, values = read_user_gradebook(course_key, user)
+        with instrumentation.stage('gradebook.proforma_grade'):
+            values['proforma_grade'] = calculate_proforma_grade(course_grade, course_context.grading_policy)
+    return values
+
+
+def is_gradebook_changed(gradebook_entry, values):
+    """
+    Tells whether freshly calculated values differ from a stored gradebook entry
+    """
+    return gradebook_entry.grade != values['grade'] or \
+        gradebook_entry.proforma_grade != values['proforma_grade'] or \
+        gradebook_entry.is_passed != values['is_passed']
+
 
-    if gradebook_entry.grade != grade or \
-            gradebook_entry.proforma_grade != proforma_grade or \
-            gradebook_entry.is_passed != is_passed:
-        gradebook_entry.grade = grade
-        gradebook_entry.proforma_grade = proforma_grade
-        gradebook_entry.progress_summary = progress_summary
-        gradebook_entry.grade_summary = grade_summary
-        gradebook_entry.grading_policy = grading_policy
-        gradebook_entry.is_passed = is_passed
-        gradebook_entry.save()
+def generate_user_gradebook(course_key, user):
+    """
+    Recalculates the specified user's gradebook entry
+    """
+    with instrumentation.stage('gradebook.total'):
+        values = calculate_user_gradebook(course_key, user)
+        fingerprint = gradebook_fingerprint(values)
+        regraded = timezone.now()
+        # includes the save signal handlers
+        with instrumentation.stage('gradebook.save'):
+            # the summaries are compared through the fingerprint, never loaded
+            gradebook_entry = StudentGradebook.objects.filter(user=user, course_id=course_key).defer(
+                *GRADEBOOK_SUMMARY_FIELDS
+            ).first()
+            if gradebook_entry is None:
+                gradebook_entry, created = StudentGradebook.objects.get_or_create(
+                    user=user,
+                    course_id=course_key,
+                    defaults=dict(values, fingerprint=fingerprint, regraded=regraded)
+                )
+                if created:
+                    return gradebook_entry
+
+            gradebook_entry.regraded = regraded
+            if is_gradebook_changed(gradebook_entry, values):
+                for field, value in values.items():
+                    setattr(gradebook_entry, field, value)
+                gradebook_entry.fingerprint = fingerprint
+                gradebook_entry.save()
+            elif gradebook_entry.fingerprint != fingerprint:
+                # only the summaries changed: rewrite them without moving the time scored
+                # or signalling a grade change
+                summaries = {field: values[field] for field in GRADEBOOK_SUMMARY_FIELDS}
+                StudentGradebook.objects.filter(pk=gradebook_entry.pk).update(
+                    fingerprint=fingerprint,
+                    regraded=regraded,
+                    **dict(summaries, grading_policy=prepare_grading_policy(summaries['grading_policy']))
+                )
+                for field, value in summaries.items():
+                    setattr(gradebook_entry, field, value)
+                gradebook_entry.fingerprint = fingerprint
+            else:
+                StudentGradebook.objects.filter(pk=gradebook_entry.pk).update(regraded=regraded)
 
     return gradebook_entry
 
 
+def bulk_save_user_gradebooks(course_key, gradebook_values, batch_size=500):
+    """
+    Writes calculated gradebook values, a dict of field values keyed by user id, with
+    batched inserts and updates.  History rows are inserted only for new or changed
+    entries.  The per-row save signals are bypassed, so no leaderboard notifications
+    are sent and course-wide derived data has to be refreshed with
+    finish_bulk_gradebook_update once all batches are written.  Entries with unchanged
+    grades only get their summaries rewritten, and only when their fingerprint differs.
+    Returns the list of user ids whose entries were created or had their grades changed.
+    """
+    gradebook_entry_fields = ('id', 'user_id', 'grade', 'proforma_grade', 'is_passed', 'fingerprint', 'created')
+    existing_entries = {
+        gradebook_entry.user_id: gradebook_entry
+        for gradebook_entry in StudentGradebook.objects.filter(
+            course_id=course_key,
+            user_id__in=list(gradebook_values),
+        ).only(*gradebook_entry_fields)
+    }
+
+    now = timezone.now()
+    new_entries = []
+    changed_entries = []
+    summary_changed_entries = []
+
+    def add_existing_entry(gradebook_entry, values):
+        fingerprint = gradebook_fingerprint(values)
+        if is_gradebook_changed(gradebook_entry, values):
+            for field, value in values.items():
+                setattr(gradebook_entry, field, value)
+            gradebook_entry.fingerprint = fingerprint
+            gradebook_entry.modified = now
+            changed_entries.append(gradebook_entry)
+        elif gradebook_entry.fingerprint != fingerprint:
+            for field in GRADEBOOK_SUMMARY_FIELDS:
+                setattr(gradebook_entry, field, values[field])
+            gradebook_entry.fingerprint = fingerprint
+            summary_changed_entries.append(gradebook_entry)
+
+    for user_id, values in gradebook_values.items():
+        gradebook_entry = existing_entries.get(user_id)
+        if gradebook_entry is None:
+            # the batch time marks the rows this insert actually writes
+            new_entries.append(StudentGradebook(
+                user_id=user_id, course_id=course_key, fingerprint=gradebook_fingerprint(values),
+                created=now, modified=now, **values
+            ))
+        else:
+            add_existing_entry(gradebook_entry, values)
+
+    with transaction.atomic():
+        StudentGradebook.objects.bulk_create(new_entries, batch_size=batch_size, ignore_conflicts=True)
+        inserted_user_ids = set()
+        if new_entries:
+            # entries created concurrently by the score changed task are skipped by the
+            # insert, and updated like the entries which existed before
+            for gradebook_entry in StudentGradebook.objects.filter(
+                    course_id=course_key,
+                    user_id__in=[new_entry.user_id for new_entry in new_entries],
+            ).only(*gradebook_entry_fields):
+                if gradebook_entry.created == now:
+                    inserted_user_ids.add(gradebook_entry.user_id)
+                else:
+                    add_existing_entry(gradebook_entry, gradebook_values[gradebook_entry.user_id])
+        inserted_entries = [new_entry for new_entry in new_entries if new_entry.user_id in inserted_user_ids]
+        if inserted_user_ids:
+            # bulk_create skips the pre_save hook which sets the flag of new entries
+            StudentGradebook.objects.filter(course_id=course_key, user_id__in=inserted_user_ids).update(
+                is_active_enrollment=StudentGradebook.active_enrollment_expression()
+            )
+        updated_entries = inserted_entries + changed_entries
+        # copied while the entries still hold the policy text their fingerprints are computed from
+        history_entries = [
+            StudentGradebookHistory.from_gradebook(gradebook_entry) for gradebook_entry in updated_entries
+        ]
+
+        # bulk_update skips the field pre_save hooks, so policies are prepared here
+        prepared_policies = {}
+        for gradebook_entry in changed_entries + summary_changed_entries:
+            policy = gradebook_entry.grading_policy
+            if policy not in prepared_policies:
+                prepared_policies[policy] = prepare_grading_policy(policy)
+            gradebook_entry.grading_policy = prepared_policies[policy]
+        StudentGradebook.objects.bulk_update(
+            changed_entries,
+            fields=list(GRADEBOOK_VALUE_FIELDS) + ['fingerprint', 'modified'],
+            batch_size=batch_size,
+        )
+        # entries whose grades are unchanged keep their time scored
+        StudentGradebook.objects.bulk_update(
+            summary_changed_entries,
+            fields=list(GRADEBOOK_SUMMARY_FIELDS) + ['fingerprint'],
+            batch_size=batch_size,
+        )
+        StudentGradebookHistory.objects.bulk_create(history_entries, batch_size=batch_size)
+        # every entry of the batch was recalculated, changed or not
+        StudentGradebook.objects.filter(course_id=course_key, user_id__in=list(gradebook_values)).update(
+            regraded=now
+        )
+
+    updated_user_ids = [gradebook_entry.user_id for gradebook_entry in updated_entries]
+    for user_id in updated_user_ids:
+        invalid_user_data_cache('grade', course_key, user_id)
+    return updated_user_ids
+
+
+def finish_bulk_gradebook_update(course_key):
+    """
+    Refreshes the course-wide data derived from gradebook entries after bulk writes
+    """
+    StudentGradebook.invalidate_leaderboard_cutoff(course_key)
+    StudentGradebook.invalidate_percentile_histogram(course_key)
+    if StudentGradebookRank.is_enabled():
+        StudentGradebookRank.rebuild(course_key)
+    if StudentGradebookCourseAggregate.is_enabled():
+        StudentGradebookCourseAggregate.rebuild(course_key)
+
+
+def get_course_published_at(course_key):
+    """
+    Returns when the course was last published, as recorded by its CourseOverview
+    """
+    return CourseOverview.objects.filter(id=course_key).values_list('modified', flat=True).first()
+
+
+def filter_stale_users(course_key, users, since):
+    """
+    Narrows a queryset of users to those whose gradebook entry is out of date: entries last
+    regraded before `since`, entries regraded before one of the user's subsection scores, and
+    users with scores but no entry yet.  Users without scores or entry are left out.  Entries
+    never regraded since the regraded time was recorded fall back to their modified time.
+    """
+    entry_regraded = StudentGradebook.objects.filter(
+        course_id=course_key,
+        user_id=OuterRef('id'),
+    ).values(regraded_or_modified=Coalesce('regraded', 'modified'))[:1]
+    course_scores = PersistentSubsectionGrade.objects.filter(course_id=course_key, user_id=OuterRef('id'))
+    return users.annotate(
+        gradebook_regraded=Subquery(entry_regraded),
+        has_scores=Exists(course_scores),
+        has_newer_scores=Exists(course_scores.filter(modified__gt=OuterRef('gradebook_regraded'))),
+    ).filter(
+        Q(gradebook_regraded__lt=since) |
+        Q(gradebook_regraded__isnull=True, has_scores=True) |
+        Q(has_newer_scores=True)
+    )
+
+
+def iter_keyset_chunks(queryset, chunk_size):
+    """
+    Yields the rows of a queryset in lists of up to `chunk_size`, ordered by id.  Every
+    chunk is read with a query of its own, starting after the last id of the previous one,
+    so memory stays bounded by the chunk size.  Works with model instances as well as flat
+    value lists of ids.
+    """
+    last_id = 0
+    while True:
+        chunk = list(queryset.filter(id__gt=last_id).order_by('id')[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        if len(chunk) < chunk_size:
+            return
+        last_id = getattr(chunk[-1], 'id', chunk[-1])
+
+
+def _add_proforma_grades(course_context, course_grades, gradebook_values, failed_user_ids):
+    """
+    Adds the proforma grade to the gradebook values of every user, calculating them in one
+    batch.  If the batch fails, grades are calculated one by one and users whose calculation
+    fails are moved from the values to the failed user ids.  Returns the number of users
+    whose values are complete.
+    """
+    grading_policy = course_context.grading_policy
+    with instrumentation.stage('gradebook.proforma_grade_batch'):
+        try:
+            proforma_grades = dict(zip(
+                course_grades, calculate_proforma_grades(list(course_grades.values()), grading_policy)
+            ))
+        except Exception:  # pylint: disable=broad-except
+            proforma_grades = {}
+            for user_id, course_grade in course_grades.items():
+                try:
+                    proforma_grades[user_id] = calculate_proforma_grade(course_grade, grading_policy)
+                except Exception as ex:  # pylint: disable=broad-except
+                    log.info(
+                        "Failed to calculate proforma grade for user %s. Error: %s", user_id, str(ex)
+                    )
+                    del gradebook_values[user_id]
+                    failed_user_ids.append(user_id)
+
+    for user_id, proforma_grade in proforma_grades.items():
+        gradebook_values[user_id]['proforma_grade'] = proforma_grade
+    return len(proforma_grades)
+
+
+def regrade_users(course_key, user_ids, bulk=False):
+    """
+    Recalculates the gradebook entries of the given users in a course.  Returns the
+    number of users regraded and the list of user ids whose regrade failed, which
+    includes the ids of users who no longer exist.
+    In bulk mode the entries are written together with bulk_save_user_gradebooks.
+    """
+    users_regraded = 0
+    failed_user_ids = []
+    gradebook_values = {}
+    course_grades = {}
+    users = list(User.objects.filter(id__in=user_ids).order_by('id'))
+    missing_user_ids = sorted(set(user_ids) - {user.id for user in users})
+    if missing_user_ids:
+        log.info("Users %s to regrade in course %s do not exist", missing_user_ids, course_key)
+        failed_user_ids.extend(missing_user_ids)
+    if bulk:
+        for user in users:
+            try:
+                course_context, course_grades[user.id], gradebook_values[user.id] = read_user_gradebook(
+                    course_key, user
+                )
+            except Exception as ex:  # pylint: disable=broad-except
+                log.info(
+                    "Failed to update gradebook for user %s in course %s. Error: %s",
+                    user.id, course_key, str(ex)
+                )
+                failed_user_ids.append(user.id)
+    else:
+        # every save commits on its own, so the locks taken by the save signal handlers
+        # are never held across the grade reads of the rest of the chunk
+        for user in users:
+            try:
+                generate_user_gradebook(course_key, user)
+            except Exception as ex:  # pylint: disable=broad-except
+                log.info(
+                    "Failed to update gradebook for user %s in course %s. Error: %s",
+                    user.id, course_key, str(ex)
+                )
+                failed_user_ids.append(user.id)
+                continue
+            users_regraded += 1
+        log.info(
+            "%d gradebook entries updated in Course %s, %d failed",
+            users_regraded, course_key, len(failed_user_ids)
+        )
+
+    if gradebook_values:
+        users_regraded += _add_proforma_grades(course_context, course_grades, gradebook_values, failed_user_ids)
+        with instrumentation.stage('gradebook.bulk_save'):
+            updated_user_ids = bulk_save_user_gradebooks(course_key, gradebook_values)
+        log.info(
+            "%d gradebook entries written in Course %s, %d of them changed",
+            len(gradebook_values), course_key, len(updated_user_ids)
+        )
+    return users_regraded, failed_user_ids
+
+
+_edx_json_encoder = EdxJSONEncoder()
+
+
 def get_json_data(obj):
+    """
+    Returns the JSON text of a gradebook value.  Values made only of JSON types, like the
+    summaries built by make_courseware_summary, take the fast path of the default encoder;
+    anything else falls back to EdxJSONEncoder, which produces the same text.
+    """
+    try:
+        return json.dumps(obj)
+    except TypeError:
+        pass
     try:
-        json_data = json.dumps(obj, cls=EdxJSONEncoder)
-    except:
-        json_data = {}
-    return json_data
+        return json.dumps(obj, default=_edx_json_encoder.default)
+    except (TypeError, ValueError):
+        log.exception("Failed to encode gradebook data")
+        raise
+
+
+def encode_datetime(value):
+    """
+    Returns the JSON form EdxJSONEncoder gives a datetime, or None
+    """
+    return _edx_json_encoder.default(value) if value else None
 
 
 def make_courseware_summary(course_grade):
@@ -77,20 +515,21 @@ def make_courseware_summary(course_grade):
                 'location': str(sub_section.location),
                 'display_name': sub_section.display_name,
                 'url_name': sub_section.url_name,
-                'due': sub_section.due,
+                # datetimes are encoded up front so that the summary holds JSON types only
+                'due': encode_datetime(sub_section.due),
                 'graded': sub_section.graded,
                 'format': sub_section.format,
                 'section_total': [
                     sub_section.all_total.earned,
                     sub_section.all_total.possible,
                     sub_section.all_total.graded,
-                    sub_section.all_total.first_attempted,
+                    encode_datetime(sub_section.all_total.first_attempted),
                 ],
                 'graded_total': [
                     sub_section.graded_total.earned,
                     sub_section.graded_total.possible,
                     sub_section.graded_total.graded,
-                    sub_section.graded_total.first_attempted,
+                    encode_datetime(sub_section.graded_total.first_attempted),
                 ],
             })
 
@@ -157,9 +596,12 @@ def calculate_proforma_grade(course_grade, grading_policy):
             categories_to_estimate.append(category)
 
     assumed_category_average = sum(category_averages) / len(category_averages) if len(category_averages) > 0 else 0
+    # weight of the first grader of each type
+    category_weights = {}
+    for grader in grading_policy['GRADER']:
+        category_weights.setdefault(grader['type'], grader['weight'])
     for category in categories_to_estimate:
-        category_policy = next((policy for policy in grading_policy['GRADER'] if policy['type'] == category), None)
-        category_weight = category_policy['weight']
+        category_weight = category_weights[category]
         category_grade = assumed_category_average * category_weight
         proforma_grade += category_grade
     return proforma_grade
@@ -13,5 +13,6 @@ setup(
     include_package_data=True,
     install_requires=[
         "Django>=2.2,<2.3",
+        "numpy",
     ],
 )